@@ -11,4 +11,7 @@ class AgentModelForm(forms.ModelForm):
             'username',
             'first_name',
             'last_name',
-        )
\ No newline at end of file
+        )
+
+class AgentImportForm(forms.Form):
+    file = forms.FileField(help_text='CSV file with a header row: email, username, first_name, last_name')
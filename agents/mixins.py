@@ -1,5 +1,6 @@
-from django.contrib.auth.mixins import AccessMixin
+from django.contrib.auth.mixins import AccessMixin, LoginRequiredMixin
 from django.shortcuts import redirect
+from leads.models import Lead, ArchivedLead, Agent, Category
 
 
 class OrganisorAndLoginRequiredMixin(AccessMixin):
@@ -8,4 +9,45 @@ class OrganisorAndLoginRequiredMixin(AccessMixin):
     def dispatch(self, request, *args, **kwargs):
         if not request.user.is_authenticated or not request.user.is_organisor:
             return redirect ('login')
-        return super().dispatch(request, *args, **kwargs)
\ No newline at end of file
+        return super().dispatch(request, *args, **kwargs)
+
+
+class AsyncLoginRequiredMixin(LoginRequiredMixin):
+    """LoginRequiredMixin for views with async handlers, they must always return an awaitable"""
+
+    def dispatch(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return self.response_later(self.handle_no_permission())
+        return super().dispatch(request, *args, **kwargs)
+
+    async def response_later(self, response):
+        return response
+
+
+class OrganisationMixin:
+    """Scope querysets to the organisation resolved by leads.middleware.OrganisationMiddleware"""
+
+    def get_organisation(self):
+        return self.request.organisation
+
+    def get_lead_queryset(self):
+        # organisors see all leads of the organisation, agents only their own
+        queryset = Lead.objects.filter(organisation=self.request.organisation)
+        if not self.request.user.is_organisor:
+            queryset = queryset.filter(agent=self.request.agent)
+        return queryset
+
+    def get_archived_lead_queryset(self):
+        # the same scoping for the leads in the archive (leads/archive.py)
+        queryset = ArchivedLead.objects.filter(organisation=self.request.organisation)
+        if not self.request.user.is_organisor:
+            queryset = queryset.filter(agent=self.request.agent)
+        return queryset
+
+    # agents and categories that are being deleted (leads/deletion.py) are left out
+
+    def get_category_queryset(self):
+        return Category.objects.filter(organisation=self.request.organisation, deleting=False)
+
+    def get_agent_queryset(self):
+        return Agent.objects.filter(organisation=self.request.organisation, deleting=False)
\ No newline at end of file
@@ -9,4 +9,6 @@ urlpatterns = [
     path('<int:pk>/update/', views.AgentUpdateView.as_view(), name='agent-update'),
     path('<int:pk>/delete/', views.AgentDeleteView.as_view(), name='agent-delete'),
     path('create/', views.AgentCreateView.as_view(), name='agent-create'),
+    path('import/', views.AgentImportView.as_view(), name='agent-import'),
+    path('dashboard/', views.AgentDashboardView.as_view(), name='agent-dashboard'),
 ]
\ No newline at end of file
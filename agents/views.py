@@ -1,19 +1,27 @@
 from django.views import generic
+from django.contrib import messages
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.shortcuts import redirect
 from leads.models import Agent, UserProfile, User
 from django.urls import reverse_lazy
-from .forms import AgentModelForm
-from .mixins import OrganisorAndLoginRequiredMixin
-import random
+from .forms import AgentModelForm, AgentImportForm
+from .mixins import OrganisorAndLoginRequiredMixin, OrganisationMixin
+from leads.pagination import KeysetPaginationMixin
+from leads.tasks import send_agent_invitations
+from leads.onboarding import AgentOnboarding
+from leads.deletion import delete_later
+from leads.dashboard import agent_dashboard
+from leads.imports import read_rows
+import io
 
 
-class AgentListView(OrganisorAndLoginRequiredMixin, generic.ListView):
+class AgentListView(OrganisorAndLoginRequiredMixin, OrganisationMixin, KeysetPaginationMixin, generic.ListView):
     template_name = 'agents/agent_list.html'
     context_object_name = 'agents'
+    ordering = ('id',) # agents don't have date_added, the primary key is enough for a stable order
 
     def get_queryset(self):
-        request_user_organisation = self.request.user.userprofile
-        return Agent.objects.filter(organisation=request_user_organisation)
+        return self.get_agent_queryset().select_related('user')
     
 class AgentCreateView(OrganisorAndLoginRequiredMixin, generic.CreateView):
     template_name = 'agents/agent_create.html'
@@ -26,30 +34,53 @@ class AgentCreateView(OrganisorAndLoginRequiredMixin, generic.CreateView):
         user = form.save(commit=False) # Don't commit to the database yet.
         user.is_organisor = False
         user.is_agent = True
-        user.set_password(f'{random.randint(0, 1000000)}')
+        # no password hashing here: the agent gets an invitation mail and sets the password
+        user.set_unusable_password()
         user.save()
         Agent.objects.create(
             user=user,
-            organisation=self.request.user.userprofile
+            organisation=self.request.organisation
+        )
+        send_agent_invitations.enqueue(
+            user_ids=[user.id], domain=self.request.get_host(), use_https=self.request.is_secure()
         )
         return super().form_valid(form)
     
-class AgentDetailView(OrganisorAndLoginRequiredMixin, generic.DetailView):
+class AgentImportView(OrganisorAndLoginRequiredMixin, generic.FormView):
+    # Onboard many agents at once from a CSV file (see leads/onboarding.py)
+    template_name = 'agents/agent_import.html'
+    form_class = AgentImportForm
+
+    def form_valid(self, form):
+        file = io.TextIOWrapper(form.cleaned_data['file'].file, encoding='utf-8-sig', newline='')
+        onboarding = AgentOnboarding(
+            self.request.organisation, self.request.get_host(), use_https=self.request.is_secure()
+        ).run(read_rows(file, 'csv'))
+        return self.render_to_response(self.get_context_data(form=form, onboarding=onboarding))
+    
+class AgentDashboardView(OrganisorAndLoginRequiredMixin, OrganisationMixin, generic.TemplateView):
+    # open leads, categories and new leads of every agent, from one cached query (see leads/dashboard.py)
+    template_name = 'agents/agent_dashboard.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['dashboard'] = agent_dashboard(self.get_organisation())
+        return context
+    
+class AgentDetailView(OrganisorAndLoginRequiredMixin, OrganisationMixin, generic.DetailView):
     template_name = "agents/agent_detail.html"
     # context_object_name = "agent"
 
     def get_queryset(self):
-        organisation = self.request.user.userprofile
-        return Agent.objects.all()
+        return self.get_agent_queryset().select_related('user')
     
-class AgentUpdateView(OrganisorAndLoginRequiredMixin, generic.UpdateView):
+class AgentUpdateView(OrganisorAndLoginRequiredMixin, OrganisationMixin, generic.UpdateView):
     template_name = 'agents/agent_update.html'
     form_class = AgentModelForm
     success_url = reverse_lazy('agents:agent-list')
 
     def get_queryset(self):
-        organisation = self.request.user.userprofile
-        return Agent.objects.filter(organisation=organisation)
+        return self.get_agent_queryset().select_related('user')
     
     def get_object(self):
         """Instead of returning an Agent, return the related User."""
@@ -57,12 +88,17 @@ class AgentUpdateView(OrganisorAndLoginRequiredMixin, generic.UpdateView):
         return agent.user
 
 
-class AgentDeleteView(OrganisorAndLoginRequiredMixin, generic.DeleteView):
+class AgentDeleteView(OrganisorAndLoginRequiredMixin, OrganisationMixin, generic.DeleteView):
     template_name = "agents/agent_delete.html"
     model = Agent
     success_url = reverse_lazy('agents:agent-list')
     context_object_name = 'agent'
 
     def get_queryset(self):
-        organisation = self.request.user.userprofile
-        return Agent.objects.filter(organisation=organisation)
\ No newline at end of file
+        return self.get_agent_queryset().select_related('user')
+
+    def form_valid(self, form):
+        # the agent disappears now, its leads are unassigned by a background job (leads/deletion.py)
+        delete_later(self.object)
+        messages.info(self.request, f'{self.object.user.username} is being deleted.')
+        return redirect(self.success_url)
\ No newline at end of file
@@ -0,0 +1,167 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import router, transaction
+from django.db.models import DEFERRED
+from .models import Lead, LeadActivity, Agent, Category
+
+# The history of the leads (LeadActivity). Saving a lead doesn't write its history row right away:
+# the signals below collect the changes in the ActivityBuffer of the request (LeadActivityMiddleware)
+# once the transaction of the change is committed, and the buffer is written with ONE bulk_create at
+# the end of the request. Bulk updates (bulk_assign, route_unassigned, the deletion jobs) call
+# record_bulk_change() before their UPDATE: it writes their history right away, in the transaction
+# of the UPDATE, BULK_INSERT_SIZE rows per INSERT, so 'select all' doesn't keep every entry in memory.
+# Outside of a request and of collect_activity() the entries are written right away, in the
+# transaction of the change.
+
+TRACKED_FIELDS = ['first_name', 'last_name', 'age', 'agent', 'category', 'description', 'phone_number', 'email']
+TRACKED_ATTNAMES = {name: Lead._meta.get_field(name).attname for name in TRACKED_FIELDS}
+BULK_INSERT_SIZE = 1000
+
+_buffer = ContextVar('lead_activity_buffer', default=None)
+
+
+class ActivityBuffer:
+    def __init__(self, actor_id=None):
+        self.actor_id = actor_id
+        self.activities = []
+
+    def add(self, activities):
+        self.activities.extend(activities)
+
+    def flush(self):
+        if self.activities:
+            LeadActivity.objects.bulk_create(self.activities, batch_size=1000)
+            self.activities = []
+
+
+@contextmanager
+def collect_activity(actor=None, flush=True):
+    # with collect_activity(request.user): ... - the changes of the block are written at its end.
+    # Async code passes flush=False and writes the buffer itself, in a thread (no queries in async code).
+    actor_id = actor.id if actor is not None and actor.is_authenticated else None
+    buffer = ActivityBuffer(actor_id)
+    token = _buffer.set(buffer)
+    try:
+        yield buffer
+    finally:
+        _buffer.reset(token)
+        if flush:
+            buffer.flush()
+
+
+def current_actor_id():
+    buffer = _buffer.get()
+    return buffer.actor_id if buffer else None
+
+
+def add_activities(activities):
+    buffer = _buffer.get()
+    if buffer is None:
+        LeadActivity.objects.bulk_create(activities, batch_size=1000)
+    elif activities:
+        # a rolled back change never reaches the buffer
+        transaction.on_commit(lambda: buffer.add(activities), using=router.db_for_write(Lead))
+
+
+def record(lead, action, changes):
+    add_activities([LeadActivity(
+        organisation_id=lead.organisation_id, lead_id=lead.id, actor_id=current_actor_id(), action=action, changes=changes
+    )])
+
+
+def record_bulk_change(queryset, **changes):
+    """Before queryset.update(agent=...), in the same transaction
+
+    changes are the new ids, e.g. record_bulk_change(leads, agent=agent.id)
+    (works for Lead and ArchivedLead)
+    """
+    attnames = [TRACKED_ATTNAMES[name] for name in changes]
+    actor_id = current_actor_id()
+    activities = []
+    recorded = 0
+    rows = queryset.values_list('id', 'organisation_id', *attnames).iterator(chunk_size=BULK_INSERT_SIZE)
+    for lead_id, organisation_id, *old_values in rows:
+        diff = {
+            name: [old, new]
+            for (name, new), old in zip(changes.items(), old_values) if changed(old, new)
+        }
+        if diff:
+            activities.append(LeadActivity(
+                organisation_id=organisation_id, lead_id=lead_id, actor_id=actor_id, action=LeadActivity.UPDATED, changes=diff
+            ))
+        if len(activities) >= BULK_INSERT_SIZE:
+            LeadActivity.objects.bulk_create(activities)
+            recorded += len(activities)
+            activities = []
+    if activities:
+        LeadActivity.objects.bulk_create(activities)
+    return recorded + len(activities)
+
+
+def changed(old, new):
+    # a form saves an empty description as '' instead of None, that is no change
+    return old != new and not (old in (None, '') and new in (None, ''))
+
+
+def tracked_values(lead):
+    # DEFERRED for the fields that weren't loaded
+    return {name: lead.__dict__.get(attname, DEFERRED) for name, attname in TRACKED_ATTNAMES.items()}
+
+
+# Signals, connected in apps.py
+
+def lead_post_init_activity_signal(sender, instance, **kwargs):
+    instance._activity_values = tracked_values(instance)
+
+def lead_saved_activity_signal(sender, instance, created, **kwargs):
+    values = tracked_values(instance)
+    if created:
+        changes = {name: [None, value] for name, value in values.items() if value not in (None, '', DEFERRED)}
+        record(instance, LeadActivity.CREATED, changes)
+    else:
+        changes = {
+            name: [old, values[name]]
+            for name, old in instance._activity_values.items()
+            if DEFERRED not in (old, values[name]) and changed(old, values[name])
+        }
+        if changes:
+            record(instance, LeadActivity.UPDATED, changes)
+    instance._activity_values = values
+
+def lead_deleted_activity_signal(sender, instance, **kwargs):
+    record(instance, LeadActivity.DELETED, {})
+
+
+def lead_timeline(lead, limit=100):
+    """The latest entries of the history of a lead, newest first, for the history page
+
+    Every entry gets .rows: [(field label, old value, new value)], with the names of the agents
+    and categories instead of their ids (one query each, only when needed).
+    """
+    activities = list(
+        LeadActivity.objects.filter(lead_id=lead.id).select_related('actor').order_by('-date_added', '-id')[:limit]
+    )
+    ids = {'agent': set(), 'category': set()}
+    for activity in activities:
+        for name in ids:
+            ids[name].update(value for value in activity.changes.get(name, []) if value is not None)
+    names = {'agent': {}, 'category': {}}
+    if ids['agent']:
+        names['agent'] = dict(Agent.objects.filter(id__in=ids['agent']).values_list('id', 'user__username'))
+    if ids['category']:
+        names['category'] = dict(Category.objects.filter(id__in=ids['category']).values_list('id', 'name'))
+
+    def display(name, value):
+        if value is None or value == '':
+            return '-'
+        if name in names:
+            return names[name].get(value, f'#{value} (deleted)')
+        return value
+
+    for activity in activities:
+        activity.rows = [
+            (Lead._meta.get_field(name).verbose_name, display(name, old), display(name, new))
+            for name, (old, new) in activity.changes.items()
+        ]
+    return activities
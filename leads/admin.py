@@ -1,10 +1,92 @@
 from django.contrib import admin
-from .models import User, Agent, Lead, UserProfile, Category
+from django.db.models import Count
+from django.utils import timezone
+from .models import (
+    User, Agent, Lead, UserProfile, Category, CategoryLeadCount, LeadImport, LeadRouting, OrganisationShard, Job,
+    ArchivePolicy, ArchivedLead, Deletion, LeadDailyCount, LeadActivity, AgentLeadCount
+)
+from .deletion import delete_later
+from .sharding import fan_out
 
 admin.site.register(User)
 admin.site.register(Agent)
 admin.site.register(Lead)
-admin.site.register(UserProfile)
+
+
+class UserProfileAdmin(admin.ModelAdmin):
+    # The organisations of all shards with their database and lead count. The leads are counted
+    # with one grouped query per shard, all shards at the same time.
+    list_display = ('__str__', 'database', 'lead_count')
+    list_select_related = ('user', 'organisationshard')
+    actions = ['delete_in_background']
+
+    def changelist_view(self, request, extra_context=None):
+        results = fan_out(lambda database: dict(
+            Lead.objects.using(database).order_by().values('organisation').annotate(count=Count('id')).values_list('organisation', 'count')
+        ))
+        self.lead_counts = {}
+        for counts in results.values():
+            for organisation_id, count in counts.items():
+                self.lead_counts[organisation_id] = self.lead_counts.get(organisation_id, 0) + count
+        return super().changelist_view(request, extra_context)
+
+    @admin.display(description='Database')
+    def database(self, obj):
+        shard = getattr(obj, 'organisationshard', None)
+        return shard.database if shard else 'default'
+
+    @admin.display(description='Leads')
+    def lead_count(self, obj):
+        return self.lead_counts.get(obj.id, 0)
+
+    @admin.action(description='Delete the selected organisations in the background')
+    def delete_in_background(self, request, queryset):
+        for organisation in queryset.filter(deleting=False):
+            delete_later(organisation)
+
+
+admin.site.register(UserProfile, UserProfileAdmin)
 admin.site.register(Category)
+admin.site.register(CategoryLeadCount)
+admin.site.register(LeadDailyCount)
+admin.site.register(AgentLeadCount)
+admin.site.register(LeadImport)
+admin.site.register(LeadRouting)
+admin.site.register(OrganisationShard)
+admin.site.register(ArchivePolicy)
+admin.site.register(ArchivedLead)
+
+
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('name', 'status', 'attempts', 'run_at', 'duration')
+    list_filter = ('status', 'name')
+    actions = ['queue_again']
+
+    @admin.action(description='Queue the selected jobs again')
+    def queue_again(self, request, queryset):
+        queryset.exclude(status=Job.RUNNING).update(status=Job.QUEUED, attempts=0, run_at=timezone.now())
+
+
+admin.site.register(Job, JobAdmin)
+
+
+class DeletionAdmin(admin.ModelAdmin):
+    # the progress of the background deletions (leads/deletion.py)
+    list_display = ('kind', 'name', 'status', 'step', 'rows_done', 'date_added', 'date_finished')
+    list_filter = ('status', 'kind')
+
+
+admin.site.register(Deletion, DeletionAdmin)
+
+
+class LeadActivityAdmin(admin.ModelAdmin):
+    # the history is append-only (leads/activity.py)
+    list_display = ('lead_id', 'action', 'actor', 'date_added')
+    list_filter = ('action',)
+    list_select_related = ('actor',)
+
+    def has_change_permission(self, request, obj=None):
+        return False
 
 
+admin.site.register(LeadActivity, LeadActivityAdmin)
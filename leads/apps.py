@@ -1,6 +1,45 @@
 from django.apps import AppConfig
+from django.db import connections
+from django.db.models.signals import post_migrate, post_save, post_delete, post_init
+
+
+def install_search(sender, using, **kwargs):
+    connection = connections[using]
+    if connection.vendor == 'sqlite':
+        from .search import ensure_sqlite_fts
+        ensure_sqlite_fts(connection)
 
 
 class LeadsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'leads'
+
+    def ready(self):
+        post_migrate.connect(install_search, sender=self)
+
+        # keep the users and agents of sharded organisations mirrored in their shard
+        from .models import User, Agent, OrganisationShard
+        from .sharding import mirror_user_signal, mirror_agent_signal, delete_mirrored_agent_signal, directory_changed_signal
+        post_save.connect(mirror_user_signal, sender=User)
+        post_save.connect(mirror_agent_signal, sender=Agent)
+        post_delete.connect(delete_mirrored_agent_signal, sender=Agent)
+        post_save.connect(directory_changed_signal, sender=OrganisationShard)
+        post_delete.connect(directory_changed_signal, sender=OrganisationShard)
+
+        # the cached snapshot of the logged in user (leads/backends.py)
+        from django.contrib.auth.signals import user_logged_in, user_logged_out
+        from .models import UserProfile
+        from .backends import user_logged_in_signal, user_logged_out_signal, user_changed_signal, agent_changed_signal, userprofile_changed_signal
+        user_logged_in.connect(user_logged_in_signal)
+        user_logged_out.connect(user_logged_out_signal)
+        for signal in (post_save, post_delete):
+            signal.connect(user_changed_signal, sender=User)
+            signal.connect(agent_changed_signal, sender=Agent)
+            signal.connect(userprofile_changed_signal, sender=UserProfile)
+
+        # the history of the leads (leads/activity.py)
+        from .models import Lead
+        from .activity import lead_post_init_activity_signal, lead_saved_activity_signal, lead_deleted_activity_signal
+        post_init.connect(lead_post_init_activity_signal, sender=Lead)
+        post_save.connect(lead_saved_activity_signal, sender=Lead)
+        post_delete.connect(lead_deleted_activity_signal, sender=Lead)
@@ -0,0 +1,72 @@
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import router, transaction
+from django.utils import timezone
+from .cache import bump_organisation_version
+from .models import Lead, ArchivedLead, CategoryLeadCount, AgentLeadCount, delete_rows
+
+# Hot/cold storage of leads. Nearly all requests work with recent leads, so the old ones that an
+# organisation's ArchivePolicy selects are moved from leads_lead to leads_archivedlead by
+# 'py manage.py archive_leads'. The lead list, the counts and the search don't change at all, they
+# just read a smaller table with smaller indexes.
+#
+# Leads are moved in chunks, each in its own transaction (insert into the archive, delete from the
+# hot table), so the command can be stopped at any time and the next run continues where it stopped.
+
+ARCHIVE_FIELDS = [field.attname for field in ArchivedLead._meta.concrete_fields if field.name != 'date_archived']
+
+
+def archivable_leads(policy, now=None):
+    cutoff = (now or timezone.now()) - timedelta(days=policy.archive_after_days)
+    queryset = Lead.objects.filter(organisation_id=policy.organisation_id, date_added__lt=cutoff)
+    category_ids = [category.id for category in policy.categories.all()]
+    if category_ids:
+        queryset = queryset.filter(category_id__in=category_ids)
+    return queryset
+
+
+class LeadArchiver:
+
+    def __init__(self, policy, chunk_size=1000):
+        self.policy = policy
+        self.chunk_size = chunk_size
+        self.archived = 0
+        self.finished = False
+
+    def run(self, max_chunks=None):
+        queryset = archivable_leads(self.policy)
+        last_id = 0
+        chunks = 0
+        while max_chunks is None or chunks < max_chunks:
+            moved = self.archive_chunk(queryset.filter(id__gt=last_id))
+            if not moved:
+                self.finished = True
+                break
+            last_id = moved[-1]
+            chunks += 1
+        return self
+
+    def archive_chunk(self, queryset):
+        # Moves the next chunk_size leads of the queryset, returns their ids
+        now = timezone.now()
+        with transaction.atomic(using=router.db_for_write(Lead)):
+            # locked on PostgreSQL, so a lead that is edited right now is not copied half changed
+            rows = list(queryset.select_for_update().order_by('id').values(*ARCHIVE_FIELDS)[:self.chunk_size])
+            if not rows:
+                return []
+            ArchivedLead.objects.bulk_create([ArchivedLead(date_archived=now, **row) for row in rows])
+            ids = [row['id'] for row in rows]
+            # a DELETE without loading the leads and without their post_delete signals (no 'deleted'
+            # history, the rollup keeps counting archived leads), the counters and the cached
+            # fragments are updated once for the whole chunk below
+            delete_rows(Lead, ids, router.db_for_write(Lead))
+            if settings.LEADS_USE_CATEGORY_COUNTERS:
+                for category_id, count in Counter(row['category_id'] for row in rows).items():
+                    CategoryLeadCount.adjust(self.policy.organisation_id, category_id, -count)
+                for (agent_id, category_id), count in Counter((row['agent_id'], row['category_id']) for row in rows).items():
+                    AgentLeadCount.adjust(self.policy.organisation_id, agent_id, category_id, -count)
+        bump_organisation_version(self.policy.organisation_id)
+        self.archived += len(ids)
+        return ids
@@ -0,0 +1,37 @@
+from django.db import transaction
+from django.utils import timezone
+from .models import Lead
+from .cache import bump_organisation_version
+from .rollup import move_leads
+from .activity import record_bulk_change
+
+ASSIGN_BATCH_SIZE = 5000 # ids per UPDATE, keeps the IN (...) list below the database parameter limits
+
+
+def bulk_assign(organisation, agent, lead_ids=None, select_all=False, category=None):
+    # Returns the number of leads that were assigned. The organisation filter is part of the
+    # UPDATE itself, so ids of other organisations are simply not changed (no extra query to check them):
+    # UPDATE leads_lead SET agent_id = ... WHERE organisation_id = ... AND id IN (...)
+    queryset = Lead.objects.filter(organisation=organisation)
+    if select_all:
+        queryset = queryset.filter(agent__isnull=True)
+        if category:
+            queryset = queryset.filter(category=category)
+        with transaction.atomic():
+            move_leads(queryset, agent=agent.id)
+            record_bulk_change(queryset, agent=agent.id)
+            updated = queryset.update(agent=agent, updated_at=timezone.now())
+        bump_organisation_version(organisation.id)
+        return updated
+
+    updated = 0
+    with transaction.atomic():
+        for start in range(0, len(lead_ids), ASSIGN_BATCH_SIZE):
+            batch = lead_ids[start:start + ASSIGN_BATCH_SIZE]
+            # the daily rollup needs the old agents of the leads, one grouped query
+            move_leads(queryset.filter(id__in=batch), agent=agent.id)
+            record_bulk_change(queryset.filter(id__in=batch), agent=agent.id) # the history, in the same transaction
+            updated += queryset.filter(id__in=batch).update(agent=agent, updated_at=timezone.now())
+    # .update() sends no signals, so we drop the cached lead lists ourselves
+    bump_organisation_version(organisation.id)
+    return updated
@@ -0,0 +1,69 @@
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+from .models import User, Agent
+
+# The logged in user is loaded on every request. We keep a snapshot of it (the user with its
+# profile, agent and organisation, pickled) in the cache, so with a cached session
+# (SESSION_ENGINE cached_db) a request needs no queries before the view runs.
+# The signals at the bottom (connected in apps.py) drop the snapshot when one of the rows changes.
+# Changes made with queryset.update() don't send signals, they are seen after LEADS_USER_CACHE_TIMEOUT.
+
+USER_CACHE_KEY = 'auth-user:{}'
+
+
+def load_user(user_id):
+    return User.objects.select_related(
+        'userprofile',
+        'agent__organisation'
+    ).get(pk=user_id)
+
+
+def cache_user(user):
+    cache.set(USER_CACHE_KEY.format(user.pk), user, timeout=settings.LEADS_USER_CACHE_TIMEOUT)
+
+
+def forget_users(user_ids):
+    cache.delete_many([USER_CACHE_KEY.format(user_id) for user_id in user_ids])
+
+
+class OrganisationModelBackend(ModelBackend):
+    """Load the user together with the profile, agent and organisation in one joined query,
+    or from the cached snapshot"""
+
+    def get_user(self, user_id):
+        user = cache.get(USER_CACHE_KEY.format(user_id))
+        if user is None:
+            try:
+                user = load_user(user_id)
+            except User.DoesNotExist:
+                return None
+            cache_user(user)
+        return user if self.user_can_authenticate(user) else None
+
+
+def user_logged_in_signal(sender, request, user, **kwargs):
+    # write-through: the next request finds the snapshot already in the cache
+    cache_user(load_user(user.pk))
+
+
+def user_logged_out_signal(sender, request, user, **kwargs):
+    if user is not None:
+        forget_users([user.pk])
+
+
+def user_changed_signal(sender, instance, update_fields=None, **kwargs):
+    # login saves last_login, the snapshot doesn't need it
+    if update_fields == frozenset(['last_login']):
+        return
+    forget_users([instance.pk])
+
+
+def agent_changed_signal(sender, instance, **kwargs):
+    forget_users([instance.user_id])
+
+
+def userprofile_changed_signal(sender, instance, **kwargs):
+    # the profile is the organisation of all its agents, their snapshots contain it
+    user_ids = list(Agent.objects.filter(organisation_id=instance.pk).values_list('user_id', flat=True))
+    forget_users([instance.user_id] + user_ids)
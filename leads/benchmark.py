@@ -0,0 +1,135 @@
+import asyncio
+import statistics
+import time
+import tracemalloc
+from contextlib import ExitStack
+
+from django.db import connections
+from django.test import Client, AsyncClient
+from django.urls import reverse
+from agents import urls as agents_urls
+from . import urls as leads_urls
+from .middleware import QueryStats
+
+
+def named_routes():
+    # ('leads:lead-list', ''), ('leads:lead-detail', '<int:pk>/'), ...
+    for urls in (leads_urls, agents_urls):
+        for pattern in urls.urlpatterns:
+            if pattern.name:
+                yield f'{urls.app_name}:{pattern.name}', str(pattern.pattern)
+
+
+def route_url(name, pattern, lead, category, agent):
+    if '<int:pk>' not in pattern:
+        return reverse(name)
+    if name.startswith('agents:'):
+        obj = agent
+    elif name.startswith('leads:category-'):
+        obj = category
+    else:
+        obj = lead
+    return reverse(name, args=[obj.pk])
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    index = min(len(values) - 1, round(percent / 100 * (len(values) - 1)))
+    return values[index]
+
+
+def fetch(client, url):
+    response = client.get(url)
+    if response.streaming:
+        for chunk in response.streaming_content:
+            pass
+    return response
+
+
+def measure(client, url, iterations):
+    # One request before measuring, so caches and connections are warm
+    fetch(client, url)
+    # The timed pass runs without tracemalloc and without the query counting, both slow down
+    # every allocation or query
+    durations = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        response = fetch(client, url)
+        durations.append(time.perf_counter() - start)
+    # A separate pass for the queries and the peak memory
+    queries = []
+    peaks = []
+    for i in range(iterations):
+        stats = QueryStats()
+        with ExitStack() as stack:
+            # every database, like QueryCountMiddleware: replicas and shards answer queries too
+            for database in connections.all():
+                stack.enter_context(database.execute_wrapper(stats))
+            tracemalloc.start()
+            try:
+                fetch(client, url)
+                peaks.append(tracemalloc.get_traced_memory()[1])
+            finally:
+                tracemalloc.stop()
+        queries.append(stats.count)
+    return {
+        'status': response.status_code,
+        'p50_ms': round(statistics.median(durations) * 1000, 2),
+        'p95_ms': round(percentile(durations, 95) * 1000, 2),
+        'queries': max(queries),
+        'peak_memory_kb': round(max(peaks) / 1024, 1),
+    }
+
+
+def run_benchmark(users, lead, category, agent, iterations=20):
+    # users: {'organisor': <User>, 'agent': <User>} -> {route: {role: results}}
+    results = {}
+    for role, user in users.items():
+        client = Client()
+        client.force_login(user)
+        for name, pattern in named_routes():
+            url = route_url(name, pattern, lead, category, agent)
+            results.setdefault(name, {})[role] = measure(client, url, iterations)
+    return results
+
+
+# The pages that have an async version (settings.LEADS_ASYNC_VIEWS)
+ASYNC_ROUTES = ('leads:lead-list', 'leads:lead-detail', 'leads:category-list', 'leads:category-detail')
+
+
+async def measure_concurrent(client, url, requests, concurrency):
+    # Sends `requests` requests through the ASGI request path, `concurrency` of them at the same time
+    durations = []
+    statuses = set()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one_request():
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.get(url)
+            durations.append(time.perf_counter() - start)
+            statuses.add(response.status_code)
+
+    await client.get(url) # warm up
+    start = time.perf_counter()
+    await asyncio.gather(*(one_request() for i in range(requests)))
+    total = time.perf_counter() - start
+    return {
+        'status': sorted(statuses),
+        'requests_per_second': round(requests / total, 1),
+        'p50_ms': round(statistics.median(durations) * 1000, 2),
+        'p95_ms': round(percentile(durations, 95) * 1000, 2),
+    }
+
+
+def run_asgi_benchmark(users, lead, category, requests=200, concurrency=50):
+    # users: {'organisor': <User>, 'agent': <User>} -> {route: {role: results}}
+    routes = dict(named_routes())
+    results = {}
+    for role, user in users.items():
+        client = AsyncClient()
+        client.force_login(user)
+        for name in ASYNC_ROUTES:
+            url = route_url(name, routes[name], lead, category, None)
+            results.setdefault(name, {})[role] = asyncio.run(measure_concurrent(client, url, requests, concurrency))
+    return results
@@ -0,0 +1,98 @@
+import time
+
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.db import transaction
+
+# Every organisation has a version number in the cache. It is part of the key of every cached
+# fragment of the organisation, so bumping it (on any change of a lead, agent or category, see
+# the signals in models.py) makes all old fragments unreachable. They expire on their own.
+# With a shared cache (CACHE_URL) the versions and fragments are the same for every worker.
+
+VERSION_KEY = 'organisation-version:{}'
+MODIFIED_KEY = 'organisation-modified:{}' # time of the last bump, for Last-Modified headers
+HITS_KEY = 'fragment-cache:hits'
+MISSES_KEY = 'fragment-cache:misses'
+
+
+def _new_version():
+    # A new version starts from the clock, not from 1, so an evicted version can't bring back
+    # fragments that were cached under an old number
+    return int(time.time() * 1000)
+
+
+def organisation_version(organisation_id):
+    key = VERSION_KEY.format(organisation_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _new_version(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def organisation_last_modified(organisation_id):
+    key = MODIFIED_KEY.format(organisation_id)
+    modified = cache.get(key)
+    if modified is None:
+        # we don't know when it changed, so it changed now
+        cache.add(key, time.time(), timeout=None)
+        modified = cache.get(key)
+    return modified
+
+
+def _bump(organisation_id):
+    key = VERSION_KEY.format(organisation_id)
+    try:
+        cache.incr(key)
+    except ValueError: # not in the cache (yet or anymore)
+        cache.set(key, _new_version(), timeout=None)
+    cache.set(MODIFIED_KEY.format(organisation_id), time.time(), timeout=None)
+
+
+def bump_organisation_version(organisation_id):
+    if organisation_id is None:
+        return
+    _bump(organisation_id)
+    # A request that rendered between our bump and the commit may have cached the old data
+    # under the new version, so we bump again once the change is visible to everyone
+    transaction.on_commit(lambda: _bump(organisation_id))
+
+
+def fragment_key(name, organisation_id, vary_on=None):
+    version = organisation_version(organisation_id)
+    return make_template_fragment_key(f'{name}:{organisation_id}:{version}', vary_on)
+
+
+def has_fragment(name, organisation_id, vary_on=None):
+    return cache.has_key(fragment_key(name, organisation_id, vary_on))
+
+
+def _count(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
+
+
+def count_hit():
+    _count(HITS_KEY)
+
+
+def count_miss():
+    _count(MISSES_KEY)
+
+
+def fragment_cache_stats():
+    hits = cache.get(HITS_KEY, 0)
+    misses = cache.get(MISSES_KEY, 0)
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': hits / total if total else 0,
+    }
+
+
+def reset_fragment_cache_stats():
+    cache.delete_many([HITS_KEY, MISSES_KEY])
@@ -0,0 +1,85 @@
+import hashlib
+import math
+
+from asgiref.sync import sync_to_async
+from django.contrib.messages import get_messages
+from django.middleware.csrf import get_token
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from .cache import organisation_version, organisation_last_modified
+
+# Conditional GET for pages that are refreshed all the time. The ETag is built from the
+# organisation version (leads/cache.py), which is bumped whenever a lead, agent or category of the
+# organisation changes, so an unchanged page is answered with 304 Not Modified straight from the
+# cache: no queries, no rendering. The version is per organisation, so any change in the
+# organisation makes the browsers load the list pages again. A page that shows one object
+# overrides get_version() and get_last_modified() with the version of that object (one query),
+# so changes of the other leads don't reload it.
+
+
+class ConditionalGetMixin:
+    """Answer GET requests with 304 when the organisation didn't change since the page was loaded"""
+
+    def get_etag_parts(self):
+        request = self.request
+        # The page is different for every user, and its forms contain the CSRF token
+        return [
+            request.resolver_match.view_name if request.resolver_match else request.path,
+            request.user.pk,
+            self.get_csrf_secret(),
+        ]
+
+    def get_csrf_secret(self):
+        # get_token() makes sure the request has a secret (a new one is sent with the response,
+        # 304 or not), so the first page and its revalidation use the same one
+        get_token(self.request)
+        return self.request.META['CSRF_COOKIE']
+
+    def get_version(self):
+        return organisation_version(self.request.organisation.id)
+
+    def get_etag(self):
+        parts = [self.get_version()] + self.get_etag_parts()
+        return quote_etag(hashlib.md5(repr(parts).encode()).hexdigest())
+
+    def get_last_modified(self):
+        return math.ceil(organisation_last_modified(self.request.organisation.id))
+
+    def is_conditional(self, request):
+        # base.html shows the messages, a page with new messages has to be rendered
+        return (
+            request.method in ('GET', 'HEAD')
+            and request.organisation is not None
+            and not len(get_messages(request))
+        )
+
+    def dispatch(self, request, *args, **kwargs):
+        if not self.is_conditional(request):
+            return super().dispatch(request, *args, **kwargs)
+        if self.view_is_async:
+            return self.adispatch(request, *args, **kwargs)
+        etag = self.get_etag()
+        last_modified = self.get_last_modified()
+        not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            return not_modified
+        response = super().dispatch(request, *args, **kwargs)
+        return self.add_validators(response, etag, last_modified)
+
+    async def adispatch(self, request, *args, **kwargs):
+        # get_version() may run a query, which async code runs in a thread
+        etag = await sync_to_async(self.get_etag)()
+        last_modified = await sync_to_async(self.get_last_modified)()
+        not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            return not_modified
+        response = await super().dispatch(request, *args, **kwargs)
+        return self.add_validators(response, etag, last_modified)
+
+    def add_validators(self, response, etag, last_modified):
+        if response.status_code == 200:
+            response['ETag'] = etag
+            response['Last-Modified'] = http_date(last_modified)
+            # the browser keeps the page, but has to ask us before it shows it again
+            patch_cache_control(response, private=True, no_cache=True)
+        return response
@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.db.models import Count
+from .models import Lead, CategoryLeadCount
+
+
+def _count_rows(organisation):
+    if settings.LEADS_USE_CATEGORY_COUNTERS:
+        return CategoryLeadCount.objects.filter(organisation=organisation).values_list('category_id', 'count')
+    # SELECT category_id, COUNT(id) FROM leads_lead WHERE organisation_id = ... GROUP BY category_id
+    return Lead.objects.filter(
+        organisation=organisation
+    ).order_by().values('category').annotate(count=Count('id')).values_list('category', 'count')
+
+
+def category_lead_counts(organisation):
+    # Returns {category_id: count} for every category of the organisation in ONE query.
+    # The key None is the 'Unassigned' bucket (leads without a category).
+    return dict(_count_rows(organisation))
+
+
+async def acategory_lead_counts(organisation):
+    return {category_id: count async for category_id, count in _count_rows(organisation)}
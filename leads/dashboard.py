@@ -0,0 +1,87 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import router
+from django.db.models import Count, Q
+from django.utils import timezone
+from .cache import organisation_version
+from .models import Lead, Agent
+from .routing import CLOSED_CATEGORY_NAMES
+
+# The agent dashboard: per agent the leads of every category, the open leads, the leads added in
+# the last 7 and 30 days and the conversion rate. The whole table comes from ONE grouped query
+# (agents LEFT JOIN leads, GROUP BY agent and category, the date windows with COUNT(...) FILTER),
+# so it costs the same for 3 or 300 agents. It is cached under the version of the organisation
+# (leads/cache.py), which the signals bump on every change of a lead, agent or category, and for
+# at most LEADS_DASHBOARD_CACHE_TIMEOUT seconds, because the 7 and 30 day windows move on their own.
+
+DASHBOARD_CACHE_KEY = 'agent-dashboard:{}:{}'
+
+
+def agent_workload_rows(organisation):
+    now = timezone.now()
+    # the agents are read from the database of the leads (their copy in the shard of the organisation)
+    return Agent.objects.using(router.db_for_read(Lead)).filter(
+        organisation_id=organisation.id,
+        deleting=False
+    ).values(
+        'id', 'user__username', 'lead__category', 'lead__category__name'
+    ).annotate(
+        count=Count('lead'),
+        last_7_days=Count('lead', filter=Q(lead__date_added__gte=now - timedelta(days=7))),
+        last_30_days=Count('lead', filter=Q(lead__date_added__gte=now - timedelta(days=30))),
+    ).order_by('user__username', 'id')
+
+
+def build_dashboard(rows):
+    # One row per (agent, category) -> one row per agent with a count for every category column
+    categories = {}
+    agents = {}
+    for row in rows:
+        agent = agents.setdefault(row['id'], {
+            'id': row['id'],
+            'username': row['user__username'],
+            'counts': {},
+            'total': 0,
+            'open': 0,
+            'last_7_days': 0,
+            'last_30_days': 0,
+            'converted': 0,
+            'unconverted': 0,
+        })
+        if not row['count']:
+            continue # an agent without leads
+        name = row['lead__category__name'] or 'No category'
+        categories[row['lead__category']] = name
+        agent['counts'][row['lead__category']] = row['count']
+        agent['total'] += row['count']
+        agent['last_7_days'] += row['last_7_days']
+        agent['last_30_days'] += row['last_30_days']
+        if name not in CLOSED_CATEGORY_NAMES:
+            agent['open'] += row['count']
+        elif name == 'Converted':
+            agent['converted'] += row['count']
+        else:
+            agent['unconverted'] += row['count']
+
+    # the categories by name, 'No category' last
+    columns = sorted(categories.items(), key=lambda item: (item[0] is None, item[1]))
+    for agent in agents.values():
+        counts = agent.pop('counts')
+        agent['category_counts'] = [counts.get(category_id, 0) for category_id, name in columns]
+        closed = agent['converted'] + agent['unconverted']
+        agent['conversion_rate'] = agent['converted'] / closed if closed else None
+    return {
+        'categories': [name for category_id, name in columns],
+        'agents': list(agents.values()),
+    }
+
+
+def agent_dashboard(organisation):
+    key = DASHBOARD_CACHE_KEY.format(organisation.id, organisation_version(organisation.id))
+    dashboard = cache.get(key)
+    if dashboard is None:
+        dashboard = build_dashboard(agent_workload_rows(organisation))
+        cache.set(key, dashboard, timeout=settings.LEADS_DASHBOARD_CACHE_TIMEOUT)
+    return dashboard
@@ -0,0 +1,221 @@
+from abc import ABC, abstractmethod
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils import timezone
+from .backends import forget_users
+from .cache import bump_organisation_version
+from .jobs import job
+from .activity import record_bulk_change
+from .rollup import move_leads
+from .models import User, UserProfile, Agent, Lead, ArchivedLead, Category, CategoryLeadCount, LeadRouting, Deletion, delete_rows
+from .sharding import TENANT_MODELS, tenant_rows, writable_shard, use_shard
+
+# Deleting an agent, a category or a whole organisation touches every one of its leads
+# (on_delete=SET_NULL / CASCADE). Done in the request that would be one long transaction that
+# locks all those rows. Instead delete_later() marks the object (deleting=True, the views and forms
+# leave it out from then on) and queues run_deletion. The job empties the dependent rows in batches
+# of LEADS_DELETION_BATCH_SIZE, each in its own short transaction, and deletes the object itself
+# once nothing points to it anymore. The Deletion row shows the progress (in the admin).
+
+
+def delete_later(obj):
+    """Mark an Agent, Category or UserProfile as deleting and queue the job that deletes it"""
+    if isinstance(obj, Agent):
+        kind, organisation_id, user_ids = Deletion.AGENT, obj.organisation_id, [obj.user_id]
+    elif isinstance(obj, Category):
+        kind, organisation_id, user_ids = Deletion.CATEGORY, obj.organisation_id, []
+    elif isinstance(obj, UserProfile):
+        kind, organisation_id = Deletion.ORGANISATION, obj.id
+        user_ids = [obj.user_id] + list(Agent.objects.filter(organisation=obj).values_list('user_id', flat=True))
+    else:
+        raise TypeError(f'{type(obj).__name__} objects are not deleted in the background')
+
+    # a deleted agent, or anybody of a deleted organisation, can't log in anymore
+    if user_ids:
+        User.objects.filter(id__in=user_ids).update(is_active=False)
+        forget_users(user_ids)
+    obj.deleting = True
+    obj.save(update_fields=['deleting']) # the post_save signals drop the cached fragments and users
+    bump_organisation_version(organisation_id)
+
+    with transaction.atomic(using=DEFAULT_DB_ALIAS):
+        deletion = Deletion.objects.using(DEFAULT_DB_ALIAS).create(
+            kind=kind, object_id=obj.pk, organisation_id=organisation_id, name=str(obj)
+        )
+        run_deletion.enqueue(deletion_id=deletion.id, organisation_id=organisation_id)
+    return deletion
+
+
+@job
+def run_deletion(deletion_id, organisation_id=None):
+    # organisation_id in the payload: move_tenant waits for the running jobs of the organisation
+    deletion = Deletion.objects.using(DEFAULT_DB_ALIAS).get(id=deletion_id)
+    if deletion.status == Deletion.DONE:
+        return
+    database = writable_shard(deletion.organisation_id)
+    with use_shard(database):
+        cascade = CASCADES[deletion.kind](deletion, database)
+        finished = cascade.run(settings.LEADS_DELETION_BATCH_SIZE, settings.LEADS_DELETION_BATCHES_PER_JOB)
+    if not finished:
+        # a big organisation takes many jobs, the other jobs in the queue get their turn in between
+        run_deletion.enqueue(deletion_id=deletion_id, organisation_id=deletion.organisation_id)
+
+
+class Cascade(ABC):
+    """The steps that empty the dependent rows of one Deletion, then the delete of the object.
+
+    A step handles one batch per call and returns the number of rows it changed, 0 when it is
+    done. Finished steps only cost one empty query, so every job simply starts with the first step.
+    """
+
+    def __init__(self, deletion, database):
+        self.deletion = deletion
+        self.database = database # the shard of the organisation
+
+    @abstractmethod
+    def steps(self):
+        """[(name, step)], step(batch_size) returns the number of rows it changed"""
+
+    @abstractmethod
+    def delete_object(self):
+        """Delete the object itself, once nothing points to it anymore"""
+
+    def run(self, batch_size, max_batches):
+        # True when the object is deleted, False when max_batches were used up
+        batches = 0
+        for name, step in self.steps():
+            if self.deletion.step != name:
+                self.deletion.step = name
+                self.deletion.save(update_fields=['step'])
+            while True:
+                if batches >= max_batches:
+                    return False
+                count = step(batch_size)
+                if not count:
+                    break
+                batches += 1 # the empty calls of finished steps don't count
+                self.deletion.rows_done += count
+                self.deletion.save(update_fields=['rows_done'])
+        self.delete_object()
+        self.deletion.status = Deletion.DONE
+        self.deletion.step = ''
+        self.deletion.date_finished = timezone.now()
+        self.deletion.save(update_fields=['status', 'step', 'date_finished'])
+        return True
+
+    def update_batch(self, queryset, batch_size, **values):
+        # UPDATE ... WHERE id IN (the next batch_size ids), returns the ids
+        with transaction.atomic(using=self.database):
+            ids = list(queryset.values_list('id', flat=True)[:batch_size])
+            if ids:
+                batch = queryset.model._base_manager.using(self.database).filter(id__in=ids)
+                move_leads(batch, **values) # the daily rollup follows the leads to agent or category None
+                record_bulk_change(batch, **values)
+                if queryset.model is Lead:
+                    batch.update(updated_at=timezone.now(), **values)
+                else:
+                    batch.update(**values)
+        return ids
+
+
+class AgentCascade(Cascade):
+
+    def steps(self):
+        agent_id = self.deletion.object_id
+        return [
+            ('leads', lambda batch_size: self.unassign(Lead.objects.filter(agent_id=agent_id), batch_size)),
+            ('archived leads', lambda batch_size: self.unassign(ArchivedLead.objects.filter(agent_id=agent_id), batch_size)),
+            ('routing', self.remove_from_routing),
+        ]
+
+    def unassign(self, queryset, batch_size):
+        ids = self.update_batch(queryset, batch_size, agent=None)
+        if ids:
+            bump_organisation_version(self.deletion.organisation_id)
+        return len(ids)
+
+    def remove_from_routing(self, batch_size):
+        # a handful of rows, one go
+        agent_id = self.deletion.object_id
+        with transaction.atomic(using=self.database):
+            removed = Category.routing_agents.through.objects.filter(agent_id=agent_id).delete()[0]
+            removed += LeadRouting.objects.filter(last_agent_id=agent_id).update(last_agent=None)
+        return removed
+
+    def delete_object(self):
+        # the signals remove the copy in the shard of the organisation as well
+        Agent.objects.using(DEFAULT_DB_ALIAS).filter(id=self.deletion.object_id).delete()
+
+
+class CategoryCascade(Cascade):
+
+    def steps(self):
+        category_id = self.deletion.object_id
+        return [
+            ('leads', lambda batch_size: self.uncategorise(Lead.objects.filter(category_id=category_id), batch_size)),
+            ('archived leads', lambda batch_size: len(self.update_batch(
+                ArchivedLead.objects.filter(category_id=category_id), batch_size, category=None
+            ))),
+        ]
+
+    def uncategorise(self, queryset, batch_size):
+        organisation_id = self.deletion.organisation_id
+        with transaction.atomic(using=self.database):
+            ids = self.update_batch(queryset, batch_size, category=None)
+            if ids and settings.LEADS_USE_CATEGORY_COUNTERS:
+                # the leads move to the 'Unassigned' bucket
+                CategoryLeadCount.adjust(organisation_id, self.deletion.object_id, -len(ids))
+                CategoryLeadCount.adjust(organisation_id, None, len(ids))
+        if ids:
+            bump_organisation_version(organisation_id)
+        return len(ids)
+
+    def delete_object(self):
+        Category.objects.filter(id=self.deletion.object_id).delete()
+
+
+class OrganisationCascade(Cascade):
+
+    def steps(self):
+        # the tenant tables in reverse order, so no deleted row is still pointed to. Nothing
+        # references the rows of a table once the tables after it are empty, so the batches are
+        # deleted with a plain DELETE, without loading them and without signals.
+        steps = [
+            (str(model._meta.verbose_name_plural), lambda batch_size, model=model: self.delete_batch(model, batch_size))
+            for model in reversed(TENANT_MODELS)
+        ]
+        return steps + [('agents', self.delete_agents)]
+
+    def delete_batch(self, model, batch_size):
+        with transaction.atomic(using=self.database):
+            rows = tenant_rows(model, self.deletion.organisation_id, self.database)
+            pks = list(rows.values_list('pk', flat=True)[:batch_size])
+            if pks:
+                delete_rows(model, pks, self.database)
+        return len(pks)
+
+    def delete_agents(self, batch_size):
+        # with delete(), the signals also remove the agents from the shard and the user cache
+        agents = Agent.objects.using(DEFAULT_DB_ALIAS).filter(organisation_id=self.deletion.organisation_id)
+        with transaction.atomic(using=DEFAULT_DB_ALIAS):
+            ids = list(agents.values_list('id', flat=True)[:batch_size])
+            if ids:
+                Agent.objects.using(DEFAULT_DB_ALIAS).filter(id__in=ids).delete()
+        return len(ids)
+
+    def delete_object(self):
+        if self.database != DEFAULT_DB_ALIAS:
+            # the mirrored profile, plain DELETEs: the collector would also look at the tables that only exist in 'default'
+            organisation_id = self.deletion.organisation_id
+            agent_ids = list(Agent._base_manager.using(self.database).filter(organisation_id=organisation_id).values_list('id', flat=True))
+            delete_rows(Agent, agent_ids, self.database)
+            delete_rows(UserProfile, [organisation_id], self.database)
+        UserProfile.objects.using(DEFAULT_DB_ALIAS).filter(id=self.deletion.organisation_id).delete()
+
+
+CASCADES = {
+    Deletion.AGENT: AgentCascade,
+    Deletion.CATEGORY: CategoryCascade,
+    Deletion.ORGANISATION: OrganisationCascade,
+}
@@ -0,0 +1,94 @@
+import re
+
+from django.conf import settings
+from django.db.models import Q
+
+# Duplicate leads are found through normalized copies of the email and the phone number
+# (Lead.email_normalized, Lead.phone_normalized), indexed together with the organisation.
+# A lookup is an index search instead of an iexact scan over every lead.
+
+
+def normalize_email(email):
+    return (email or '').strip().lower()
+
+
+def normalize_phone(phone):
+    # E.164 style: '+' and the digits. National numbers (one leading 0) get
+    # settings.LEADS_PHONE_COUNTRY_CODE when it is set, '00' is the international prefix.
+    phone = (phone or '').strip()
+    digits = re.sub(r'\D', '', phone)
+    if not digits:
+        return ''
+    if phone.startswith('+'):
+        return '+' + digits
+    if digits.startswith('00'):
+        return '+' + digits[2:]
+    country_code = settings.LEADS_PHONE_COUNTRY_CODE
+    if country_code and digits.startswith('0'):
+        return f'+{country_code}{digits[1:]}'
+    return digits
+
+
+def duplicate_keys(email_normalized, phone_normalized):
+    # The blocking keys: two leads that share one of them are duplicates
+    keys = []
+    if email_normalized:
+        keys.append(('email', email_normalized))
+    if phone_normalized:
+        keys.append(('phone', phone_normalized))
+    return keys
+
+
+def find_duplicates(queryset, email, phone):
+    # Leads of the queryset with the same (normalized) email or phone number
+    query = Q()
+    for field, value in duplicate_keys(normalize_email(email), normalize_phone(phone)):
+        query |= Q(**{f'{field}_normalized': value})
+    if not query:
+        return queryset.none()
+    return queryset.filter(query)
+
+
+class DuplicateClusters:
+    """Group leads that share a blocking key, in one pass over the leads.
+
+    Every key remembers the first lead it was seen on. A lead with a key that was seen before
+    joins the cluster of that lead (union-find), so the work grows with the number of leads,
+    not with the number of pairs. Add the leads in id order, the oldest lead is the root.
+    """
+
+    def __init__(self):
+        self.key_owners = {} # key -> id of the first lead with it
+        self.parents = {} # lead id -> parent lead id, only for leads in a cluster
+        self.keys = {} # root lead id -> keys that joined the cluster
+
+    def find(self, lead_id):
+        root = lead_id
+        while self.parents.get(root, root) != root:
+            root = self.parents[root]
+        # path compression: point everything on the way straight to the root
+        while lead_id != root:
+            self.parents[lead_id], lead_id = root, self.parents[lead_id]
+        return root
+
+    def add(self, lead_id, keys):
+        for key in keys:
+            owner = self.key_owners.setdefault(key, lead_id)
+            if owner == lead_id:
+                continue
+            root, other = sorted([self.find(owner), self.find(lead_id)])
+            self.parents.setdefault(root, root)
+            self.keys.setdefault(root, set()).add(key)
+            if other != root:
+                self.parents[other] = root
+                self.keys[root] |= self.keys.pop(other, set())
+
+    def clusters(self):
+        # [(oldest lead id, [other lead ids], keys), ...]
+        members = {}
+        for lead_id in self.parents:
+            members.setdefault(self.find(lead_id), []).append(lead_id)
+        return [
+            (root, sorted(lead_id for lead_id in lead_ids if lead_id != root), sorted(self.keys.get(root, ())))
+            for root, lead_ids in sorted(members.items())
+        ]
@@ -0,0 +1,72 @@
+import csv
+import datetime
+import heapq
+import json
+
+from django import forms
+from django.utils import timezone
+
+# Column name in the file -> lookup used in .values_list()
+EXPORT_COLUMNS = {
+    'id': 'id',
+    'first_name': 'first_name',
+    'last_name': 'last_name',
+    'age': 'age',
+    'email': 'email',
+    'phone_number': 'phone_number',
+    'description': 'description',
+    'category': 'category__name',
+    'agent': 'agent__user__username',
+    'date_added': 'date_added',
+}
+
+
+class LeadExportFilterForm(forms.Form):
+    format = forms.ChoiceField(choices=[('csv', 'CSV'), ('jsonl', 'JSONL')], required=False)
+    category = forms.IntegerField(required=False)
+    agent = forms.IntegerField(required=False)
+    date_from = forms.DateField(required=False)
+    date_to = forms.DateField(required=False)
+    archived = forms.BooleanField(required=False) # also the leads in the archive (leads/archive.py)
+
+
+def start_of_day(date):
+    return timezone.make_aware(datetime.datetime.combine(date, datetime.time.min))
+
+
+def filter_leads(queryset, category=None, agent=None, date_from=None, date_to=None, **kwargs):
+    if category:
+        queryset = queryset.filter(category_id=category)
+    if agent:
+        queryset = queryset.filter(agent_id=agent)
+    # date ranges are compared with datetimes (not date_added__date) so the index can be used
+    if date_from:
+        queryset = queryset.filter(date_added__gte=start_of_day(date_from))
+    if date_to:
+        queryset = queryset.filter(date_added__lt=start_of_day(date_to + datetime.timedelta(days=1)))
+    return queryset
+
+
+class Echo:
+    # csv.writer wants a file, this one just gives the written line back
+    def write(self, value):
+        return value
+
+
+def export_rows(queryset, file_format='csv', chunk_size=2000, archived=None):
+    # Generator of text lines. values_list() skips building model instances and .iterator()
+    # reads the rows in chunks from a server-side cursor, so memory stays the same for any size.
+    columns = list(EXPORT_COLUMNS)
+    rows = queryset.order_by('id').values_list(*EXPORT_COLUMNS.values()).iterator(chunk_size=chunk_size)
+    if archived is not None:
+        # archived leads kept their id, both tables are read in id order and merged (id is the first column)
+        archived_rows = archived.order_by('id').values_list(*EXPORT_COLUMNS.values()).iterator(chunk_size=chunk_size)
+        rows = heapq.merge(rows, archived_rows, key=lambda row: row[0])
+    if file_format == 'jsonl':
+        for row in rows:
+            yield json.dumps(dict(zip(columns, row)), default=str) + '\n'
+    else:
+        writer = csv.writer(Echo())
+        yield writer.writerow(columns)
+        for row in rows:
+            yield writer.writerow(row)
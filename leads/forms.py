@@ -1,6 +1,14 @@
+import datetime
+
 from django import forms
-from .models import Lead, User, Agent # or we can define: User = get_user_model()
-from django.contrib.auth.forms import UserCreationForm
+from django.forms.models import ModelChoiceIterator
+from django.urls import reverse_lazy
+from django.utils import timezone
+from .models import Lead, User, Agent, Category, LeadRouting, ArchivePolicy # or we can define: User = get_user_model()
+from django.contrib.auth.forms import UserCreationForm, PasswordResetForm
+from django.template import loader
+from .duplicates import find_duplicates
+from .tasks import send_email
 
 # class CustomUserCreationForm(UserCreationForm):
 #     class Meta:
@@ -26,7 +34,93 @@ class CustomUserCreationForm(UserCreationForm):
         model = User
         fields = ("username", "password1", "password2")
 
+class QueuedPasswordResetForm(PasswordResetForm):
+    # The reset mail is rendered here and sent by a background job, the request doesn't wait for SMTP
+
+    def send_mail(self, subject_template_name, email_template_name, context, from_email, to_email, html_email_template_name=None):
+        subject = ''.join(loader.render_to_string(subject_template_name, context).splitlines())
+        body = loader.render_to_string(email_template_name, context)
+        html_body = loader.render_to_string(html_email_template_name, context) if html_email_template_name else None
+        send_email.enqueue(subject=subject, body=body, from_email=from_email, to=[to_email], html_body=html_body)
+
+    def get_users(self, email):
+        yield from super().get_users(email)
+        # invited agents have no password yet (see leads/onboarding.py), they can ask for a new link
+        invited = User.objects.filter(email__iexact=email, is_active=True, is_agent=True, last_login__isnull=True)
+        for user in invited:
+            if not user.has_usable_password() and user.email.casefold() == email.casefold():
+                yield user
+
+PICKER_MAX_CHOICES = 100 # more agents or categories than this: only the autocomplete
+
+
+class AutocompleteSelect(forms.Select):
+    """A <select> for a ModelChoiceField that never renders more than PICKER_MAX_CHOICES options.
+
+    Up to that it is a normal <select> (one query, LIMIT PICKER_MAX_CHOICES + 1). For a bigger
+    organisation it only has the selected option, the script in leads/autocomplete_script.html adds
+    a search box that fills it from the JSON endpoint in data-autocomplete-url. So the page and its
+    queries stay the same size however many agents there are.
+    """
+
+    def __init__(self, url, attrs=None):
+        super().__init__(attrs)
+        self.url = url
+        self.loaded = {} # the options per selected value, crispy asks for them more than once
+
+    def __deepcopy__(self, memo):
+        # every form gets a copy of the widget, the loaded options must not be shared
+        obj = super().__deepcopy__(memo)
+        obj.loaded = {}
+        return obj
+
+    def build_attrs(self, base_attrs, extra_attrs=None):
+        attrs = super().build_attrs(base_attrs, extra_attrs)
+        attrs['data-autocomplete-url'] = str(self.url)
+        return attrs
+
+    def optgroups(self, name, value, attrs=None):
+        choices = self.choices
+        if not isinstance(choices, ModelChoiceIterator):
+            return super().optgroups(name, value, attrs)
+        key = tuple(value)
+        if key not in self.loaded:
+            queryset = choices.queryset
+            objects = list(queryset[:PICKER_MAX_CHOICES + 1])
+            if len(objects) > PICKER_MAX_CHOICES:
+                selected = [pk for pk in value if str(pk).isdigit()]
+                objects = list(queryset.filter(pk__in=selected)) if selected else []
+            self.loaded[key] = [choices.choice(obj) for obj in objects]
+        options = list(self.loaded[key])
+        if choices.field.empty_label is not None:
+            options.insert(0, ('', choices.field.empty_label))
+        self.choices = options
+        try:
+            return super().optgroups(name, value, attrs)
+        finally:
+            self.choices = choices
+
+
+def organisation_agents(organisation_id):
+    # Agent.__str__ shows agent.user.email, select_related avoids a query per option
+    return Agent.objects.filter(organisation_id=organisation_id, deleting=False).select_related('user').order_by('user__username')
+
+
+def organisation_categories(organisation_id):
+    return Category.objects.filter(organisation_id=organisation_id, deleting=False).order_by('name')
+
+
 class LeadModelForm(forms.ModelForm):
+    agent = forms.ModelChoiceField(
+        queryset=Agent.objects.none(),
+        required=False,
+        widget=AutocompleteSelect(reverse_lazy('leads:agent-autocomplete'))
+    )
+    allow_duplicate = forms.BooleanField(
+        required=False,
+        label='Save even if a lead with the same email or phone number exists'
+    )
+
     class Meta:
         model = Lead
         fields = (
@@ -39,6 +133,28 @@ class LeadModelForm(forms.ModelForm):
             'email'
         )
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # The views give the form a lead with the organisation set, also when a lead is created
+        self.fields['agent'].queryset = organisation_agents(self.instance.organisation_id)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        organisation_id = self.instance.organisation_id
+        if organisation_id is None or cleaned_data.get('allow_duplicate'):
+            return cleaned_data
+        duplicates = find_duplicates(
+            Lead.objects.filter(organisation_id=organisation_id).exclude(pk=self.instance.pk),
+            cleaned_data.get('email'),
+            cleaned_data.get('phone_number')
+        )
+        duplicate = duplicates.only('id', 'first_name', 'last_name').first()
+        if duplicate:
+            raise forms.ValidationError(
+                f'{duplicate} (#{duplicate.pk}) has the same email or phone number.'
+            )
+        return cleaned_data
+
 class LeadForm(forms.Form):
     first_name = forms.CharField()
     last_name = forms.CharField()
@@ -46,13 +162,13 @@ class LeadForm(forms.Form):
 
 
 class AssignAgentForm(forms.Form):
-    agent = forms.ModelChoiceField(queryset=Agent.objects.none())
+    agent = forms.ModelChoiceField(queryset=Agent.objects.none(), widget=AutocompleteSelect(reverse_lazy('leads:agent-autocomplete')))
     # ChoiceField is used for pre-defined choices, that are manually defined. ModelChoiceField
     # is dynamically populated 
 
     def __init__(self, *args, **kwargs):
         request = kwargs.pop("request")
-        agents = Agent.objects.filter(organisation=request.user.userprofile)
+        agents = organisation_agents(request.organisation.id)
         super(AssignAgentForm, self).__init__(*args, **kwargs)
         self.fields["agent"].queryset = agents
     #__init__ method gets triggered when created or rendered. We are customizing the form how it gets
@@ -64,11 +180,110 @@ class AssignAgentForm(forms.Form):
     # "name": <CharField object>
     # }
 
+class LeadIdsField(forms.Field):
+    # A list of lead ids from the checkboxes (<input type="checkbox" name="leads" value="12">).
+    # We don't use ModelMultipleChoiceField because it would load every selected lead.
+    widget = forms.MultipleHiddenInput
+
+    def to_python(self, value):
+        try:
+            return sorted({int(lead_id) for lead_id in value or []})
+        except (TypeError, ValueError):
+            raise forms.ValidationError('Invalid lead id.')
+
+
+class BulkAssignAgentForm(AssignAgentForm):
+    leads = LeadIdsField(required=False)
+    select_all = forms.BooleanField(required=False, label='All unassigned leads (in the category below)')
+    category = forms.ModelChoiceField(
+        queryset=Category.objects.none(),
+        required=False,
+        widget=AutocompleteSelect(reverse_lazy('leads:category-autocomplete'))
+    )
+
+    def __init__(self, *args, **kwargs):
+        request = kwargs["request"]
+        super(BulkAssignAgentForm, self).__init__(*args, **kwargs)
+        self.fields["category"].queryset = organisation_categories(request.organisation.id)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if not cleaned_data.get("select_all") and not cleaned_data.get("leads"):
+            raise forms.ValidationError('Select at least one lead.')
+        return cleaned_data
+
+
 class LeadCategoryUpdateForm(forms.ModelForm):
     class Meta:
         model = Lead
         fields = (
             'category',
         )
+        widgets = {
+            'category': AutocompleteSelect(reverse_lazy('leads:category-autocomplete')),
+        }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # only the categories of the organisation of the lead
+        self.fields['category'].queryset = organisation_categories(self.instance.organisation_id)
+
+
+
+
+class LeadImportForm(forms.Form):
+    file = forms.FileField(help_text='CSV or JSONL')
+    format = forms.ChoiceField(
+        choices=[('', 'Guess from the file name'), ('csv', 'CSV'), ('jsonl', 'JSONL')],
+        required=False
+    )
+
+
+class LeadRoutingForm(forms.ModelForm):
+    class Meta:
+        model = LeadRouting
+        fields = (
+            'strategy',
+        )
+
+class ArchivePolicyForm(forms.ModelForm):
+    class Meta:
+        model = ArchivePolicy
+        fields = (
+            'enabled',
+            'archive_after_days',
+            'categories',
+        )
+        widgets = {
+            'categories': forms.CheckboxSelectMultiple,
+        }
+        help_texts = {
+            'categories': 'Only leads of these categories are archived, with none selected every old enough lead is.',
+        }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # only the categories of the organisation
+        self.fields['categories'].queryset = Category.objects.filter(organisation=self.instance.organisation_id, deleting=False)
+
 
+class LeadReportForm(forms.Form):
+    # the filters of the intake report, the default is the last 30 days per day and category
+    date_from = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date'}))
+    date_to = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date'}))
+    period = forms.ChoiceField(choices=[('day', 'Per day'), ('week', 'Per week')], required=False)
+    split = forms.ChoiceField(choices=[('category', 'By category'), ('agent', 'By agent')], required=False)
 
+    def clean(self):
+        cleaned_data = super().clean()
+        date_to = cleaned_data.get('date_to') or timezone.localdate()
+        date_from = cleaned_data.get('date_from') or date_to - datetime.timedelta(days=29)
+        if date_from > date_to:
+            raise forms.ValidationError('The start date is after the end date.')
+        cleaned_data.update({
+            'date_from': date_from,
+            'date_to': date_to,
+            'period': cleaned_data.get('period') or 'day',
+            'split': cleaned_data.get('split') or 'category',
+        })
+        return cleaned_data
@@ -0,0 +1,271 @@
+import csv
+import hashlib
+import io
+import json
+import time
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import DEFAULT_DB_ALIAS, connections, router, transaction
+from django.db.models import Q
+from django.utils import timezone
+from .forms import LeadModelForm
+from .models import Lead, Agent, CategoryLeadCount, LeadImport, Job
+from .routing import LeadRouter
+from .cache import bump_organisation_version
+from .duplicates import duplicate_keys
+from .jobs import job
+from .rollup import count_new_leads
+from .sharding import writable_shard, use_shard
+
+MAX_STORED_ERRORS = 1000 # we keep only the first errors of a (possibly huge) broken file
+
+
+def read_rows(file, file_format):
+    # Generators - we never hold more than one line of the file in memory.
+    if file_format == 'jsonl':
+        for line in file:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield row if isinstance(row, dict) else {'__invalid__': line}
+    else:
+        yield from csv.DictReader(file)
+
+
+def guess_format(name):
+    return 'jsonl' if name.lower().endswith(('.jsonl', '.ndjson')) else 'csv'
+
+
+class LeadImporter:
+    """Validate rows with the LeadModelForm rules and insert them in batches"""
+
+    def __init__(self, lead_import, batch_size=1000, use_copy=True, progress=None, skip_duplicates=True):
+        self.lead_import = lead_import
+        self.batch_size = batch_size
+        # rows with the email or phone number of an existing lead (or an earlier row) fail
+        self.skip_duplicates = skip_duplicates
+        # the database of the organisation (see leads/sharding.py), the leads go where the import is
+        self.database = lead_import._state.db or router.db_for_write(Lead)
+        # COPY FROM STDIN is only available on PostgreSQL, everywhere else we use bulk_create
+        self.use_copy = use_copy and connections[self.database].vendor == 'postgresql'
+        self.progress = progress # optional callback, called after every committed batch
+        self.finished = False
+        # Same form fields (max_length, EmailField, IntegerField,...) as the create form. The agent
+        # is checked against the organisation's agents loaded once, not with a query per row.
+        self.fields = {
+            name: field for name, field in LeadModelForm.base_fields.items() if name in LeadModelForm._meta.fields and name != 'agent'
+        }
+        self.agent_ids = set(
+            Agent.objects.filter(organisation=lead_import.organisation, deleting=False).values_list('id', flat=True)
+        )
+        # Rows without an agent are routed like leads created in LeadCreateView
+        self.router = LeadRouter.for_organisation(lead_import.organisation)
+
+    def build_lead(self, row):
+        if '__invalid__' in row:
+            return None, ['Row is not a JSON object']
+        data = {}
+        errors = []
+        for name, field in self.fields.items():
+            try:
+                data[name] = field.clean(row.get(name))
+            except ValidationError as error:
+                errors += [f'{name}: {message}' for message in error.messages]
+
+        agent_id = row.get('agent') or None
+        if agent_id is not None:
+            try:
+                agent_id = int(agent_id)
+            except (TypeError, ValueError):
+                agent_id = -1
+            if agent_id not in self.agent_ids:
+                errors.append('agent: Select a valid choice. That choice is not one of the available choices.')
+
+        if errors:
+            return None, errors
+        lead = Lead(organisation=self.lead_import.organisation, agent_id=agent_id, **data)
+        lead.normalize()
+        return lead, []
+
+    def remove_duplicates(self, leads, rows):
+        # One indexed query per batch for the duplicates in the database, a dict for the ones in the batch
+        keys = [key for lead in leads for key in duplicate_keys(lead.email_normalized, lead.phone_normalized)]
+        if not self.skip_duplicates or not keys:
+            return leads, []
+        query = Q(email_normalized__in=[value for field, value in keys if field == 'email'])
+        query |= Q(phone_normalized__in=[value for field, value in keys if field == 'phone'])
+        seen = {}
+        existing = Lead.objects.using(self.database).filter(
+            query, organisation_id=self.lead_import.organisation_id
+        ).values_list('id', 'email_normalized', 'phone_normalized')
+        for lead_id, email, phone in existing:
+            for key in duplicate_keys(email, phone):
+                seen.setdefault(key, f'lead #{lead_id}')
+
+        unique = []
+        errors = []
+        for lead, row_number in zip(leads, rows):
+            lead_keys = duplicate_keys(lead.email_normalized, lead.phone_normalized)
+            duplicate = next((seen[key] for key in lead_keys if key in seen), None)
+            if duplicate:
+                errors.append({'row': row_number, 'errors': [f'Duplicate of {duplicate} (same email or phone number)']})
+                continue
+            for key in lead_keys:
+                seen[key] = f'row {row_number}'
+            unique.append(lead)
+        return unique, errors
+
+    def run(self, rows, max_batches=None):
+        # Stops after max_batches committed batches, the next run continues after them
+        lead_import = self.lead_import
+        batches = 0
+        skip = lead_import.rows_processed # resume after the last committed batch
+        started = time.monotonic()
+        leads = []
+        rows_of_leads = []
+        errors = []
+        row_number = skip
+
+        for row_number, row in enumerate(rows, start=1):
+            if row_number <= skip:
+                continue
+            lead, row_errors = self.build_lead(row)
+            if lead:
+                leads.append(lead)
+                rows_of_leads.append(row_number)
+            else:
+                errors.append({'row': row_number, 'errors': row_errors})
+            if row_number - lead_import.rows_processed >= self.batch_size:
+                self.commit_batch(row_number, leads, errors, rows_of_leads)
+                leads, errors, rows_of_leads = [], [], []
+                self.report(skip, started)
+                batches += 1
+                if max_batches is not None and batches >= max_batches:
+                    return lead_import
+
+        self.commit_batch(row_number, leads, errors, rows_of_leads, finished=True)
+        self.report(skip, started)
+        self.finished = True
+        return lead_import
+
+    def commit_batch(self, row_number, leads, errors, rows_of_leads, finished=False):
+        lead_import = self.lead_import
+        leads, duplicate_errors = self.remove_duplicates(leads, rows_of_leads)
+        errors = sorted(errors + duplicate_errors, key=lambda error: error['row'])
+        # The leads and the import progress are saved in the same transaction, so after a crash
+        # rows_processed tells us exactly where to continue.
+        with transaction.atomic(using=self.database):
+            if self.router:
+                self.router.assign(leads)
+                self.router.save()
+            if self.use_copy:
+                self.copy_leads(leads)
+            else:
+                Lead.objects.using(self.database).bulk_create(leads)
+            if leads and settings.LEADS_USE_CATEGORY_COUNTERS:
+                # bulk inserts don't send post_save, imported leads have no category yet
+                CategoryLeadCount.adjust(lead_import.organisation_id, None, len(leads))
+            if leads:
+                count_new_leads(leads)
+                bump_organisation_version(lead_import.organisation_id)
+
+            stored = MAX_STORED_ERRORS - len(lead_import.errors)
+            lead_import.errors += errors[:max(stored, 0)]
+            lead_import.rows_processed = row_number
+            lead_import.rows_imported += len(leads)
+            lead_import.rows_failed += len(errors)
+            if finished:
+                lead_import.status = LeadImport.FINISHED
+            lead_import.save()
+
+    def copy_leads(self, leads):
+        if not leads:
+            return
+        # COPY needs every value - it skips auto_now_add/auto_now, so we set the dates ourselves
+        now = timezone.now()
+        columns = ['first_name', 'last_name', 'age', 'organisation_id', 'agent_id', 'description',
+                   'phone_number', 'email', 'email_normalized', 'phone_normalized', 'date_added', 'updated_at']
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for lead in leads:
+            lead.date_added = lead.updated_at = now
+            writer.writerow([
+                '\\N' if getattr(lead, column) is None else getattr(lead, column) for column in columns
+            ])
+        buffer.seek(0)
+        sql = 'COPY {} ({}) FROM STDIN WITH (FORMAT csv, NULL \'\\N\')'.format(
+            Lead._meta.db_table, ', '.join(columns)
+        )
+        with connections[self.database].cursor() as cursor:
+            cursor.copy_expert(sql, buffer) # psycopg2
+
+    def report(self, skip, started):
+        if self.progress:
+            elapsed = time.monotonic() - started
+            done = self.lead_import.rows_processed - skip
+            self.progress(self.lead_import, done / elapsed if elapsed else 0)
+
+
+def file_hash(file):
+    # sha256 of a binary file, read in chunks
+    digest = hashlib.sha256()
+    file.seek(0)
+    for chunk in iter(lambda: file.read(1024 * 1024), b''):
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def get_or_resume_import(organisation, source_name, source_size, source_hash, restart=False):
+    # The same file (same content, whatever its name) uploaded again continues where the unfinished import stopped
+    lead_import = LeadImport.objects.filter(
+        organisation=organisation,
+        source_hash=source_hash,
+        status=LeadImport.RUNNING
+    ).order_by('-id').first()
+    if lead_import and not restart:
+        return lead_import
+    return LeadImport.objects.create(
+        organisation=organisation,
+        source_name=source_name,
+        source_size=source_size,
+        source_hash=source_hash
+    )
+
+
+def start_import(lead_import, file_format):
+    # Queue run_lead_import for an uploaded file (lead_import.file). An import that already has a
+    # waiting or running job isn't queued twice, the upload of the same file only shows its progress.
+    payload = {'organisation_id': lead_import.organisation_id, 'import_id': lead_import.id, 'file_format': file_format}
+    pending = Job.objects.using(DEFAULT_DB_ALIAS).filter(
+        name=f'{__name__}.run_lead_import',
+        payload__organisation_id=lead_import.organisation_id,
+        payload__import_id=lead_import.id,
+        status__in=[Job.QUEUED, Job.RUNNING]
+    )
+    if not pending.exists():
+        run_lead_import.enqueue(**payload)
+
+
+@job
+def run_lead_import(organisation_id, import_id, file_format):
+    # the import and its leads are in the database of the organisation. Every job imports
+    # LEADS_IMPORT_BATCHES_PER_JOB batches and queues the next one, which (like a retry after a
+    # failure) continues after the last committed batch.
+    with use_shard(writable_shard(organisation_id)):
+        lead_import = LeadImport.objects.get(id=import_id)
+        if lead_import.status == LeadImport.FINISHED:
+            return
+        with lead_import.file.open('rb') as file:
+            rows = read_rows(io.TextIOWrapper(file, encoding='utf-8-sig', newline=''), file_format)
+            importer = LeadImporter(lead_import)
+            importer.run(rows, settings.LEADS_IMPORT_BATCHES_PER_JOB)
+        if not importer.finished:
+            run_lead_import.enqueue(organisation_id=organisation_id, import_id=import_id, file_format=file_format)
+            return
+        lead_import.file.delete()
@@ -0,0 +1,154 @@
+import logging
+import os
+import random
+import socket
+import threading
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from .models import Job
+from .sharding import OrganisationMoving
+
+logger = logging.getLogger(__name__)
+
+# A small job queue in our own database, for slow side effects (mails, password hashing,...)
+# that shouldn't make a request wait. A view calls some_job.enqueue(...) and returns, and
+# 'py manage.py run_workers' runs the job in the background. The job row is written in the same
+# transaction as the rest of the request, so a job never runs for changes that were rolled back.
+#
+# Workers claim jobs with SELECT ... FOR UPDATE SKIP LOCKED on PostgreSQL: every worker gets
+# other rows and nobody waits. SQLite has no row locks, there a worker claims a job with
+# UPDATE ... WHERE status = 'queued' (SQLite writes one transaction at a time, so only one
+# worker's UPDATE matches) and the threads of a process take turns with a lock.
+
+_sqlite_lock = threading.Lock()
+
+
+def job(function=None, *, max_attempts=None):
+    """Make a function a job: @job or @job(max_attempts=3), then function.enqueue(**kwargs)
+
+    The keyword arguments are stored as JSON, so pass ids, not model instances.
+    """
+    def decorate(function):
+        name = f'{function.__module__}.{function.__name__}'
+        function.is_job = True
+
+        def enqueue(run_at=None, **payload):
+            return enqueue_job(name, payload, run_at=run_at, max_attempts=max_attempts)
+        function.enqueue = enqueue
+        return function
+    return decorate(function) if function else decorate
+
+
+def enqueue_job(name, payload=None, run_at=None, max_attempts=None):
+    if settings.LEADS_JOBS_EAGER:
+        # tests and development without a worker: run it now
+        import_string(name)(**(payload or {}))
+        return None
+    return Job.objects.using(DEFAULT_DB_ALIAS).create(
+        name=name,
+        payload=payload or {},
+        run_at=run_at or timezone.now(),
+        max_attempts=max_attempts or settings.LEADS_JOB_MAX_ATTEMPTS
+    )
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}'
+
+
+def claim_jobs(limit=1, worker=None):
+    # Marks up to limit due jobs as running for this worker and returns them
+    worker = worker or worker_name()
+    jobs = Job.objects.using(DEFAULT_DB_ALIAS)
+    connection = connections[DEFAULT_DB_ALIAS]
+    now = timezone.now()
+    due = jobs.filter(status=Job.QUEUED, run_at__lte=now).order_by('run_at', 'id')
+
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic(using=DEFAULT_DB_ALIAS):
+            ids = list(due.select_for_update(skip_locked=True).values_list('id', flat=True)[:limit])
+            jobs.filter(id__in=ids).update(status=Job.RUNNING, locked_by=worker, started_at=now, attempts=F('attempts') + 1)
+    else:
+        ids = []
+        with _sqlite_lock:
+            for job_id in due.values_list('id', flat=True)[:limit]:
+                # only one worker can change the status from queued to running
+                if jobs.filter(id=job_id, status=Job.QUEUED).update(
+                    status=Job.RUNNING, locked_by=worker, started_at=now, attempts=F('attempts') + 1
+                ):
+                    ids.append(job_id)
+    return list(jobs.filter(id__in=ids).order_by('run_at', 'id'))
+
+
+def backoff(attempts):
+    # LEADS_JOB_RETRY_DELAY, then twice as long for every attempt, with some jitter, so failed jobs don't retry all at once
+    delay = settings.LEADS_JOB_RETRY_DELAY * 2 ** (attempts - 1)
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+
+def run_job(job):
+    started = time.monotonic()
+    try:
+        function = import_string(job.name)
+        if not getattr(function, 'is_job', False):
+            raise ValueError(f'{job.name} is not a job')
+        function(**job.payload)
+    except OrganisationMoving:
+        # not a failure: the job runs again once the organisation is in its new database
+        job.status = Job.QUEUED
+        job.attempts -= 1
+        job.run_at = timezone.now() + timedelta(seconds=settings.LEADS_SHARD_DIRECTORY_TIMEOUT)
+        logger.info('Job %s #%s waits for its organisation to be moved', job.name, job.id)
+    except Exception:
+        job.last_error = traceback.format_exc()
+        if job.attempts >= job.max_attempts:
+            job.status = Job.DEAD
+            logger.error('Job %s #%s failed %s times, giving up', job.name, job.id, job.attempts)
+        else:
+            job.status = Job.QUEUED
+            job.run_at = timezone.now() + backoff(job.attempts)
+            logger.warning('Job %s #%s failed (attempt %s of %s), retrying at %s', job.name, job.id, job.attempts, job.max_attempts, job.run_at)
+    else:
+        job.status = Job.DONE
+        job.last_error = ''
+    job.duration = time.monotonic() - started
+    job.finished_at = timezone.now()
+    job.locked_by = ''
+    job.save(update_fields=['status', 'attempts', 'run_at', 'last_error', 'duration', 'finished_at', 'locked_by'])
+    return job
+
+
+def run_available_jobs(limit=None, worker=None):
+    # Runs due jobs until there are none left (or limit were run), returns the number of jobs run
+    count = 0
+    while limit is None or count < limit:
+        claimed = claim_jobs(1, worker)
+        if not claimed:
+            break
+        run_job(claimed[0])
+        count += 1
+    return count
+
+
+def requeue_stale_jobs():
+    # Jobs of workers that died (running for longer than LEADS_JOB_TIMEOUT) count as a failed attempt
+    stale = timezone.now() - timedelta(seconds=settings.LEADS_JOB_TIMEOUT)
+    jobs = Job.objects.using(DEFAULT_DB_ALIAS).filter(status=Job.RUNNING, started_at__lt=stale)
+    dead = jobs.filter(attempts__gte=F('max_attempts')).update(
+        status=Job.DEAD, locked_by='', last_error='Timed out'
+    )
+    queued = jobs.update(status=Job.QUEUED, locked_by='', last_error='Timed out', run_at=timezone.now())
+    return queued + dead
+
+
+def purge_finished_jobs():
+    # done jobs are only kept for the statistics of the last LEADS_JOB_KEEP_DONE_DAYS
+    before = timezone.now() - timedelta(days=settings.LEADS_JOB_KEEP_DONE_DAYS)
+    return Job.objects.using(DEFAULT_DB_ALIAS).filter(status=Job.DONE, finished_at__lt=before).delete()[0]
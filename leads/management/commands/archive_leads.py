@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from leads.archive import LeadArchiver
+from leads.models import ArchivePolicy
+from leads.sharding import use_shard, used_shards, owns_organisation
+
+
+class Command(BaseCommand):
+    help = 'Move old leads to the archive table, with the archive policy of every organisation (leads/archive.py)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--organisation', type=int, help='Only this organisation (UserProfile id)')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Leads moved per transaction')
+        parser.add_argument('--max-chunks', type=int, help='Stop after this many chunks per organisation, the next run continues')
+
+    def handle(self, *args, **options):
+        # the policies and leads of every shard (leads/sharding.py)
+        for database in used_shards():
+            with use_shard(database):
+                self.archive(options, database)
+
+    def archive(self, options, database):
+        policies = ArchivePolicy.objects.filter(enabled=True).select_related('organisation__user')
+        if options['organisation']:
+            policies = policies.filter(organisation_id=options['organisation'])
+
+        for policy in policies:
+            if not owns_organisation(database, policy.organisation_id):
+                self.stdout.write(f'{policy.organisation}: skipped, being moved or moved to another database')
+                continue
+            archiver = LeadArchiver(policy, options['chunk_size']).run(options['max_chunks'])
+            status = '' if archiver.finished else ' (not finished, run the command again)'
+            self.stdout.write(f'{policy.organisation}: {archiver.archived} leads archived{status}')
@@ -0,0 +1,83 @@
+import datetime
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+from django.test.utils import setup_test_environment
+from leads.benchmark import run_asgi_benchmark
+from leads.models import UserProfile, Lead, Category
+
+
+class Command(BaseCommand):
+    help = (
+        'Send concurrent requests to the lead list, lead detail and category pages through the ASGI '
+        'request path and report requests per second and latency. Run it once with LEADS_ASYNC_VIEWS=False '
+        'and --output, then with LEADS_ASYNC_VIEWS=True and --compare to see the difference.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--organisation', type=int, help='UserProfile id (default: the one with most leads)')
+        parser.add_argument('--requests', type=int, default=200, help='Requests per page and role')
+        parser.add_argument('--concurrency', type=int, default=50)
+        parser.add_argument('--output', help='Save the results as JSON')
+        parser.add_argument('--compare', help='JSON file of an earlier run to compare with')
+
+    def handle(self, *args, **options):
+        try:
+            setup_test_environment()
+        except RuntimeError:
+            pass # already done, e.g. when running inside the tests
+
+        organisations = UserProfile.objects.select_related('user')
+        if options['organisation']:
+            organisation = organisations.filter(id=options['organisation']).first()
+        else:
+            organisation = organisations.annotate(lead_count=Count('lead')).order_by('-lead_count').first()
+        if organisation is None:
+            raise CommandError('No organisation found, run "py manage.py seed_crm" first')
+
+        lead = Lead.objects.filter(organisation=organisation, agent__isnull=False).select_related('agent__user').first()
+        category = Category.objects.filter(organisation=organisation).first()
+        if lead is None or category is None:
+            raise CommandError(f'{organisation} needs at least one assigned lead and one category')
+
+        mode = 'async' if settings.LEADS_ASYNC_VIEWS else 'sync'
+        self.stdout.write(f'{mode} views, {options["requests"]} requests per page, concurrency {options["concurrency"]}')
+        users = {'organisor': organisation.user, 'agent': lead.agent.user}
+        results = run_asgi_benchmark(users, lead, category, options['requests'], options['concurrency'])
+
+        previous = {}
+        if options['compare']:
+            with open(options['compare']) as file:
+                data = json.load(file)
+            previous = data['results']
+            self.stdout.write(f'compared with {data["mode"]} views')
+        self.print_results(results, previous)
+
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump({
+                    'mode': mode,
+                    'date': datetime.datetime.now().isoformat(),
+                    'organisation': organisation.id,
+                    'requests': options['requests'],
+                    'concurrency': options['concurrency'],
+                    'results': results,
+                }, file, indent=2)
+            self.stdout.write(self.style.SUCCESS(f'Saved to {options["output"]}'))
+
+    def print_results(self, results, previous):
+        self.stdout.write(f'{"view":28} {"role":10} {"status":>8} {"req/s":>8} {"p50 ms":>8} {"p95 ms":>8}')
+        for name, roles in results.items():
+            for role, result in roles.items():
+                status = ','.join(str(code) for code in result['status'])
+                line = (
+                    f'{name:28} {role:10} {status:>8} {result["requests_per_second"]:>8} '
+                    f'{result["p50_ms"]:>8} {result["p95_ms"]:>8}'
+                )
+                before = previous.get(name, {}).get(role)
+                if before and before['requests_per_second']:
+                    change = (result['requests_per_second'] - before['requests_per_second']) / before['requests_per_second'] * 100
+                    line += f'  req/s {change:+.0f}%'
+                self.stdout.write(line)
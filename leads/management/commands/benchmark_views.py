@@ -0,0 +1,85 @@
+import datetime
+import json
+import subprocess
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+from django.test.utils import setup_test_environment
+from leads.benchmark import run_benchmark
+from leads.models import UserProfile, Lead, Agent, Category
+
+
+class Command(BaseCommand):
+    help = (
+        'Request every view of the leads and agents apps as an organisor and as an agent and report '
+        'p50/p95 latency, queries and peak memory. Run "py manage.py seed_crm" first.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--organisation', type=int, help='UserProfile id (default: the one with most leads)')
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--output', help='Save the results as JSON')
+        parser.add_argument('--compare', help='JSON file of an earlier run to compare with')
+
+    def handle(self, *args, **options):
+        # lets the test client use the 'testserver' host and keeps e-mails in memory
+        try:
+            setup_test_environment()
+        except RuntimeError:
+            pass # already done, e.g. when running inside the tests
+
+        organisations = UserProfile.objects.select_related('user')
+        if options['organisation']:
+            organisation = organisations.filter(id=options['organisation']).first()
+        else:
+            organisation = organisations.annotate(lead_count=Count('lead')).order_by('-lead_count').first()
+        if organisation is None:
+            raise CommandError('No organisation found, run "py manage.py seed_crm" first')
+
+        lead = Lead.objects.filter(organisation=organisation, agent__isnull=False).select_related('agent__user').first()
+        category = Category.objects.filter(organisation=organisation).first()
+        if lead is None or category is None:
+            raise CommandError(f'{organisation} needs at least one assigned lead and one category')
+
+        # the agent opens the pages of their own lead
+        users = {'organisor': organisation.user, 'agent': lead.agent.user}
+        results = run_benchmark(users, lead, category, lead.agent, options['iterations'])
+
+        previous = {}
+        if options['compare']:
+            with open(options['compare']) as file:
+                previous = json.load(file)['results']
+        self.print_results(results, previous)
+
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump({
+                    'commit': self.git_commit(),
+                    'date': datetime.datetime.now().isoformat(),
+                    'organisation': organisation.id,
+                    'leads': Lead.objects.filter(organisation=organisation).count(),
+                    'agents': Agent.objects.filter(organisation=organisation).count(),
+                    'iterations': options['iterations'],
+                    'results': results,
+                }, file, indent=2)
+            self.stdout.write(self.style.SUCCESS(f'Saved to {options["output"]}'))
+
+    def print_results(self, results, previous):
+        self.stdout.write(f'{"view":32} {"role":10} {"status":>6} {"p50 ms":>8} {"p95 ms":>8} {"queries":>7} {"peak kB":>8}')
+        for name, roles in results.items():
+            for role, result in roles.items():
+                line = (
+                    f'{name:32} {role:10} {result["status"]:>6} {result["p50_ms"]:>8} {result["p95_ms"]:>8} '
+                    f'{result["queries"]:>7} {result["peak_memory_kb"]:>8}'
+                )
+                before = previous.get(name, {}).get(role)
+                if before and before['p50_ms']:
+                    change = (result['p50_ms'] - before['p50_ms']) / before['p50_ms'] * 100
+                    line += f'  p50 {change:+.0f}%, queries {before["queries"]} -> {result["queries"]}'
+                self.stdout.write(line)
+
+    def git_commit(self):
+        try:
+            return subprocess.check_output(['git', 'rev-parse', 'HEAD'], text=True).strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+from leads.deletion import delete_later
+from leads.models import UserProfile
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete an organisation with all its leads, categories and agents. Nobody of the organisation can '
+        'log in from now on, the rows are deleted in batches by the background workers (leads/deletion.py).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('organisation', type=int, help='UserProfile id')
+
+    def handle(self, *args, **options):
+        try:
+            organisation = UserProfile.objects.using(DEFAULT_DB_ALIAS).get(id=options['organisation'])
+        except UserProfile.DoesNotExist:
+            raise CommandError(f'Organisation {options["organisation"]} does not exist')
+        if organisation.deleting:
+            raise CommandError(f'{organisation} is already being deleted')
+        deletion = delete_later(organisation)
+        self.stdout.write(f'{organisation} is being deleted, the progress is in the admin (Deletion #{deletion.id})')
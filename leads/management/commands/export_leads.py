@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+from leads.exports import LeadExportFilterForm, filter_leads, export_rows
+from leads.models import Lead, ArchivedLead
+from leads.sharding import organisation_shard
+
+
+class Command(BaseCommand):
+    help = 'Stream the leads of an organisation to a CSV or JSONL file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--organisation', type=int, required=True, help='UserProfile id of the organisation')
+        parser.add_argument('--output', help='File to write to (default: standard output)')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], default='csv')
+        parser.add_argument('--category', type=int)
+        parser.add_argument('--agent', type=int)
+        parser.add_argument('--date-from', help='YYYY-MM-DD')
+        parser.add_argument('--date-to', help='YYYY-MM-DD')
+        parser.add_argument('--archived', action='store_true', help='Also the leads in the archive')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        # the same form as the export view validates the filters
+        form = LeadExportFilterForm(options)
+        if not form.is_valid():
+            raise CommandError(form.errors.as_text())
+
+        database = organisation_shard(options['organisation'])[0]
+        queryset = filter_leads(Lead.objects.using(database).filter(organisation_id=options['organisation']), **form.cleaned_data)
+        archived = None
+        if options['archived']:
+            archived = filter_leads(ArchivedLead.objects.using(database).filter(organisation_id=options['organisation']), **form.cleaned_data)
+        rows = export_rows(queryset, options['format'], options['chunk_size'], archived)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as file:
+                file.writelines(rows)
+        else:
+            for row in rows:
+                self.stdout.write(row, ending='')
@@ -0,0 +1,40 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from leads.duplicates import DuplicateClusters, duplicate_keys
+from leads.models import Lead, UserProfile
+from leads.sharding import set_current_organisation
+
+
+class Command(BaseCommand):
+    help = 'Find groups of duplicate leads (same email or phone number) in an organisation, one JSON line per group'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--organisation', type=int, required=True, help='UserProfile id of the organisation')
+        parser.add_argument('--chunk-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        try:
+            organisation = UserProfile.objects.get(id=options['organisation'])
+        except UserProfile.DoesNotExist:
+            raise CommandError(f'Organisation {options["organisation"]} does not exist')
+        set_current_organisation(organisation)
+
+        # One pass over the leads in id order, only the keys are read
+        clusters = DuplicateClusters()
+        rows = Lead.objects.filter(organisation=organisation).order_by('id').values_list(
+            'id', 'email_normalized', 'phone_normalized'
+        )
+        for lead_id, email, phone in rows.iterator(chunk_size=options['chunk_size']):
+            clusters.add(lead_id, duplicate_keys(email, phone))
+
+        # Merge candidates: keep the oldest lead, merge the others into it
+        count = 0
+        for keep, merge, keys in clusters.clusters():
+            self.stdout.write(json.dumps({
+                'keep': keep,
+                'merge': merge,
+                'keys': [f'{field}:{value}' for field, value in keys],
+            }))
+            count += 1
+        self.stderr.write(f'{count} groups of duplicate leads')
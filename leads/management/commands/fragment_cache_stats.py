@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from leads.cache import fragment_cache_stats, reset_fragment_cache_stats
+
+
+class Command(BaseCommand):
+    help = 'Show the hits and misses of the lead list fragment cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Set the counters back to 0 after showing them')
+
+    def handle(self, *args, **options):
+        stats = fragment_cache_stats()
+        self.stdout.write(f"hits: {stats['hits']}, misses: {stats['misses']}, hit ratio: {stats['hit_ratio']:.1%}")
+        if options['reset']:
+            reset_fragment_cache_stats()
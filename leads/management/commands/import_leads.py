@@ -0,0 +1,61 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from leads.imports import LeadImporter, read_rows, guess_format, get_or_resume_import, file_hash
+from leads.models import UserProfile
+from leads.sharding import set_current_organisation, organisation_shard
+
+
+class Command(BaseCommand):
+    help = 'Stream a CSV or JSONL file of leads into an organisation (resumes an unfinished import of the same file)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--organisation', type=int, required=True, help='UserProfile id of the organisation')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Default: guessed from the file extension')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--no-copy', action='store_true', help='Use bulk_create also on PostgreSQL')
+        parser.add_argument('--restart', action='store_true', help='Ignore the progress of an unfinished import')
+        parser.add_argument('--allow-duplicates', action='store_true',
+                            help='Also import rows with the email or phone number of an existing lead')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        try:
+            organisation = UserProfile.objects.get(id=options['organisation'])
+        except UserProfile.DoesNotExist:
+            raise CommandError(f'Organisation {options["organisation"]} does not exist')
+        if not os.path.exists(path):
+            raise CommandError(f'File {path} does not exist')
+        if organisation_shard(organisation.id)[1]:
+            raise CommandError(f'{organisation} is being moved to another database, try again later')
+        # the import and the leads go to the database of the organisation, like in a request
+        set_current_organisation(organisation)
+
+        with open(path, 'rb') as file:
+            source_hash = file_hash(file)
+        lead_import = get_or_resume_import(
+            organisation, os.path.basename(path), os.path.getsize(path), source_hash, options['restart']
+        )
+        if lead_import.rows_processed:
+            self.stdout.write(f'Resuming after row {lead_import.rows_processed}')
+
+        importer = LeadImporter(
+            lead_import,
+            batch_size=options['batch_size'],
+            use_copy=not options['no_copy'],
+            progress=self.progress,
+            skip_duplicates=not options['allow_duplicates']
+        )
+        file_format = options['format'] or guess_format(path)
+        with open(path, encoding='utf-8-sig', newline='') as file:
+            importer.run(read_rows(file, file_format))
+
+        for error in lead_import.errors:
+            self.stderr.write(f'Row {error["row"]}: {"; ".join(error["errors"])}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {lead_import.rows_imported} leads, {lead_import.rows_failed} rows failed'
+        ))
+
+    def progress(self, lead_import, rows_per_second):
+        self.stdout.write(f'{lead_import.rows_processed} rows processed ({rows_per_second:.0f} rows/s)')
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Avg, Count, Max, Min, Q
+from django.utils import timezone
+from leads.models import Job
+
+
+class Command(BaseCommand):
+    help = 'Show the background job queue: jobs per status and the run times per job'
+
+    def handle(self, *args, **options):
+        # one grouped query, the jobs are read from the primary like the workers do
+        rows = Job.objects.using('default').order_by('name').values('name').annotate(
+            queued=Count('id', filter=Q(status=Job.QUEUED)),
+            running=Count('id', filter=Q(status=Job.RUNNING)),
+            done=Count('id', filter=Q(status=Job.DONE)),
+            dead=Count('id', filter=Q(status=Job.DEAD)),
+            retried=Count('id', filter=Q(attempts__gt=1)),
+            average=Avg('duration', filter=Q(status=Job.DONE)),
+            slowest=Max('duration', filter=Q(status=Job.DONE)),
+            oldest_queued=Min('run_at', filter=Q(status=Job.QUEUED)),
+        )
+        now = timezone.now()
+        for row in rows:
+            waiting = f'{(now - row["oldest_queued"]).total_seconds():.0f}s' if row['oldest_queued'] else '-'
+            self.stdout.write(
+                f'{row["name"]}: {row["queued"]} queued (oldest due {waiting} ago), {row["running"]} running, '
+                f'{row["done"]} done, {row["dead"]} dead, {row["retried"]} retried, '
+                f'{row["average"] or 0:.3f}s average, {row["slowest"] or 0:.3f}s slowest'
+            )
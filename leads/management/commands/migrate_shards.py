@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from leads.sharding import reset_id_sequences
+
+
+class Command(BaseCommand):
+    help = 'Run migrate on every database in settings.DATABASE_SHARDS'
+
+    def add_arguments(self, parser):
+        parser.add_argument('app_label', nargs='?')
+        parser.add_argument('migration_name', nargs='?')
+
+    def handle(self, *args, **options):
+        migrate_args = [arg for arg in (options['app_label'], options['migration_name']) if arg]
+        for database in settings.DATABASE_SHARDS:
+            self.stdout.write(self.style.MIGRATE_HEADING(f'Database {database}:'))
+            call_command('migrate', *migrate_args, database=database, verbosity=options['verbosity'], stdout=self.stdout)
+            # every shard hands out the ids of its own range (leads/sharding.py)
+            reset_id_sequences(database)
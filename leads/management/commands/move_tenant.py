@@ -0,0 +1,125 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, transaction
+from leads.cache import bump_organisation_version
+from leads.models import UserProfile, Agent, OrganisationShard, Job
+from leads.sharding import (
+    TENANT_MODELS, tenant_rows, organisation_shard, mirror_organisation, keep_dates, use_shard, delete_tenant_rows,
+    reset_id_sequences
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Move an organisation to another database of settings.DATABASE_SHARDS. The organisation is read '
+        'only while its rows are copied in batches, then the tenant directory points to the new database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('organisation', type=int, help='UserProfile id')
+        parser.add_argument('database', help='Alias of the target shard')
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--keep-source', action='store_true', help="Don't delete the rows from the old database")
+        parser.add_argument(
+            '--wait', type=float, default=None,
+            help='Seconds to wait for the workers to see a directory change (default: LEADS_SHARD_DIRECTORY_TIMEOUT + 2)'
+        )
+
+    def handle(self, *args, **options):
+        target = options['database']
+        if target not in settings.DATABASE_SHARDS:
+            raise CommandError(f'{target} is not in DATABASE_SHARDS {settings.DATABASE_SHARDS}')
+        try:
+            organisation = UserProfile.objects.using(DEFAULT_DB_ALIAS).get(id=options['organisation'])
+        except UserProfile.DoesNotExist:
+            raise CommandError(f'Organisation {options["organisation"]} does not exist')
+        source, moving = organisation_shard(organisation.id)
+        if source == target:
+            raise CommandError(f'{organisation} is already in {target}')
+        if moving:
+            raise CommandError(f'{organisation} is already being moved')
+
+        # the cached directory entries of the workers expire, then the running requests finish.
+        # New jobs of the organisation wait from then on (leads/jobs.py), the running ones are waited for.
+        wait = options['wait']
+        if wait is None:
+            wait = settings.LEADS_SHARD_DIRECTORY_TIMEOUT + 2
+
+        # 1. read only: OrganisationMiddleware answers changes with 503 from now on
+        shard, created = OrganisationShard.objects.using(DEFAULT_DB_ALIAS).get_or_create(organisation=organisation)
+        shard.moving = True
+        shard.save()
+        time.sleep(wait)
+
+        try:
+            self.wait_for_jobs(organisation)
+
+            # 2. copy the users and agents, then the tenant tables in batches. Rows of the organisation that
+            # are still in the target (an earlier move with --keep-source) would collide with the copies.
+            removed = delete_tenant_rows(organisation, target, options['batch_size'])
+            if removed:
+                self.stdout.write(f'Deleted {removed} old rows of {organisation} from {target}')
+            mirror_organisation(organisation, target)
+            for model in TENANT_MODELS:
+                copied = self.copy_rows(model, organisation, source, target, options['batch_size'])
+                self.stdout.write(f'{model._meta.label}: {copied} rows copied')
+
+            # 3. only switch when everything arrived
+            for model in TENANT_MODELS:
+                expected = tenant_rows(model, organisation, source).count()
+                found = tenant_rows(model, organisation, target).count()
+                if expected != found:
+                    raise CommandError(f'{model._meta.label}: {expected} rows in {source}, {found} in {target}')
+            # the copies kept their ids, the next new rows of the target must not get one of them
+            reset_id_sequences(target)
+        except Exception:
+            # the half copied rows would collide with the next attempt
+            delete_tenant_rows(organisation, target, options['batch_size'])
+            shard.moving = False
+            shard.save()
+            raise
+
+        # 4. cut over
+        shard.database = target
+        shard.moving = False
+        shard.save()
+        bump_organisation_version(organisation.id)
+        self.stdout.write(self.style.SUCCESS(f'{organisation} is now in {target}'))
+
+        if not options['keep_source']:
+            # workers that still have the old entry read from the source until then
+            time.sleep(wait)
+            self.delete_source(organisation, source, options['batch_size'])
+
+    def wait_for_jobs(self, organisation):
+        # jobs that started before the organisation was read only still write to the source
+        running = Job.objects.using(DEFAULT_DB_ALIAS).filter(status=Job.RUNNING, payload__organisation_id=organisation.id)
+        deadline = time.monotonic() + settings.LEADS_JOB_TIMEOUT
+        while running.exists():
+            if time.monotonic() > deadline:
+                raise CommandError(f'Jobs of {organisation} are still running after LEADS_JOB_TIMEOUT, try again later')
+            time.sleep(1)
+
+    def copy_rows(self, model, organisation, source, target, batch_size):
+        # keyset over the primary key, so every batch is a cheap index range scan and memory stays flat
+        copied = 0
+        last_pk = 0
+        rows = tenant_rows(model, organisation, source).order_by('pk')
+        while True:
+            batch = list(rows.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                return copied
+            with keep_dates(model), transaction.atomic(using=target):
+                model._base_manager.using(target).bulk_create(batch)
+            copied += len(batch)
+            last_pk = batch[-1].pk
+
+    def delete_source(self, organisation, source, batch_size):
+        # in batches so the locks stay short
+        delete_tenant_rows(organisation, source, batch_size)
+        if source != DEFAULT_DB_ALIAS:
+            with use_shard(source):
+                Agent.objects.using(source).filter(organisation=organisation).delete()
+        self.stdout.write(f'Deleted the rows of {organisation} from {source}')
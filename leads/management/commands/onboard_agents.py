@@ -0,0 +1,41 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from leads.imports import read_rows
+from leads.models import UserProfile
+from leads.onboarding import AgentOnboarding
+from leads.sharding import organisation_shard
+
+
+class Command(BaseCommand):
+    help = 'Create the agents of a CSV file (email, username, first_name, last_name) and send them invitations'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--organisation', type=int, required=True, help='UserProfile id of the organisation')
+        parser.add_argument('--domain', required=True, help='Host name for the links in the invitation mails, e.g. crm.example.com')
+        parser.add_argument('--http', action='store_true', help='Links with http:// instead of https://')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        try:
+            organisation = UserProfile.objects.get(id=options['organisation'])
+        except UserProfile.DoesNotExist:
+            raise CommandError(f'Organisation {options["organisation"]} does not exist')
+        if not os.path.exists(options['path']):
+            raise CommandError(f'File {options["path"]} does not exist')
+        if organisation_shard(organisation.id)[1]:
+            raise CommandError(f'{organisation} is being moved to another database, try again later')
+
+        onboarding = AgentOnboarding(
+            organisation, options['domain'], use_https=not options['http'], batch_size=options['batch_size']
+        )
+        with open(options['path'], encoding='utf-8-sig', newline='') as file:
+            onboarding.run(read_rows(file, 'csv'))
+
+        for error in onboarding.errors:
+            self.stderr.write(f'Row {error["row"]}: {"; ".join(error["errors"])}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {onboarding.created} agents, {len(onboarding.errors)} rows failed. '
+            'The invitations are sent by run_workers.'
+        ))
@@ -0,0 +1,35 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from leads.models import LeadActivity
+from leads.sharding import use_shard, used_shards
+
+
+class Command(BaseCommand):
+    help = 'Delete the lead history entries older than LEADS_ACTIVITY_RETENTION_DAYS in small batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='Keep this many days instead of LEADS_ACTIVITY_RETENTION_DAYS')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        days = options['days'] or settings.LEADS_ACTIVITY_RETENTION_DAYS
+        before = timezone.now() - timedelta(days=days)
+        # every shard has the history of its organisations (leads/sharding.py)
+        for database in used_shards():
+            with use_shard(database):
+                deleted = self.prune(before, options['batch_size'], database)
+            self.stdout.write(f'{database}: deleted {deleted} lead history entries')
+
+    def prune(self, before, batch_size, database):
+        # the oldest entries first, over the date_added index. Nothing points to the history and it
+        # has no signals, so delete() is one plain DELETE per batch (Django's fast delete).
+        deleted = 0
+        while True:
+            ids = list(LeadActivity.objects.filter(date_added__lt=before).order_by('date_added').values_list('id', flat=True)[:batch_size])
+            if not ids:
+                return deleted
+            LeadActivity.objects.using(database).filter(id__in=ids).delete()
+            deleted += len(ids)
@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand
+from django.db import router, transaction
+from django.db.models import Count
+from leads.models import Lead, CategoryLeadCount, AgentLeadCount
+from leads.sharding import use_shard, used_shards
+
+
+class Command(BaseCommand):
+    help = 'Recalculate the denormalized CategoryLeadCount and AgentLeadCount tables from the leads table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--organisation', type=int, help='Only rebuild the counts of this organisation (UserProfile id)')
+
+    def handle(self, *args, **options):
+        # every shard has its own counters (leads/sharding.py)
+        for database in used_shards():
+            with use_shard(database):
+                self.rebuild(options)
+
+    def rebuild(self, options):
+        leads = Lead.objects.order_by()
+        counters = CategoryLeadCount.objects.all()
+        loads = AgentLeadCount.objects.all()
+        if options['organisation']:
+            leads = leads.filter(organisation_id=options['organisation'])
+            counters = counters.filter(organisation_id=options['organisation'])
+            loads = loads.filter(organisation_id=options['organisation'])
+
+        # one grouped query for all organisations and categories
+        rows = leads.values('organisation', 'category').annotate(count=Count('id'))
+        new_counters = [
+            CategoryLeadCount(
+                organisation_id=row['organisation'],
+                category_id=row['category'],
+                count=row['count']
+            )
+            for row in rows
+        ]
+        rows = leads.filter(agent__isnull=False).values('organisation', 'agent', 'category').annotate(count=Count('id'))
+        new_loads = [
+            AgentLeadCount(
+                organisation_id=row['organisation'],
+                agent_id=row['agent'],
+                category_id=row['category'],
+                count=row['count']
+            )
+            for row in rows
+        ]
+        with transaction.atomic(using=router.db_for_write(CategoryLeadCount)):
+            counters.delete()
+            CategoryLeadCount.objects.bulk_create(new_counters, batch_size=1000)
+            loads.delete()
+            AgentLeadCount.objects.bulk_create(new_loads, batch_size=1000)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {len(new_counters)} category counters and {len(new_loads)} agent loads'))
@@ -0,0 +1,67 @@
+import datetime
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+from django.db import router, transaction
+from django.db.models import Min
+from django.utils import timezone
+from leads.exports import start_of_day
+from leads.models import Lead, ArchivedLead, LeadDailyCount, UserProfile
+from leads.rollup import rollup_rows
+from leads.sharding import use_shard, used_shards
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily lead rollup (LeadDailyCount) from the leads and the archived leads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--organisation', type=int, help='Only this organisation (UserProfile id)')
+        parser.add_argument('--days', type=int, default=31, help='Days rebuilt per transaction')
+
+    def handle(self, *args, **options):
+        # every shard has the rollup of its organisations (leads/sharding.py)
+        for database in used_shards():
+            with use_shard(database):
+                organisations = UserProfile.objects.using(database).order_by('id')
+                if options['organisation']:
+                    organisations = organisations.filter(id=options['organisation'])
+                for organisation_id in organisations.values_list('id', flat=True):
+                    self.rebuild(organisation_id, options['days'])
+
+    def rebuild(self, organisation_id, days):
+        querysets = [
+            Lead.objects.filter(organisation_id=organisation_id),
+            ArchivedLead.objects.filter(organisation_id=organisation_id),
+        ]
+        firsts = [queryset.aggregate(first=Min('date_added'))['first'] for queryset in querysets]
+        firsts = [first for first in firsts if first]
+        rollup = LeadDailyCount.objects.filter(organisation_id=organisation_id)
+        if not firsts:
+            rollup.delete()
+            return
+
+        # a range of days at a time, in one short transaction: the rollup rows of the range are locked,
+        # the grouped rows of the leads are read with a cursor and replace them. A lead saved meanwhile
+        # either is committed before we read, or its signals wait for the lock and add to the new rows.
+        day = timezone.localdate(min(firsts))
+        today = timezone.localdate()
+        rows = 0
+        rollup.filter(day__lt=day).delete()
+        while day <= today:
+            end = day + datetime.timedelta(days=days)
+            span_rollup = rollup.filter(day__gte=day, day__lt=end)
+            with transaction.atomic(using=router.db_for_write(LeadDailyCount)):
+                list(span_rollup.select_for_update().values_list('id', flat=True))
+                counts = Counter()
+                for queryset in querysets:
+                    span = queryset.filter(date_added__gte=start_of_day(day), date_added__lt=start_of_day(end))
+                    for row in rollup_rows(span).iterator():
+                        counts[row['day'], row['category'], row['agent']] += row['count']
+                span_rollup.delete()
+                LeadDailyCount.objects.bulk_create([
+                    LeadDailyCount(organisation_id=organisation_id, day=key[0], category_id=key[1], agent_id=key[2], count=count)
+                    for key, count in counts.items()
+                ], batch_size=1000)
+            rows += len(counts)
+            day = end
+        self.stdout.write(f'Organisation {organisation_id}: {rows} rollup rows')
@@ -0,0 +1,66 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction, router as db_router
+from django.utils import timezone
+from leads.models import Lead, LeadRouting
+from leads.routing import LeadRouter
+from leads.sharding import use_shard, used_shards, owns_organisation
+from leads.cache import bump_organisation_version
+from leads.rollup import move_leads
+from leads.activity import record_bulk_change
+
+
+class Command(BaseCommand):
+    help = 'Give the unassigned leads to agents with the routing strategy of their organisation'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--organisation', type=int, help='Only this organisation (UserProfile id)')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        # the routings and leads of every shard (leads/sharding.py)
+        for database in used_shards():
+            with use_shard(database):
+                self.route(options, database)
+
+    def route(self, options, database):
+        routings = LeadRouting.objects.exclude(strategy=LeadRouting.NONE)
+        if options['organisation']:
+            routings = routings.filter(organisation_id=options['organisation'])
+
+        for routing in routings:
+            if not owns_organisation(database, routing.organisation_id):
+                self.stdout.write(f'{routing.organisation}: skipped, being moved or moved to another database')
+                continue
+            router = LeadRouter(routing)
+            if not router.agent_ids:
+                continue
+            assigned = 0
+            last_id = 0
+            while True:
+                # keyset over the id, every batch is a cheap index range scan
+                leads = list(
+                    Lead.objects.filter(
+                        organisation_id=routing.organisation_id,
+                        agent__isnull=True,
+                        id__gt=last_id
+                    ).order_by('id').only('id', 'category_id', 'agent_id')[:options['batch_size']]
+                )
+                if not leads:
+                    break
+                router.assign(leads)
+                # one UPDATE per agent instead of one per lead
+                lead_ids_per_agent = {}
+                for lead in leads:
+                    lead_ids_per_agent.setdefault(lead.agent_id, []).append(lead.id)
+                # the history is written in the same transaction as the UPDATEs
+                with transaction.atomic(using=db_router.db_for_write(Lead)):
+                    for agent_id, lead_ids in lead_ids_per_agent.items():
+                        # agent__isnull=True: leads assigned by hand in the meantime are left alone
+                        unassigned = Lead.objects.filter(id__in=lead_ids, agent__isnull=True)
+                        move_leads(unassigned, agent=agent_id)
+                        record_bulk_change(unassigned, agent=agent_id)
+                        assigned += unassigned.update(agent_id=agent_id, updated_at=timezone.now())
+                    router.save()
+                last_id = leads[-1].id
+            bump_organisation_version(routing.organisation_id)
+            self.stdout.write(f'{routing.organisation}: {assigned} leads assigned')
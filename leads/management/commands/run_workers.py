@@ -0,0 +1,92 @@
+import multiprocessing
+import signal
+import threading
+
+import django
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+from leads.jobs import run_available_jobs, requeue_stale_jobs, purge_finished_jobs, worker_name
+from leads.routers import database_state
+
+MAINTENANCE_INTERVAL = 60 # seconds between checks for stale and old jobs
+
+
+def work(stop, poll_interval):
+    # The loop of one worker thread or process
+    if not apps.ready:
+        django.setup() # processes started with 'spawn' (macOS, Windows) begin without Django
+    worker = worker_name()
+    try:
+        # the queue is read from the primary, a replica could hand out jobs that were already taken
+        with database_state(use_primary=True):
+            while not stop.is_set():
+                # one job at a time, so a stop request waits for one job at most
+                if not run_available_jobs(limit=1, worker=worker):
+                    stop.wait(poll_interval)
+    finally:
+        connections.close_all()
+
+
+def work_in_process(stop, poll_interval):
+    # Only the main process handles Ctrl+C/SIGTERM, it tells the workers to stop through the event
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    work(stop, poll_interval)
+
+
+class Command(BaseCommand):
+    help = 'Run the background jobs (leads/jobs.py) with a pool of worker threads or processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.LEADS_JOB_WORKERS)
+        parser.add_argument('--processes', action='store_true', help='Use processes instead of threads (for CPU heavy jobs)')
+        parser.add_argument('--poll-interval', type=float, default=1, help='Seconds to wait when the queue is empty')
+        parser.add_argument('--once', action='store_true', help='Run the jobs that are due and exit (for cron and tests)')
+
+    def handle(self, *args, **options):
+        if options['once']:
+            requeue_stale_jobs()
+            with database_state(use_primary=True):
+                count = run_available_jobs()
+            self.stdout.write(f'Ran {count} jobs')
+            return
+
+        stopping = threading.Event()
+        if options['processes']:
+            stop = multiprocessing.Event()
+            # connections must not be shared with the new processes
+            connections.close_all()
+            workers = [
+                multiprocessing.Process(target=work_in_process, args=(stop, options['poll_interval']), daemon=True)
+                for i in range(options['workers'])
+            ]
+        else:
+            stop = stopping
+            workers = [
+                threading.Thread(target=work, args=(stop, options['poll_interval']), daemon=True)
+                for i in range(options['workers'])
+            ]
+
+        def shut_down(signum, frame):
+            # a multiprocessing.Event can't be set from a signal handler, the loop below does it
+            self.stdout.write('Stopping, the running jobs are finished first')
+            stopping.set()
+        signal.signal(signal.SIGINT, shut_down)
+        signal.signal(signal.SIGTERM, shut_down)
+
+        for worker in workers:
+            worker.start()
+        self.stdout.write(f'Started {len(workers)} {"processes" if options["processes"] else "threads"}')
+
+        while not stopping.is_set():
+            requeued = requeue_stale_jobs()
+            purged = purge_finished_jobs()
+            if requeued or purged:
+                self.stdout.write(f'Requeued {requeued} stale jobs, deleted {purged} old jobs')
+            connections.close_all()
+            stopping.wait(MAINTENANCE_INTERVAL)
+        stop.set()
+        for worker in workers:
+            worker.join()
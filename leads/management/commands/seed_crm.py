@@ -0,0 +1,119 @@
+import datetime
+import random
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from leads.cache import bump_organisation_version
+from leads.models import User, UserProfile, Agent, Lead, Category
+
+CATEGORY_WEIGHTS = {
+    'New': 40,
+    'Contacted': 30,
+    'Converted': 10,
+    'Unconverted': 10,
+    None: 10, # no category
+}
+FIRST_NAMES = ['Ana', 'Bor', 'Cene', 'Dana', 'Eva', 'Filip', 'Gal', 'Hana', 'Iza', 'Jan', 'Katja', 'Luka', 'Maja', 'Nik']
+LAST_NAMES = ['Novak', 'Horvat', 'Kos', 'Zupan', 'Krajnc', 'Kovac', 'Potocnik', 'Mlakar', 'Vidmar', 'Golob']
+
+
+@contextmanager
+def keep_date_added():
+    # auto_now_add would overwrite the dates we generate, so we switch it off while inserting
+    field = Lead._meta.get_field('date_added')
+    field.auto_now_add = False
+    try:
+        yield
+    finally:
+        field.auto_now_add = True
+
+
+class Command(BaseCommand):
+    help = 'Create organisations, agents and leads with bulk inserts (for development and benchmarks)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--organisations', type=int, default=1)
+        parser.add_argument('--agents', type=int, default=20, help='Agents per organisation')
+        parser.add_argument('--leads', type=int, default=10000, help='Leads per organisation')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--password', default='password', help='Password of every created user')
+        parser.add_argument('--seed', type=int, help='Random seed, for the same data on every run')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        # Hashing the password once and reusing it is what makes creating thousands of users fast
+        password = make_password(options['password'])
+        prefix = f'seed{rng.randrange(10 ** 6)}'
+        batch_size = options['batch_size']
+
+        for number in range(options['organisations']):
+            with transaction.atomic():
+                organisation = self.create_organisation(f'{prefix}-org{number}', password)
+                agents = self.create_agents(organisation, f'{prefix}-org{number}', options['agents'], password)
+                categories = Category.objects.bulk_create([
+                    Category(name=name, organisation=organisation) for name in CATEGORY_WEIGHTS if name
+                ])
+
+            # a few agents get most of the leads, like in a real call centre
+            agent_weights = [1 / (rank + 1) for rank in range(len(agents))]
+            category_choices = categories + [None]
+            category_weights = list(CATEGORY_WEIGHTS.values())
+            now = timezone.now()
+
+            created = 0
+            while created < options['leads']:
+                size = min(batch_size, options['leads'] - created)
+                leads = []
+                for i in range(size):
+                    first_name = rng.choice(FIRST_NAMES)
+                    last_name = rng.choice(LAST_NAMES)
+                    leads.append(Lead(
+                        first_name=first_name,
+                        last_name=last_name,
+                        age=rng.randint(18, 80),
+                        organisation=organisation,
+                        # 15% of the leads wait for an agent
+                        agent=rng.choices(agents, agent_weights)[0] if agents and rng.random() > 0.15 else None,
+                        category=rng.choices(category_choices, category_weights)[0],
+                        description=rng.choice(['', 'Asked for a call back', 'Interested in the yearly plan']),
+                        date_added=now - datetime.timedelta(seconds=rng.randrange(365 * 24 * 3600)),
+                        phone_number=f'+3864{rng.randrange(10 ** 7):07d}',
+                        email=f'{first_name}.{last_name}{created + i}@example.com'.lower()
+                    ))
+                for lead in leads:
+                    lead.normalize()
+                with keep_date_added(), transaction.atomic():
+                    Lead.objects.bulk_create(leads)
+                created += size
+            bump_organisation_version(organisation.id)
+            self.stdout.write(f'{organisation}: {len(agents)} agents, {created} leads')
+
+        if settings.LEADS_USE_CATEGORY_COUNTERS:
+            call_command('rebuild_category_counts', stdout=self.stdout)
+        # the leads were added over a whole year, one grouped query per month is cheaper than adjusting per lead
+        call_command('rebuild_lead_rollup', stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(f'Done, every user has the password "{options["password"]}"'))
+
+    def create_organisation(self, username, password):
+        # post_user_created_signal creates the UserProfile (= the organisation)
+        user = User.objects.create(username=username, email=f'{username}@example.com', password=password)
+        return UserProfile.objects.get(user=user)
+
+    def create_agents(self, organisation, prefix, count, password):
+        # bulk_create skips post_save, so agents don't get a UserProfile they don't need
+        users = User.objects.bulk_create([
+            User(
+                username=f'{prefix}-agent{i}',
+                email=f'{prefix}-agent{i}@example.com',
+                password=password,
+                is_organisor=False,
+                is_agent=True
+            )
+            for i in range(count)
+        ])
+        return Agent.objects.bulk_create([Agent(user=user, organisation=organisation) for user in users])
@@ -0,0 +1,33 @@
+import time
+
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = 'Delete expired sessions from the django_session table in small batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--interval', type=int, help='Keep running and sweep again every INTERVAL seconds')
+
+    def handle(self, *args, **options):
+        # Unlike clearsessions, which deletes everything in one statement, the short
+        # batches don't lock the table for logins that happen at the same time.
+        # The cached copies (cached_db) expire in the cache on their own.
+        while True:
+            deleted = self.sweep(options['batch_size'])
+            self.stdout.write(f'Deleted {deleted} expired sessions')
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
+
+    def sweep(self, batch_size):
+        deleted = 0
+        now = timezone.now()
+        while True:
+            keys = list(Session.objects.filter(expire_date__lt=now).values_list('session_key', flat=True)[:batch_size])
+            if not keys:
+                return deleted
+            deleted += Session.objects.filter(session_key__in=keys).delete()[0]
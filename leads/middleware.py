@@ -0,0 +1,240 @@
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed, ObjectDoesNotExist
+from django.db import connections
+from django.http import HttpResponse
+from .models import User, Agent
+from .activity import collect_activity
+from .routers import database_state
+from .sharding import organisation_shard, use_organisation
+
+logger = logging.getLogger(__name__)
+
+
+class OrganisationMiddleware:
+    """Resolve the profile, agent and organisation of the logged in user once per request.
+
+    Views read request.organisation, request.userprofile and request.agent instead of
+    going through user.userprofile / user.agent.organisation themselves. With
+    OrganisationModelBackend they come from the same joined query as request.user.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        self.resolve(request, request.user)
+        if self.is_read_only(request):
+            return self.read_only_response()
+        with use_organisation(request.organisation):
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        # Under ASGI request.user can't be loaded lazily (no database queries in async code),
+        # so we load it with request.auser() and set it for the views
+        user = await request.auser()
+        request.user = user
+        if user.is_authenticated and not self.is_preloaded(user):
+            # the session was made by ModelBackend, the relations still need their queries
+            await sync_to_async(self.resolve)(request, user)
+        else:
+            self.resolve(request, user)
+        if self.is_read_only(request):
+            return self.read_only_response()
+        with use_organisation(request.organisation):
+            return await self.get_response(request)
+
+    def is_read_only(self, request):
+        # move_tenant is copying the organisation to another database, changes would be lost
+        if request.organisation is None or request.method in ('GET', 'HEAD', 'OPTIONS'):
+            return False
+        return organisation_shard(request.organisation.id)[1]
+
+    def read_only_response(self):
+        response = HttpResponse('Your organisation is being moved, please try again in a few minutes.', status=503)
+        response['Retry-After'] = '60'
+        return response
+
+    def is_preloaded(self, user):
+        # True when OrganisationModelBackend loaded the relations together with the user
+        if not (User.userprofile.is_cached(user) and User.agent.is_cached(user)):
+            return False
+        agent = User.agent.related.get_cached_value(user)
+        return agent is None or Agent.organisation.is_cached(agent)
+
+    def resolve(self, request, user):
+        request.userprofile = None
+        request.agent = None
+        request.organisation = None
+
+        if user.is_authenticated:
+            try:
+                request.userprofile = user.userprofile
+            except ObjectDoesNotExist:
+                pass
+            try:
+                request.agent = user.agent
+            except ObjectDoesNotExist:
+                pass
+            if user.is_organisor:
+                request.organisation = request.userprofile
+            elif request.agent:
+                request.organisation = request.agent.organisation
+
+
+class LeadActivityMiddleware:
+    """Collect the lead history entries of the request and write them with one INSERT at its end.
+
+    See leads/activity.py. The entries get the logged in user as their actor.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with collect_activity(request.user):
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        # request.user was loaded by OrganisationMiddleware. Under ASGI the sync views that change
+        # leads run in a thread as well, their entries are written in a thread after the response.
+        with collect_activity(request.user, flush=False) as buffer:
+            try:
+                return await self.get_response(request)
+            finally:
+                await sync_to_async(buffer.flush)()
+
+
+class ReplicaStickinessMiddleware:
+    """Read your own writes with read replicas (see leads/routers.py).
+
+    Requests that change data (POST, ...) use only the primary. When a request wrote to the
+    primary, a cookie keeps the next requests of the user on the primary for
+    DATABASE_REPLICA_STICKY_SECONDS, long enough for the replicas to catch up.
+    """
+    sync_capable = True
+    async_capable = True
+    cookie_name = 'use_primary_until'
+
+    def __init__(self, get_response):
+        if not settings.DATABASE_REPLICAS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with database_state(self.use_primary(request)) as state:
+            response = self.get_response(request)
+        return self.stick(response, state)
+
+    async def __acall__(self, request):
+        with database_state(self.use_primary(request)) as state:
+            response = await self.get_response(request)
+        return self.stick(response, state)
+
+    def use_primary(self, request):
+        if request.method not in ('GET', 'HEAD', 'OPTIONS'):
+            return True
+        try:
+            return float(request.COOKIES.get(self.cookie_name, 0)) > time.time()
+        except ValueError:
+            return False
+
+    def stick(self, response, state):
+        if state.wrote:
+            seconds = settings.DATABASE_REPLICA_STICKY_SECONDS
+            response.set_cookie(
+                self.cookie_name, str(time.time() + seconds), max_age=seconds, httponly=True, samesite='Lax'
+            )
+        return response
+
+
+class QueryCountMiddleware:
+    """Development/test helper: count the database queries of every request.
+
+    Adds X-Query-Count and X-Query-Time headers, keeps the details in request.query_stats
+    and logs a warning when the same SQL (with different parameters) runs more than
+    QUERY_COUNT_N_PLUS_ONE_THRESHOLD times - the typical N+1 - or when a view needs more
+    queries than its budget in settings.QUERY_BUDGETS.
+    It is sync only, so under ASGI it adds a thread switch to every request; keep it off there.
+    """
+
+    def __init__(self, get_response):
+        if not settings.QUERY_COUNT_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = QueryStats()
+        request.query_stats = stats
+        with ExitStack() as stack:
+            # every database: the replicas and shards answer queries of the request as well
+            for database in connections.all():
+                stack.enter_context(database.execute_wrapper(stats))
+            response = self.get_response(request)
+            if response.streaming:
+                # the queries of a streaming response run while it is sent, we can't count them here
+                return response
+
+        view_name = request.resolver_match.view_name if request.resolver_match else None
+        response['X-Query-Count'] = str(stats.count)
+        response['X-Query-Time'] = f'{stats.duration * 1000:.1f}ms'
+
+        for fingerprint, count in stats.repeated(settings.QUERY_COUNT_N_PLUS_ONE_THRESHOLD):
+            logger.warning('Possible N+1 in %s: %s queries of %s', view_name or request.path, count, fingerprint)
+        budget = settings.QUERY_BUDGETS.get(view_name)
+        if budget is not None and stats.count > budget:
+            logger.warning('%s ran %s queries, the budget is %s', view_name, stats.count, budget)
+        return response
+
+
+class QueryStats:
+    # Used as connection.execute_wrapper(), so it sees every query of the request
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0
+        self.fingerprints = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.monotonic()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.monotonic() - start
+            self.count += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+    def repeated(self, threshold):
+        return [(sql, count) for sql, count in self.fingerprints.items() if count > threshold]
+
+
+def fingerprint(sql):
+    # The "shape" of a query: numbers, strings and IN (...) lists replaced by ?
+    sql = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    sql = re.sub(r'\b\d+\b', '?', sql)
+    sql = re.sub(r'\(\s*(?:\?|%s)(?:\s*,\s*(?:\?|%s))*\s*\)', '(?)', sql)
+    return re.sub(r'\s+', ' ', sql).strip()
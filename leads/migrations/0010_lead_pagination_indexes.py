@@ -0,0 +1,21 @@
+# Generated by Django 5.1.6 on 2026-10-18 12:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leads', '0009_lead_email'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='lead',
+            index=models.Index(fields=['organisation', 'agent', 'date_added', 'id'], name='lead_org_agent_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lead',
+            index=models.Index(fields=['category', 'date_added', 'id'], name='lead_category_date_idx'),
+        ),
+    ]
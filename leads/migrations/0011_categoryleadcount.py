@@ -0,0 +1,26 @@
+# Generated by Django 5.1.6 on 2026-10-18 12:39
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leads', '0010_lead_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryLeadCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.IntegerField(default=0)),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='leads.category')),
+                ('organisation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='leads.userprofile')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['organisation', 'category'], name='category_count_org_idx')],
+            },
+        ),
+    ]
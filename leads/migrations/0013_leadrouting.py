@@ -0,0 +1,28 @@
+# Generated by Django 5.1.6 on 2026-10-18 12:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leads', '0012_leadimport'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='routing_agents',
+            field=models.ManyToManyField(blank=True, related_name='routing_categories', to='leads.agent'),
+        ),
+        migrations.CreateModel(
+            name='LeadRouting',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('strategy', models.CharField(choices=[('none', 'Assign leads by hand'), ('round_robin', 'Round robin'), ('least_loaded', 'Agent with the fewest open leads'), ('category_pool', 'Agents of the lead category (fewest open leads)')], default='none', max_length=20)),
+                ('last_agent', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='leads.agent')),
+                ('organisation', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='leads.userprofile')),
+            ],
+        ),
+    ]
@@ -0,0 +1,45 @@
+from django.db import migrations
+
+# PostgreSQL only. On SQLite the FTS5 table and its triggers are created after migrate,
+# see leads.search.ensure_sqlite_fts().
+
+POSTGRESQL_SQL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE EXTENSION IF NOT EXISTS btree_gin",
+    """ALTER TABLE leads_lead ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+        to_tsvector('simple',
+            coalesce(first_name, '') || ' ' || coalesce(last_name, '') || ' ' ||
+            coalesce(email, '') || ' ' || coalesce(phone_number, '') || ' ' || coalesce(description, '')
+        )
+    ) STORED""",
+    # organisation first, so one GIN index answers "search inside this organisation"
+    "CREATE INDEX lead_search_vector_idx ON leads_lead USING gin (organisation_id, search_vector)",
+    "CREATE INDEX lead_email_trgm_idx ON leads_lead USING gin (email gin_trgm_ops)",
+    "CREATE INDEX lead_phone_trgm_idx ON leads_lead USING gin (phone_number gin_trgm_ops)",
+]
+
+POSTGRESQL_REVERSE_SQL = [
+    "DROP INDEX IF EXISTS lead_phone_trgm_idx",
+    "DROP INDEX IF EXISTS lead_email_trgm_idx",
+    "DROP INDEX IF EXISTS lead_search_vector_idx",
+    "ALTER TABLE leads_lead DROP COLUMN IF EXISTS search_vector",
+]
+
+
+def run_sql(statements):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor == 'postgresql':
+            for sql in statements:
+                schema_editor.execute(sql)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leads', '0013_leadrouting'),
+    ]
+
+    operations = [
+        migrations.RunPython(run_sql(POSTGRESQL_SQL), run_sql(POSTGRESQL_REVERSE_SQL)),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.6 on 2026-10-18 13:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leads', '0014_lead_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrganisationShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('database', models.CharField(default='default', max_length=100)),
+                ('moving', models.BooleanField(default=False)),
+                ('organisation', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='leads.userprofile')),
+            ],
+        ),
+    ]
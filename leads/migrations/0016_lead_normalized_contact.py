@@ -0,0 +1,49 @@
+# Generated by Django 5.1.6 on 2026-10-18 13:24
+
+from django.db import migrations, models
+from leads.duplicates import normalize_email, normalize_phone
+
+
+def fill_normalized(apps, schema_editor):
+    # in batches by primary key, before the indexes exist (faster than updating indexed columns)
+    Lead = apps.get_model('leads', 'Lead')
+    leads = Lead.objects.using(schema_editor.connection.alias).order_by('pk')
+    last_pk = 0
+    while True:
+        batch = list(leads.filter(pk__gt=last_pk).only('pk', 'email', 'phone_number')[:2000])
+        if not batch:
+            break
+        for lead in batch:
+            lead.email_normalized = normalize_email(lead.email)
+            lead.phone_normalized = normalize_phone(lead.phone_number)
+        Lead.objects.using(schema_editor.connection.alias).bulk_update(batch, ['email_normalized', 'phone_normalized'])
+        last_pk = batch[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leads', '0015_organisationshard'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lead',
+            name='email_normalized',
+            field=models.CharField(blank=True, default='', editable=False, max_length=254),
+        ),
+        migrations.AddField(
+            model_name='lead',
+            name='phone_normalized',
+            field=models.CharField(blank=True, default='', editable=False, max_length=32),
+        ),
+        migrations.RunPython(fill_normalized, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='lead',
+            index=models.Index(fields=['organisation', 'email_normalized'], name='lead_org_email_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lead',
+            index=models.Index(fields=['organisation', 'phone_normalized'], name='lead_org_phone_idx'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.1.6 on 2026-10-18 13:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leads', '0017_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivePolicy',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('enabled', models.BooleanField(default=False)),
+                ('archive_after_days', models.PositiveIntegerField(default=365)),
+                ('categories', models.ManyToManyField(blank=True, related_name='archive_policies', to='leads.category')),
+                ('organisation', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='leads.userprofile')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedLead',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('first_name', models.CharField(max_length=20)),
+                ('last_name', models.CharField(max_length=20)),
+                ('age', models.IntegerField(default=0)),
+                ('description', models.TextField(blank=True, null=True)),
+                ('date_added', models.DateTimeField()),
+                ('phone_number', models.CharField(max_length=20)),
+                ('email', models.EmailField(max_length=254)),
+                ('email_normalized', models.CharField(blank=True, default='', max_length=254)),
+                ('phone_normalized', models.CharField(blank=True, default='', max_length=32)),
+                ('date_archived', models.DateTimeField()),
+                ('agent', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='leads.agent')),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='leads.category')),
+                ('organisation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='leads.userprofile')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['organisation', 'date_added'], name='archived_lead_org_date_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.1.6 on 2026-10-18 13:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leads', '0018_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Deletion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('agent', 'Agent'), ('category', 'Category'), ('organisation', 'Organisation')], max_length=20)),
+                ('object_id', models.BigIntegerField()),
+                ('organisation_id', models.BigIntegerField()),
+                ('name', models.CharField(max_length=255)),
+                ('status', models.CharField(choices=[('running', 'Running'), ('done', 'Done')], default='running', max_length=20)),
+                ('step', models.CharField(blank=True, default='', max_length=50)),
+                ('rows_done', models.IntegerField(default=0)),
+                ('date_added', models.DateTimeField(auto_now_add=True)),
+                ('date_finished', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='agent',
+            name='deleting',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='deleting',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='deleting',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AlterField(
+            model_name='lead',
+            name='agent',
+            field=models.ForeignKey(blank=True, limit_choices_to={'deleting': False}, null=True, on_delete=django.db.models.deletion.SET_NULL, to='leads.agent'),
+        ),
+        migrations.AlterField(
+            model_name='lead',
+            name='category',
+            field=models.ForeignKey(blank=True, limit_choices_to={'deleting': False}, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='leads', to='leads.category'),
+        ),
+    ]
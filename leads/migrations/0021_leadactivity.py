@@ -0,0 +1,31 @@
+# Generated by Django 5.1.6 on 2026-10-18 14:11
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leads', '0020_leaddailycount'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeadActivity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('lead_id', models.BigIntegerField()),
+                ('action', models.CharField(choices=[('created', 'Created'), ('updated', 'Updated'), ('deleted', 'Deleted')], max_length=20)),
+                ('changes', models.JSONField(blank=True, default=dict)),
+                ('date_added', models.DateTimeField(auto_now_add=True)),
+                ('actor', models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('organisation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='leads.userprofile')),
+            ],
+            options={
+                'verbose_name_plural': 'lead activities',
+                'indexes': [models.Index(fields=['lead_id', 'date_added'], name='lead_activity_lead_idx'), models.Index(fields=['actor', 'date_added'], name='lead_activity_actor_idx'), models.Index(fields=['date_added'], name='lead_activity_date_idx')],
+            },
+        ),
+    ]
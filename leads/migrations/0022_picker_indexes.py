@@ -0,0 +1,22 @@
+# Generated by Django 5.1.6 on 2026-10-18 14:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leads', '0021_leadactivity'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='user',
+            name='email',
+            field=models.EmailField(blank=True, db_index=True, max_length=254),
+        ),
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(fields=['organisation', 'name'], name='category_org_name_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.1.6 on 2026-10-18 14:44
+
+import django.db.models.functions.comparison
+from django.db import migrations, models
+
+
+def merge_duplicate_counters(apps, schema_editor):
+    # two requests could create the same counter before the constraint, we keep one row with the sum
+    CategoryLeadCount = apps.get_model('leads', 'CategoryLeadCount')
+    counters = CategoryLeadCount.objects.using(schema_editor.connection.alias)
+    duplicates = counters.order_by().values('organisation', 'category').annotate(
+        rows=models.Count('id'), total=models.Sum('count'), keep=models.Min('id')
+    ).filter(rows__gt=1)
+    for row in duplicates:
+        same = counters.filter(organisation_id=row['organisation'], category_id=row['category'])
+        same.exclude(id=row['keep']).delete()
+        same.update(count=row['total'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leads', '0022_picker_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_counters, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='categoryleadcount',
+            constraint=models.UniqueConstraint(models.F('organisation'), django.db.models.functions.comparison.Coalesce('category', models.Value(0)), name='category_count_unique'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.1.6 on 2026-10-18 14:50
+
+import django.db.models.functions.comparison
+from django.db import migrations, models
+
+
+def merge_duplicate_rows(apps, schema_editor):
+    # like 0023: one row per key with the sum of the duplicates
+    LeadDailyCount = apps.get_model('leads', 'LeadDailyCount')
+    rollup = LeadDailyCount.objects.using(schema_editor.connection.alias)
+    duplicates = rollup.order_by().values('organisation', 'day', 'category', 'agent').annotate(
+        rows=models.Count('id'), total=models.Sum('count'), keep=models.Min('id')
+    ).filter(rows__gt=1)
+    for row in duplicates:
+        same = rollup.filter(
+            organisation_id=row['organisation'], day=row['day'], category_id=row['category'], agent_id=row['agent']
+        )
+        same.exclude(id=row['keep']).delete()
+        same.update(count=row['total'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leads', '0023_category_count_unique'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_rows, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='leaddailycount',
+            constraint=models.UniqueConstraint(models.F('organisation'), models.F('day'), django.db.models.functions.comparison.Coalesce('category', models.Value(0)), django.db.models.functions.comparison.Coalesce('agent', models.Value(0)), name='lead_daily_count_unique'),
+        ),
+        # the unique index starts with (organisation, day)
+        migrations.RemoveIndex(
+            model_name='leaddailycount',
+            name='lead_daily_count_org_day_idx',
+        ),
+    ]
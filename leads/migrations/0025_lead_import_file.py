@@ -0,0 +1,23 @@
+# Generated by Django 5.1.6 on 2026-10-18 14:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leads', '0024_lead_daily_count_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='leadimport',
+            name='file',
+            field=models.FileField(blank=True, upload_to='lead_imports/'),
+        ),
+        migrations.AddField(
+            model_name='leadimport',
+            name='source_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
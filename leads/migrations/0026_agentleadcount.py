@@ -0,0 +1,28 @@
+# Generated by Django 5.1.6 on 2026-10-18 15:09
+
+import django.db.models.deletion
+import django.db.models.functions.comparison
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leads', '0025_lead_import_file'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AgentLeadCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.IntegerField(default=0)),
+                ('agent', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='leads.agent')),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='leads.category')),
+                ('organisation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='leads.userprofile')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(models.F('organisation'), models.F('agent'), django.db.models.functions.comparison.Coalesce('category', models.Value(0)), name='agent_count_unique')],
+            },
+        ),
+    ]
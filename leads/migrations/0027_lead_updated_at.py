@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-18 15:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leads', '0026_agentleadcount'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lead',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
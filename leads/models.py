@@ -1,13 +1,21 @@
-from django.db import models
-from django.db.models.signals import post_save
+from django.conf import settings
+from django.db import models, router, transaction, connections, IntegrityError
+from django.utils import timezone
+from django.db.models import F, Q, Value, Case, When, DEFERRED
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_save, post_delete, post_init, pre_delete
 from django.contrib.auth.models import AbstractUser
+from .cache import bump_organisation_version
+from .duplicates import normalize_email, normalize_phone
 
 class User(AbstractUser):
+    email = models.EmailField(blank=True, db_index=True) # prefix search in the agent pickers
     is_organisor = models.BooleanField(default=True)
     is_agent = models.BooleanField(default=False)
 
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
+    deleting = models.BooleanField(default=False) # see Deletion
 
     def __str__(self):
         return self.user.username
@@ -15,6 +23,7 @@ class UserProfile(models.Model):
 class Agent(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     organisation = models.ForeignKey(UserProfile, on_delete=models.CASCADE)
+    deleting = models.BooleanField(default=False) # see Deletion
 
     def __str__(self):
         return self.user.email
@@ -24,33 +33,543 @@ class Lead(models.Model):
     last_name = models.CharField(max_length=20)
     age = models.IntegerField(default=0) 
     organisation = models.ForeignKey(UserProfile, on_delete=models.CASCADE)
-    agent = models.ForeignKey(Agent, null=True, blank=True, on_delete=models.SET_NULL) # if we delete the Agent, the lead will be set to null
-    category = models.ForeignKey("Category", related_name='leads', null=True, blank=True, on_delete=models.SET_NULL)
+    agent = models.ForeignKey(Agent, null=True, blank=True, on_delete=models.SET_NULL, limit_choices_to={'deleting': False}) # if we delete the Agent, the lead will be set to null
+    category = models.ForeignKey("Category", related_name='leads', null=True, blank=True, on_delete=models.SET_NULL, limit_choices_to={'deleting': False})
     description = models.TextField(null=True, blank=True)
     date_added = models.DateTimeField(auto_now_add=True)
+    # the version of the lead for the ETag of its page (leads/conditional.py), bulk updates set it themselves
+    updated_at = models.DateTimeField(auto_now=True)
     phone_number = models.CharField(max_length=20)
     email = models.EmailField()
+    # Set from email and phone_number in save() / normalize(), used to find duplicates (leads/duplicates.py)
+    email_normalized = models.CharField(max_length=254, blank=True, default='', editable=False)
+    phone_normalized = models.CharField(max_length=32, blank=True, default='', editable=False)
+
+    is_archived = False # see ArchivedLead
     
+    class Meta:
+        # Composite indexes for the keyset pagination in the lead list and the category detail page
+        indexes = [
+            models.Index(fields=['organisation', 'agent', 'date_added', 'id'], name='lead_org_agent_date_idx'),
+            models.Index(fields=['category', 'date_added', 'id'], name='lead_category_date_idx'),
+            # duplicate checks
+            models.Index(fields=['organisation', 'email_normalized'], name='lead_org_email_idx'),
+            models.Index(fields=['organisation', 'phone_normalized'], name='lead_org_phone_idx'),
+        ]
+
     def __str__(self):
         return f'{self.first_name} {self.last_name}'
 
+    def normalize(self):
+        # bulk_create() doesn't call save(), code that inserts leads in bulk calls this itself
+        self.email_normalized = normalize_email(self.email)
+        self.phone_normalized = normalize_phone(self.phone_number)
+
+    def save(self, *args, **kwargs):
+        self.normalize()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            if 'email' in update_fields or 'phone_number' in update_fields:
+                kwargs['update_fields'] = set(update_fields) | {'email_normalized', 'phone_normalized'}
+            kwargs['update_fields'] = set(kwargs['update_fields']) | {'updated_at'}
+        super().save(*args, **kwargs)
+
     # organisation = models.ForeignKey(UserProfile, on_delete=models.CASCADE)
 
 class Category(models.Model):
     name = models.CharField(max_length=30)  # New, Contacted, Converted, Unconverted
     organisation = models.ForeignKey(UserProfile, on_delete=models.CASCADE)
+    # agents that get the leads of this category with the 'category pool' routing
+    routing_agents = models.ManyToManyField(Agent, blank=True, related_name='routing_categories')
+    deleting = models.BooleanField(default=False) # see Deletion
+
+    class Meta:
+        indexes = [
+            # the category pickers, ordered by name and searched by the start of the name
+            models.Index(fields=['organisation', 'name'], name='category_org_name_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
+class CategoryLeadCount(models.Model):
+    # Denormalized number of leads per category (category=None is the 'Unassigned' bucket).
+    # Kept in sync by the signals below when settings.LEADS_USE_CATEGORY_COUNTERS is on,
+    # 'py manage.py rebuild_category_counts' repairs it if it drifts (e.g. after queryset.update()).
+    organisation = models.ForeignKey(UserProfile, on_delete=models.CASCADE)
+    category = models.ForeignKey(Category, null=True, blank=True, on_delete=models.CASCADE)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['organisation', 'category'], name='category_count_org_idx'),
+        ]
+        constraints = [
+            # one row per category, also for 'Unassigned' (a plain unique constraint allows many NULLs)
+            models.UniqueConstraint('organisation', Coalesce('category', Value(0)), name='category_count_unique'),
+        ]
+
+    def __str__(self):
+        return f'{self.category or "Unassigned"}: {self.count}'
+
+    @classmethod
+    def adjust(cls, organisation_id, category_id, delta):
+        adjust_counter(cls, delta, organisation_id=organisation_id, category_id=category_id)
+
+
+class AgentLeadCount(models.Model):
+    # Denormalized number of assigned leads per agent and category, the load of the agents for
+    # the lead routing (leads/routing.py) without counting the leads table. Kept in sync like
+    # CategoryLeadCount when settings.LEADS_USE_CATEGORY_COUNTERS is on, rebuilt by the same command.
+    # Archived leads don't count.
+    organisation = models.ForeignKey(UserProfile, on_delete=models.CASCADE)
+    agent = models.ForeignKey(Agent, on_delete=models.CASCADE)
+    category = models.ForeignKey(Category, null=True, blank=True, on_delete=models.SET_NULL)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            # like category_count_unique, also the index for the routing (organisation, ...)
+            models.UniqueConstraint('organisation', 'agent', Coalesce('category', Value(0)), name='agent_count_unique'),
+        ]
+
+    def __str__(self):
+        return f'{self.agent} / {self.category or "Unassigned"}: {self.count}'
+
+    @classmethod
+    def adjust(cls, organisation_id, agent_id, category_id, delta):
+        # leads without an agent aren't counted
+        if agent_id is not None and delta:
+            adjust_counter(cls, delta, organisation_id=organisation_id, agent_id=agent_id, category_id=category_id)
+
+
+def adjust_counter(model, delta, using=None, **key):
+    # UPDATE ... SET count = count + delta, so two requests can't overwrite each other.
+    # When the row doesn't exist yet and another request creates it first, the unique constraint
+    # fails our INSERT and we add to its row instead.
+    database = using or router.db_for_write(model)
+    counters = model.objects.using(database).filter(**key)
+    if counters.update(count=F('count') + delta):
+        return
+    try:
+        # a savepoint, the transaction of the caller goes on after the IntegrityError
+        with transaction.atomic(using=database):
+            model.objects.using(database).create(count=delta, **key)
+    except IntegrityError:
+        counters.update(count=F('count') + delta)
+
+
+def adjust_counters(model, fields, deltas, using=None):
+    """adjust_counter() for many rows at once, deltas is {(a value for each of fields): delta}
+
+    One SELECT for the rows that exist, one UPDATE per 500 of them and one INSERT for the others,
+    however many keys there are. A key that another request inserted in the meantime falls
+    back to adjust_counter().
+    """
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    database = using or router.db_for_write(model)
+    counters = model.objects.using(database)
+    # every field IN (its values), a few rows too many at most
+    query = Q()
+    for index, field in enumerate(fields):
+        values = {key[index] for key in deltas}
+        condition = Q(**{f'{field}__in': [value for value in values if value is not None]})
+        if None in values:
+            condition |= Q(**{f'{field}__isnull': True})
+        query &= condition
+    existing = {tuple(row[1:]): row[0] for row in counters.filter(query).values_list('id', *fields)}
+
+    updates = [(existing[key], delta) for key, delta in deltas.items() if key in existing]
+    for start in range(0, len(updates), 500):
+        by_delta = {}
+        for counter_id, delta in updates[start:start + 500]:
+            by_delta.setdefault(delta, []).append(counter_id)
+        counters.filter(id__in=[counter_id for counter_id, delta in updates[start:start + 500]]).update(
+            count=F('count') + Case(*[When(id__in=ids, then=Value(delta)) for delta, ids in by_delta.items()], default=Value(0))
+        )
+
+    missing = {key: delta for key, delta in deltas.items() if key not in existing}
+    if not missing:
+        return
+    try:
+        with transaction.atomic(using=database):
+            counters.bulk_create([model(count=delta, **dict(zip(fields, key))) for key, delta in missing.items()])
+    except IntegrityError:
+        for key, delta in missing.items():
+            adjust_counter(model, delta, using=database, **dict(zip(fields, key)))
+
+
+def delete_rows(model, pks, using):
+    # DELETE FROM ... WHERE id IN (...): one statement, no loading of the rows, no signals, no
+    # collector. For rows nothing points to anymore, the caller updates the counters itself.
+    if not pks:
+        return 0
+    connection = connections[using]
+    sql = 'DELETE FROM {} WHERE {} IN ({})'.format(
+        connection.ops.quote_name(model._meta.db_table),
+        connection.ops.quote_name(model._meta.pk.column),
+        ', '.join(['%s'] * len(pks))
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, list(pks))
+        return cursor.rowcount
+
+class LeadDailyCount(models.Model):
+    # Rollup for the intake report: leads added per day, by the category and agent the leads have now.
+    # Kept up to date by the signals below and, for the bulk updates, by leads/rollup.py.
+    # 'py manage.py rebuild_lead_rollup' fills it from the leads (also the archived ones).
+    organisation = models.ForeignKey(UserProfile, on_delete=models.CASCADE)
+    day = models.DateField() # in settings.TIME_ZONE
+    category = models.ForeignKey(Category, null=True, blank=True, on_delete=models.SET_NULL)
+    agent = models.ForeignKey(Agent, null=True, blank=True, on_delete=models.SET_NULL)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            # like category_count_unique, also the index for the report (organisation, day)
+            models.UniqueConstraint(
+                'organisation', 'day', Coalesce('category', Value(0)), Coalesce('agent', Value(0)),
+                name='lead_daily_count_unique'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.day}: {self.count}'
+
+    @classmethod
+    def adjust(cls, organisation_id, day, category_id, agent_id, delta):
+        adjust_counter(cls, delta, organisation_id=organisation_id, day=day, category_id=category_id, agent_id=agent_id)
+
+
+class LeadActivity(models.Model):
+    # Append-only history of the leads: who created, changed or deleted a lead and the changed fields,
+    # {'agent': [old id, new id], ...}. Written in batches by leads/activity.py, never updated.
+    # lead_id is no foreign key, so the history stays when the lead is deleted or archived.
+    CREATED = 'created'
+    UPDATED = 'updated'
+    DELETED = 'deleted'
+    ACTION_CHOICES = [
+        (CREATED, 'Created'),
+        (UPDATED, 'Updated'),
+        (DELETED, 'Deleted'),
+    ]
+    organisation = models.ForeignKey(UserProfile, on_delete=models.CASCADE)
+    lead_id = models.BigIntegerField()
+    actor = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL, db_index=False, related_name='+') # None for commands and jobs
+    action = models.CharField(max_length=20, choices=ACTION_CHOICES)
+    changes = models.JSONField(default=dict, blank=True)
+    date_added = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name_plural = 'lead activities'
+        indexes = [
+            # the timeline of a lead, the changes of a user in a period, the retention (prune_lead_activity)
+            models.Index(fields=['lead_id', 'date_added'], name='lead_activity_lead_idx'),
+            models.Index(fields=['actor', 'date_added'], name='lead_activity_actor_idx'),
+            models.Index(fields=['date_added'], name='lead_activity_date_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.action} lead {self.lead_id}'
+
+class LeadRouting(models.Model):
+    # How new and unassigned leads of an organisation are given to agents (see leads/routing.py)
+    NONE = 'none'
+    ROUND_ROBIN = 'round_robin'
+    LEAST_LOADED = 'least_loaded'
+    CATEGORY_POOL = 'category_pool'
+    STRATEGY_CHOICES = [
+        (NONE, 'Assign leads by hand'),
+        (ROUND_ROBIN, 'Round robin'),
+        (LEAST_LOADED, 'Agent with the fewest open leads'),
+        (CATEGORY_POOL, 'Agents of the lead category (fewest open leads)'),
+    ]
+
+    organisation = models.OneToOneField(UserProfile, on_delete=models.CASCADE)
+    strategy = models.CharField(max_length=20, choices=STRATEGY_CHOICES, default=NONE)
+    last_agent = models.ForeignKey(Agent, null=True, blank=True, on_delete=models.SET_NULL, related_name='+') # for round robin
+
+    def __str__(self):
+        return f'{self.organisation}: {self.get_strategy_display()}'
+
+class ArchivePolicy(models.Model):
+    # Which leads of an organisation 'py manage.py archive_leads' moves to ArchivedLead (see leads/archive.py)
+    organisation = models.OneToOneField(UserProfile, on_delete=models.CASCADE)
+    enabled = models.BooleanField(default=False)
+    archive_after_days = models.PositiveIntegerField(default=365) # age of date_added
+    # e.g. Converted and Unconverted, no categories: every lead that is old enough
+    categories = models.ManyToManyField(Category, blank=True, related_name='archive_policies')
+
+    def __str__(self):
+        return f'{self.organisation}: after {self.archive_after_days} days'
+
+class ArchivedLead(models.Model):
+    # Cold storage for old leads, so the leads_lead table and its indexes only hold the leads that are
+    # worked on. The rows keep the id they had as a Lead, so /leads/<id>/ still shows them. Lists,
+    # counts and search only read Lead, the lead detail page and the export also read this table.
+    id = models.BigIntegerField(primary_key=True)
+    first_name = models.CharField(max_length=20)
+    last_name = models.CharField(max_length=20)
+    age = models.IntegerField(default=0)
+    organisation = models.ForeignKey(UserProfile, on_delete=models.CASCADE)
+    agent = models.ForeignKey(Agent, null=True, blank=True, on_delete=models.SET_NULL)
+    category = models.ForeignKey(Category, null=True, blank=True, on_delete=models.SET_NULL)
+    description = models.TextField(null=True, blank=True)
+    date_added = models.DateTimeField()
+    phone_number = models.CharField(max_length=20)
+    email = models.EmailField()
+    email_normalized = models.CharField(max_length=254, blank=True, default='')
+    phone_normalized = models.CharField(max_length=32, blank=True, default='')
+    date_archived = models.DateTimeField()
+
+    is_archived = True
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['organisation', 'date_added'], name='archived_lead_org_date_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.first_name} {self.last_name}'
+
+class LeadImport(models.Model):
+    # Progress of a bulk import - rows_processed is saved together with every inserted batch,
+    # so an interrupted import can continue from the last committed batch.
+    # An upload is stored in file until the run_lead_import job (leads/imports.py) has read it.
+    RUNNING = 'running'
+    FINISHED = 'finished'
+    STATUS_CHOICES = [
+        (RUNNING, 'Running'),
+        (FINISHED, 'Finished'),
+    ]
+
+    organisation = models.ForeignKey(UserProfile, on_delete=models.CASCADE)
+    source_name = models.CharField(max_length=255)
+    source_size = models.BigIntegerField(default=0)
+    source_hash = models.CharField(max_length=64, blank=True, default='') # sha256, the same file resumes the import
+    file = models.FileField(upload_to='lead_imports/', blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=RUNNING)
+    rows_processed = models.IntegerField(default=0)
+    rows_imported = models.IntegerField(default=0)
+    rows_failed = models.IntegerField(default=0)
+    errors = models.JSONField(default=list, blank=True) # [{'row': 12, 'errors': ['email: Enter a valid email address.']}]
+    date_added = models.DateTimeField(auto_now_add=True)
+    date_updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.source_name} ({self.status})'
+
+class OrganisationShard(models.Model):
+    # Tenant directory: the database (settings.DATABASE_SHARDS) that holds the leads, categories,...
+    # of an organisation. Organisations without a row are in 'default'. Always stored in 'default'.
+    organisation = models.OneToOneField(UserProfile, on_delete=models.CASCADE)
+    database = models.CharField(max_length=100, default='default')
+    moving = models.BooleanField(default=False) # read only while move_tenant copies the data
+
+    def __str__(self):
+        return f'{self.organisation}: {self.database}'
+
+class Job(models.Model):
+    # Background job queue (see leads/jobs.py), run by 'py manage.py run_workers'.
+    # Always stored in 'default', next to the users.
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    DEAD = 'dead' # failed max_attempts times, kept for inspection (dead letter)
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (DEAD, 'Dead'),
+    ]
+
+    name = models.CharField(max_length=255) # dotted path of a function decorated with @job
+    payload = models.JSONField(default=dict, blank=True) # keyword arguments of the function
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=QUEUED)
+    run_at = models.DateTimeField() # not before, used for the retry backoff
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=5)
+    last_error = models.TextField(blank=True, default='')
+    locked_by = models.CharField(max_length=100, blank=True, default='')
+    date_added = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    duration = models.FloatField(null=True, blank=True) # seconds of the last attempt
+
+    class Meta:
+        indexes = [
+            # the workers ask for the next queued jobs that are due
+            models.Index(fields=['status', 'run_at'], name='job_status_run_at_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.name} #{self.id} ({self.status})'
+
+class Deletion(models.Model):
+    # An agent, category or organisation that is being deleted (see leads/deletion.py). The object
+    # is marked (deleting=True) and hidden right away, a background job then empties its dependent
+    # rows in small batches and deletes it at the end. Always stored in 'default', next to the jobs.
+    AGENT = 'agent'
+    CATEGORY = 'category'
+    ORGANISATION = 'organisation'
+    KIND_CHOICES = [
+        (AGENT, 'Agent'),
+        (CATEGORY, 'Category'),
+        (ORGANISATION, 'Organisation'),
+    ]
+    RUNNING = 'running'
+    DONE = 'done'
+    STATUS_CHOICES = [
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+    ]
+
+    # only ids, the rows are gone at the end but the record stays
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField()
+    organisation_id = models.BigIntegerField()
+    name = models.CharField(max_length=255)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=RUNNING)
+    step = models.CharField(max_length=50, blank=True, default='') # what the job is emptying right now
+    rows_done = models.IntegerField(default=0)
+    date_added = models.DateTimeField(auto_now_add=True)
+    date_finished = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f'{self.get_kind_display()} {self.name} ({self.status})'
+
 def post_user_created_signal(sender, instance, created, **kwargs):
-    if created:
+    # only organisors have a profile (= organisation), agents belong to the organisation of their Agent
+    if created and instance.is_organisor:
         UserProfile.objects.create(user=instance)
 
 
 post_save.connect(post_user_created_signal, sender=User)
 
 
+# Remember the category the lead was loaded with, so on save we know if it changed.
+# We read __dict__ so a lead loaded with .only()/.defer() doesn't trigger an extra query.
+def lead_post_init_signal(sender, instance, **kwargs):
+    instance._original_category_id = instance.__dict__.get('category_id', DEFERRED)
+    instance._original_agent_id = instance.__dict__.get('agent_id', DEFERRED)
+
+# The agent loads move with the agent and the category of a lead. Connected first, before the
+# signals below reset _original_agent_id and _original_category_id.
+def lead_saved_agent_count_signal(sender, instance, created, **kwargs):
+    if not settings.LEADS_USE_CATEGORY_COUNTERS:
+        return
+    if created:
+        AgentLeadCount.adjust(instance.organisation_id, instance.agent_id, instance.category_id, 1)
+        return
+    original = (instance._original_agent_id, instance._original_category_id)
+    if DEFERRED not in original and original != (instance.agent_id, instance.category_id):
+        AgentLeadCount.adjust(instance.organisation_id, *original, -1)
+        AgentLeadCount.adjust(instance.organisation_id, instance.agent_id, instance.category_id, 1)
+
+def lead_deleted_agent_count_signal(sender, instance, **kwargs):
+    original = (instance._original_agent_id, instance._original_category_id)
+    if settings.LEADS_USE_CATEGORY_COUNTERS and DEFERRED not in original:
+        AgentLeadCount.adjust(instance.organisation_id, *original, -1)
+
+def lead_saved_category_count_signal(sender, instance, created, **kwargs):
+    if settings.LEADS_USE_CATEGORY_COUNTERS:
+        if created:
+            CategoryLeadCount.adjust(instance.organisation_id, instance.category_id, 1)
+        elif instance._original_category_id is not DEFERRED and instance.category_id != instance._original_category_id:
+            CategoryLeadCount.adjust(instance.organisation_id, instance._original_category_id, -1)
+            CategoryLeadCount.adjust(instance.organisation_id, instance.category_id, 1)
+    instance._original_category_id = instance.category_id
+
+def lead_deleted_category_count_signal(sender, instance, **kwargs):
+    if settings.LEADS_USE_CATEGORY_COUNTERS and instance._original_category_id is not DEFERRED:
+        CategoryLeadCount.adjust(instance.organisation_id, instance._original_category_id, -1)
+
+# The daily rollup (LeadDailyCount) moves a lead from its old (category, agent) to the new one.
+# Connected before the category counters, which reset _original_category_id.
+def lead_saved_rollup_signal(sender, instance, created, **kwargs):
+    day = timezone.localdate(instance.date_added)
+    if created:
+        LeadDailyCount.adjust(instance.organisation_id, day, instance.category_id, instance.agent_id, 1)
+    else:
+        original = (instance._original_category_id, instance._original_agent_id)
+        if DEFERRED not in original and original != (instance.category_id, instance.agent_id):
+            LeadDailyCount.adjust(instance.organisation_id, day, *original, -1)
+            LeadDailyCount.adjust(instance.organisation_id, day, instance.category_id, instance.agent_id, 1)
+    instance._original_agent_id = instance.agent_id
+
+def lead_deleted_rollup_signal(sender, instance, **kwargs):
+    original = (instance._original_category_id, instance._original_agent_id)
+    if DEFERRED not in original:
+        LeadDailyCount.adjust(instance.organisation_id, timezone.localdate(instance.date_added), *original, -1)
+
+# Deleting a category sets lead.category to NULL with one UPDATE (no Lead signals),
+# so we move its count to the 'Unassigned' bucket before the counter row is deleted.
+def category_deleted_category_count_signal(sender, instance, **kwargs):
+    if settings.LEADS_USE_CATEGORY_COUNTERS:
+        counter = CategoryLeadCount.objects.filter(category=instance).first()
+        if counter and counter.count:
+            CategoryLeadCount.adjust(instance.organisation_id, None, counter.count)
+
+# SET_NULL would move the rollup rows of a deleted category or agent onto the keys of the rows
+# without one, which the unique constraint doesn't allow, so we add them to those rows first.
+def rollup_deleted_signal(sender, instance, using, **kwargs):
+    field = 'category_id' if sender is Category else 'agent_id'
+    merge_counters(LeadDailyCount, field, instance.pk, using)
+
+# The same for the agent loads of a deleted category (the rows of a deleted agent are deleted with it)
+def category_deleted_agent_count_signal(sender, instance, using, **kwargs):
+    merge_counters(AgentLeadCount, 'category_id', instance.pk, using)
+
+def merge_counters(model, field, value, using):
+    rows = model.objects.using(using).filter(**{field: value})
+    key = [model_field.attname for model_field in model._meta.concrete_fields if model_field.name not in ('id', 'count')]
+    for row in rows.exclude(count=0).values(*key, 'count'):
+        count = row.pop('count')
+        row[field] = None
+        adjust_counter(model, count, using=using, **row)
+    rows.delete()
+
+
+post_init.connect(lead_post_init_signal, sender=Lead)
+post_save.connect(lead_saved_agent_count_signal, sender=Lead)
+post_delete.connect(lead_deleted_agent_count_signal, sender=Lead)
+post_save.connect(lead_saved_rollup_signal, sender=Lead)
+post_delete.connect(lead_deleted_rollup_signal, sender=Lead)
+post_save.connect(lead_saved_category_count_signal, sender=Lead)
+post_delete.connect(lead_deleted_category_count_signal, sender=Lead)
+pre_delete.connect(category_deleted_category_count_signal, sender=Category)
+pre_delete.connect(rollup_deleted_signal, sender=Category)
+pre_delete.connect(rollup_deleted_signal, sender=Agent)
+pre_delete.connect(category_deleted_agent_count_signal, sender=Category)
+
+
+# The cached lead list fragments of an organisation (see leads/cache.py) are dropped by bumping
+# its version whenever a lead, agent or category of it changes. Bulk updates don't send signals,
+# so bulk_assign, the importer and route_unassigned bump the version themselves.
+def organisation_changed_signal(sender, instance, **kwargs):
+    bump_organisation_version(instance.organisation_id)
+
+def organisation_created_signal(sender, instance, created, **kwargs):
+    # A new organisation may get the id of a deleted one, it must not see its fragments
+    if created:
+        bump_organisation_version(instance.id)
+
+def agent_user_changed_signal(sender, instance, update_fields=None, **kwargs):
+    # The username of an agent is shown in the agent choices of the lead list
+    if instance.is_agent and update_fields != frozenset(['last_login']):
+        for organisation_id in Agent.objects.filter(user=instance).values_list('organisation_id', flat=True):
+            bump_organisation_version(organisation_id)
+
+
+for model in (Lead, Agent, Category):
+    post_save.connect(organisation_changed_signal, sender=model)
+    post_delete.connect(organisation_changed_signal, sender=model)
+post_save.connect(organisation_created_signal, sender=UserProfile)
+post_save.connect(agent_user_changed_signal, sender=User)
+
+
 # def save()...if not self.slug->slugify
 # py manage.py shell -> exit()
 
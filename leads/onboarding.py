@@ -0,0 +1,117 @@
+from django import forms
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ValidationError
+from django.db import router, transaction
+from django.db.models import Q
+from django.db.models.functions import Lower
+from .cache import bump_organisation_version
+from .models import User, Agent
+from .sharding import writable_shard, copy_objects
+from .tasks import send_agent_invitations
+
+# Bulk agent onboarding: a CSV file (email, username, first_name, last_name) becomes users and
+# agents with two bulk inserts per batch. bulk_create() sends no post_save, so no UserProfile is
+# created and no password is hashed: the agents get an unusable password and an invitation mail
+# (sent by a background job) with a link to set their own password.
+
+INVITATIONS_PER_JOB = 100
+EMAIL_FIELD = forms.EmailField(max_length=254)
+NAME_FIELD = forms.CharField(max_length=150, required=False)
+
+
+class AgentOnboarding:
+
+    def __init__(self, organisation, domain, use_https=False, batch_size=500):
+        self.organisation = organisation
+        self.domain = domain # for the links in the invitation mails
+        self.use_https = use_https
+        self.batch_size = batch_size
+        self.created = 0
+        self.errors = [] # [{'row': 3, 'errors': ['email: Enter a valid email address.']}]
+
+    def build_user(self, row):
+        errors = []
+        try:
+            email = EMAIL_FIELD.clean((row.get('email') or '').strip())
+        except ValidationError as error:
+            errors += [f'email: {message}' for message in error.messages]
+            email = ''
+        username = (row.get('username') or '').strip() or email
+        try:
+            User._meta.get_field('username').run_validators(username)
+        except ValidationError as error:
+            errors += [f'username: {message}' for message in error.messages]
+        names = {}
+        for name in ('first_name', 'last_name'):
+            try:
+                names[name] = NAME_FIELD.clean((row.get(name) or '').strip())
+            except ValidationError as error:
+                errors += [f'{name}: {message}' for message in error.messages]
+        if errors:
+            return None, errors
+        return User(
+            username=username,
+            email=email,
+            is_organisor=False,
+            is_agent=True,
+            password=make_password(None), # unusable, no hashing
+            **names
+        ), []
+
+    def run(self, rows):
+        users = []
+        row_numbers = []
+        for row_number, row in enumerate(rows, start=1):
+            user, errors = self.build_user(row)
+            if user:
+                users.append(user)
+                row_numbers.append(row_number)
+            else:
+                self.errors.append({'row': row_number, 'errors': errors})
+            if len(users) >= self.batch_size:
+                self.create_batch(users, row_numbers)
+                users, row_numbers = [], []
+        self.create_batch(users, row_numbers)
+        self.errors.sort(key=lambda error: error['row'])
+        return self
+
+    def remove_taken(self, users, row_numbers):
+        # usernames and emails that exist already or came earlier in the file, one query per batch.
+        # Emails are compared in lower case, Ana@test.com is taken by ana@test.com
+        taken = set()
+        for username, email in User.objects.annotate(email_lower=Lower('email')).filter(
+            Q(username__in=[user.username for user in users]) | Q(email_lower__in=[user.email.lower() for user in users])
+        ).values_list('username', 'email_lower'):
+            taken.update([('username', username), ('email', email)])
+        new_users = []
+        for user, row_number in zip(users, row_numbers):
+            keys = [('username', user.username), ('email', user.email.lower())]
+            if taken.intersection(keys):
+                self.errors.append({'row': row_number, 'errors': ['A user with this username or email already exists']})
+                continue
+            taken.update(keys)
+            new_users.append(user)
+        return new_users
+
+    def create_batch(self, users, row_numbers):
+        users = self.remove_taken(users, row_numbers)
+        if not users:
+            return
+        # the copy of the agents in the shard would miss the new ones
+        database = writable_shard(self.organisation.id)
+        with transaction.atomic(using=router.db_for_write(User)):
+            users = User.objects.bulk_create(users)
+            agents = Agent.objects.bulk_create([Agent(user=user, organisation=self.organisation) for user in users])
+            # the post_save signals that keep a sharded organisation's copy of its agents don't run
+            if database != 'default':
+                copy_objects(User, users, database)
+                copy_objects(Agent, agents, database)
+            bump_organisation_version(self.organisation.id)
+            # the mails go out after the commit, a job per INVITATIONS_PER_JOB agents
+            for start in range(0, len(users), INVITATIONS_PER_JOB):
+                send_agent_invitations.enqueue(
+                    user_ids=[user.id for user in users[start:start + INVITATIONS_PER_JOB]],
+                    domain=self.domain,
+                    use_https=self.use_https
+                )
+        self.created += len(users)
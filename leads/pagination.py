@@ -0,0 +1,114 @@
+import base64
+import json
+
+from django.db.models import Q
+from django.http import Http404
+from django.utils.functional import cached_property
+
+
+# Keyset (cursor) pagination. Instead of OFFSET, which makes the database walk over every row
+# of the previous pages, we remember the ordering values of the last row on the page and ask for
+# the rows that come after it: WHERE (date_added, id) < (last_date_added, last_id).
+# With an index on the ordering columns, page 100 costs the same as page 1.
+
+def encode_cursor(values):
+    data = json.dumps(values, default=str).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+
+def decode_cursor(cursor, model, ordering):
+    try:
+        padding = '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(cursor + padding))
+        if not isinstance(values, list) or len(values) != len(ordering):
+            raise ValueError
+        # to_python turns the JSON strings back into datetimes, ints,... for each ordering field
+        return [
+            model._meta.get_field(field.lstrip('-')).to_python(value)
+            for field, value in zip(ordering, values)
+        ]
+    except Exception:
+        raise Http404('Invalid cursor')
+
+
+def keyset_filter(ordering, values):
+    # For ordering ('-date_added', '-id') this builds:
+    # date_added < x OR (date_added = x AND id < y)
+    query = Q()
+    equal = Q()
+    for field, value in zip(ordering, values):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        query |= equal & Q(**{f'{name}__{lookup}': value})
+        equal &= Q(**{name: value})
+    return query
+
+
+class KeysetPage:
+    # The rows are only fetched when the page is used, so a template that serves the list
+    # from the cache (see {% orgcache %}) doesn't run the query at all.
+
+    def __init__(self, queryset, page_size, ordering, has_previous):
+        self.queryset = queryset
+        self.page_size = page_size
+        self.ordering = ordering
+        self.has_previous = has_previous # we only know that we are not on the first page
+
+    @cached_property
+    def _rows(self):
+        # We fetch one row more than we need to know if there is a next page (no COUNT query needed)
+        return list(self.queryset[:self.page_size + 1])
+
+    async def aload(self):
+        # For async views: fetch the rows with the async ORM before the template is rendered
+        if '_rows' not in self.__dict__:
+            self.__dict__['_rows'] = [obj async for obj in self.queryset[:self.page_size + 1]]
+        return self
+
+    @property
+    def object_list(self):
+        return self._rows[:self.page_size]
+
+    @property
+    def has_next(self):
+        return len(self._rows) > self.page_size
+
+    @property
+    def next_cursor(self):
+        if not self.has_next:
+            return None
+        last = self.object_list[-1]
+        return encode_cursor([getattr(last, field.lstrip('-')) for field in self.ordering])
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __bool__(self):
+        return bool(self._rows)
+
+
+def keyset_paginate(queryset, cursor, page_size, ordering=('-date_added', '-id')):
+    queryset = queryset.order_by(*ordering)
+    if cursor:
+        values = decode_cursor(cursor, queryset.model, ordering)
+        queryset = queryset.filter(keyset_filter(ordering, values))
+    return KeysetPage(queryset, page_size, ordering, bool(cursor))
+
+
+class KeysetPaginationMixin:
+    """Replace the OFFSET based pagination of ListView with keyset pagination"""
+    paginate_by = 20
+    ordering = ('-date_added', '-id')
+    cursor_param = 'cursor'
+
+    def get_cursor(self, param=None):
+        return self.request.GET.get(param or self.cursor_param)
+
+    def paginate_queryset(self, queryset, page_size):
+        page = keyset_paginate(queryset, self.get_cursor(), page_size, self.get_ordering())
+        # ListView expects (paginator, page, object_list, is_paginated). We give the lazy page
+        # as object_list and don't check for other pages here, the templates use page_obj.has_next.
+        return (None, page, page, True)
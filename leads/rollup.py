@@ -0,0 +1,121 @@
+import datetime
+from collections import Counter
+
+from django.conf import settings
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate, TruncWeek
+from django.utils import timezone
+from .models import Lead, LeadDailyCount, AgentLeadCount, adjust_counters
+
+# The lead intake report reads LeadDailyCount (leads added per organisation, day, category and
+# agent) instead of grouping millions of leads by date_added: a year of a busy organisation is a
+# few thousand rollup rows. Lead.save() and delete() keep it up to date through the signals in
+# models.py, the code that inserts or updates leads in bulk (no signals) calls the functions below.
+# They add the changes up per counter row first and write them with adjust_counters(), a few
+# queries per call however many days and agents the leads span.
+
+DAILY_FIELDS = ['organisation_id', 'day', 'category_id', 'agent_id']
+LOAD_FIELDS = ['organisation_id', 'agent_id', 'category_id']
+
+
+def adjust_loads(loads):
+    # leads without an agent aren't counted (AgentLeadCount.adjust)
+    adjust_counters(AgentLeadCount, LOAD_FIELDS, {key: count for key, count in loads.items() if key[1] is not None})
+
+
+def count_new_leads(leads):
+    # After bulk_create() or COPY, in the same transaction
+    days = Counter(
+        (lead.organisation_id, timezone.localdate(lead.date_added), lead.category_id, lead.agent_id)
+        for lead in leads
+    )
+    adjust_counters(LeadDailyCount, DAILY_FIELDS, days)
+    if settings.LEADS_USE_CATEGORY_COUNTERS:
+        # the agent loads as well (leads/routing.py)
+        adjust_loads(Counter((lead.organisation_id, lead.agent_id, lead.category_id) for lead in leads))
+
+
+def rollup_rows(queryset):
+    # SELECT organisation_id, DATE(date_added), category_id, agent_id, COUNT(id) ... GROUP BY those
+    # (works for Lead and ArchivedLead)
+    return queryset.order_by().annotate(
+        day=TruncDate('date_added')
+    ).values('organisation', 'day', 'category', 'agent').annotate(count=Count('id'))
+
+
+def move_leads(queryset, **changes):
+    """Before queryset.update(agent=...) or update(category=...), in the same transaction
+
+    changes are the new ids, e.g. move_leads(leads, agent=agent.id)
+    With LEADS_USE_CATEGORY_COUNTERS the agent loads (AgentLeadCount) of the leads move too.
+    """
+    days = Counter()
+    loads = Counter()
+    for row in rollup_rows(queryset):
+        new = {'category': row['category'], 'agent': row['agent'], **changes}
+        days[row['organisation'], row['day'], row['category'], row['agent']] -= row['count']
+        days[row['organisation'], row['day'], new['category'], new['agent']] += row['count']
+        loads[row['organisation'], row['agent'], row['category']] -= row['count']
+        loads[row['organisation'], new['agent'], new['category']] += row['count']
+    adjust_counters(LeadDailyCount, DAILY_FIELDS, days)
+    # archived leads have no load
+    if settings.LEADS_USE_CATEGORY_COUNTERS and queryset.model is Lead:
+        adjust_loads(loads)
+
+
+class LeadIntakeReport:
+    """Leads added per day or week in a date range, split by category or agent
+
+    All numbers come from one grouped query over the rollup rows of the range.
+    """
+    PERIODS = ('day', 'week')
+    SPLITS = {
+        # split -> (column, name of the bucket without one)
+        'category': ('category__name', 'No category'),
+        'agent': ('agent__user__username', 'Unassigned'),
+    }
+
+    def __init__(self, organisation, date_from, date_to, period='day', split='category'):
+        self.organisation = organisation
+        self.date_from = date_from
+        self.date_to = date_to
+        self.period = period
+        self.split = split
+
+    def get_rows(self):
+        column, empty_name = self.SPLITS[self.split]
+        period = TruncWeek('day') if self.period == 'week' else F('day')
+        return LeadDailyCount.objects.filter(
+            organisation=self.organisation,
+            day__gte=self.date_from,
+            day__lte=self.date_to
+        ).annotate(
+            period=period,
+            name=F(column)
+        ).order_by().values('period', 'name').annotate(count=Sum('count'))
+
+    def build(self):
+        # {'columns': ['Contacted', ...], 'rows': [{'period': date, 'counts': [3, ...], 'total': 5}, ...]}
+        column, empty_name = self.SPLITS[self.split]
+        periods = {}
+        names = set()
+        for row in self.get_rows():
+            if not row['count']:
+                continue
+            period = row['period']
+            if isinstance(period, datetime.datetime): # TruncWeek of a DateField gives a date on most databases
+                period = period.date()
+            name = row['name'] or empty_name
+            names.add(name)
+            counts = periods.setdefault(period, {})
+            counts[name] = counts.get(name, 0) + row['count']
+        columns = sorted(names, key=lambda name: (name == empty_name, name))
+        rows = [
+            {
+                'period': period,
+                'counts': [periods[period].get(name, 0) for name in columns],
+                'total': sum(periods[period].values()),
+            }
+            for period in sorted(periods)
+        ]
+        return {'columns': columns, 'rows': rows, 'total': sum(row['total'] for row in rows)}
@@ -0,0 +1,147 @@
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from django.utils.connection import ConnectionDoesNotExist
+from .sharding import is_tenant_model, current_shard
+
+# Reads go to a healthy replica (settings.DATABASE_REPLICAS), writes to the primary ('default').
+# Once something was written, the rest of the request (and, through a cookie set by
+# ReplicaStickinessMiddleware, the next requests of the user for DATABASE_REPLICA_STICKY_SECONDS)
+# reads from the primary as well, so users always see their own changes.
+
+_state = ContextVar('database_state', default=None)
+
+
+class DatabaseState:
+    def __init__(self, use_primary=False):
+        self.use_primary = use_primary
+        self.wrote = False
+
+
+def current_state():
+    state = _state.get()
+    if state is None:
+        # outside of a request (management commands, shell): one state for the whole context
+        state = DatabaseState()
+        _state.set(state)
+    return state
+
+
+@contextmanager
+def database_state(use_primary=False):
+    token = _state.set(DatabaseState(use_primary))
+    try:
+        yield _state.get()
+    finally:
+        _state.reset(token)
+
+
+class ReplicaHealth:
+    """Remembers per process whether a replica answers (and isn't too far behind).
+
+    Every replica is checked at most once per DATABASE_REPLICA_HEALTH_CHECK_SECONDS.
+    """
+
+    def __init__(self):
+        self.results = {} # alias -> (healthy, checked_at)
+
+    def is_healthy(self, alias):
+        healthy, checked_at = self.results.get(alias, (None, 0))
+        if time.monotonic() - checked_at >= settings.DATABASE_REPLICA_HEALTH_CHECK_SECONDS:
+            healthy = self.check(alias)
+            self.results[alias] = (healthy, time.monotonic())
+        return healthy
+
+    def check(self, alias):
+        try:
+            connection = connections[alias]
+        except ConnectionDoesNotExist:
+            return False
+        try:
+            with connection.cursor() as cursor:
+                if connection.vendor == 'postgresql':
+                    # seconds since the last replayed transaction, 0 when everything is replayed
+                    cursor.execute(
+                        "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+                        "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+                    )
+                    lag = cursor.fetchone()[0]
+                    return lag is None or lag <= settings.DATABASE_REPLICA_MAX_LAG_SECONDS
+                cursor.execute('SELECT 1')
+            return True
+        except DatabaseError:
+            # drop the broken connection, the next check opens a new one
+            connection.close()
+            return False
+
+
+replica_health = ReplicaHealth()
+
+
+class PrimaryReplicaRouter:
+
+    def __init__(self, replicas=None):
+        self.replicas = settings.DATABASE_REPLICAS if replicas is None else replicas
+
+    def use_primary(self):
+        state = current_state()
+        # inside transaction.atomic() we read what the transaction sees
+        return state.use_primary or state.wrote or connections[DEFAULT_DB_ALIAS].in_atomic_block
+
+    def db_for_read(self, model, **hints):
+        if not self.replicas or self.use_primary():
+            return DEFAULT_DB_ALIAS
+        healthy = [alias for alias in self.replicas if replica_health.is_healthy(alias)]
+        return random.choice(healthy) if healthy else DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        current_state().wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # the replicas get the schema through replication
+        return db not in self.replicas
+
+
+class TenantShardRouter:
+    """Send the tenant tables (leads/sharding.py TENANT_MODELS) to the shard of the current organisation.
+
+    It comes before PrimaryReplicaRouter in DATABASE_ROUTERS. For everything in 'default'
+    it answers None, so the replica router decides between the primary and its replicas.
+    """
+
+    def db_for_tenant(self, model, hints):
+        if not is_tenant_model(model):
+            return None
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db and is_tenant_model(type(instance)):
+            # related objects of a tenant row come from the same shard
+            return instance._state.db
+        database = current_shard()
+        return None if database == DEFAULT_DB_ALIAS else database
+
+    def db_for_read(self, model, **hints):
+        return self.db_for_tenant(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self.db_for_tenant(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # users, profiles and agents are mirrored into every shard that needs them
+        if not is_tenant_model(type(obj1)) or not is_tenant_model(type(obj2)):
+            return True
+        return obj1._state.db == obj2._state.db
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # the tenant directory is only in 'default', every shard gets all the other tables
+        if app_label == 'leads' and model_name == 'organisationshard':
+            return db == DEFAULT_DB_ALIAS
+        return None
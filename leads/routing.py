@@ -0,0 +1,129 @@
+import heapq
+
+from django.conf import settings
+from django.db.models import Count, Sum
+from .models import Lead, Agent, Category, LeadRouting, AgentLeadCount
+
+# Leads in these categories are done, they don't count into the workload of an agent
+CLOSED_CATEGORY_NAMES = ('Converted', 'Unconverted')
+
+
+class LeadRouter:
+    """Pick an agent for new or unassigned leads of one organisation.
+
+    The open lead count of every agent is loaded once with a single grouped query and then kept
+    in memory in a heap, so every assignment costs O(log agents) instead of a COUNT per agent.
+    With LEADS_USE_CATEGORY_COUNTERS the query reads the agent loads (AgentLeadCount), a few rows
+    per agent, instead of the leads. A router for a single new lead (for_lead) reads only the
+    loads of the agents the lead can go to.
+    """
+
+    def __init__(self, routing, lead=None):
+        self.routing = routing
+        self.strategy = routing.strategy
+        self.agent_ids = list(
+            Agent.objects.filter(organisation_id=routing.organisation_id, deleting=False).order_by('id').values_list('id', flat=True)
+        )
+        self.loads = dict.fromkeys(self.agent_ids, 0)
+        self.heaps = {}
+        self.pools = {}
+
+        if self.strategy == LeadRouting.CATEGORY_POOL:
+            pools = Category.routing_agents.through.objects.filter(
+                agent__organisation_id=routing.organisation_id,
+                agent__deleting=False
+            ).values_list('category_id', 'agent_id')
+            if lead is not None:
+                # one lead: only the pool of its category
+                pools = pools.filter(category_id=lead.category_id)
+            for category_id, agent_id in pools:
+                self.pools.setdefault(category_id, []).append(agent_id)
+
+        if self.strategy in (LeadRouting.LEAST_LOADED, LeadRouting.CATEGORY_POOL):
+            agent_ids = None
+            if lead is not None:
+                # one lead: only the loads of the agents it can go to
+                agent_ids = self.pools.get(lead.category_id) or self.agent_ids
+            self.loads.update(self.load_rows(routing.organisation_id, agent_ids))
+
+        self.next_index = 0
+        if self.strategy == LeadRouting.ROUND_ROBIN and routing.last_agent_id in self.agent_ids:
+            self.next_index = self.agent_ids.index(routing.last_agent_id) + 1
+
+    @staticmethod
+    def load_rows(organisation_id, agent_ids=None):
+        # (agent_id, open leads) of the agents with open leads, all of them or those in agent_ids
+        if settings.LEADS_USE_CATEGORY_COUNTERS:
+            counters = AgentLeadCount.objects.filter(organisation_id=organisation_id)
+            if agent_ids is not None:
+                counters = counters.filter(agent_id__in=agent_ids)
+            return counters.exclude(
+                category__name__in=CLOSED_CATEGORY_NAMES
+            ).order_by().values('agent').annotate(count=Sum('count')).values_list('agent', 'count')
+        # SELECT agent_id, COUNT(id) FROM leads_lead WHERE ... GROUP BY agent_id
+        leads = Lead.objects.filter(organisation_id=organisation_id, agent__isnull=False)
+        if agent_ids is not None:
+            leads = leads.filter(agent_id__in=agent_ids)
+        return leads.exclude(
+            category__name__in=CLOSED_CATEGORY_NAMES
+        ).order_by().values('agent').annotate(count=Count('id')).values_list('agent', 'count')
+
+    @classmethod
+    def for_organisation(cls, organisation):
+        # None when the organisation doesn't route leads automatically
+        routing = LeadRouting.objects.filter(organisation=organisation).first()
+        if not routing or routing.strategy == LeadRouting.NONE:
+            return None
+        return cls(routing)
+
+    @classmethod
+    def for_lead(cls, lead):
+        # A router for one new lead. Call it inside the transaction that saves the lead: the routing
+        # row stays locked until the end of it, so concurrent creates go round robin one after
+        # another instead of picking the same agent.
+        routing = LeadRouting.objects.select_for_update().filter(organisation_id=lead.organisation_id).first()
+        if not routing or routing.strategy == LeadRouting.NONE:
+            return None
+        return cls(routing, lead=lead)
+
+    def least_loaded(self, agent_ids):
+        key = tuple(agent_ids)
+        heap = self.heaps.get(key)
+        if heap is None:
+            heap = [(self.loads[agent_id], agent_id) for agent_id in agent_ids]
+            heapq.heapify(heap)
+            self.heaps[key] = heap
+        # Heaps of other pools may hold an old load of the agent - we fix such entries when we meet them
+        while True:
+            load, agent_id = heapq.heappop(heap)
+            if load == self.loads[agent_id]:
+                break
+            heapq.heappush(heap, (self.loads[agent_id], agent_id))
+        self.loads[agent_id] += 1
+        heapq.heappush(heap, (self.loads[agent_id], agent_id))
+        return agent_id
+
+    def choose(self, lead):
+        # Returns the id of the chosen agent (or None when the organisation has no agents)
+        if not self.agent_ids:
+            return None
+        if self.strategy == LeadRouting.ROUND_ROBIN:
+            agent_id = self.agent_ids[self.next_index % len(self.agent_ids)]
+            self.next_index += 1
+            return agent_id
+        if self.strategy == LeadRouting.CATEGORY_POOL and self.pools.get(lead.category_id):
+            return self.least_loaded(self.pools[lead.category_id])
+        return self.least_loaded(self.agent_ids)
+
+    def assign(self, leads):
+        # Sets lead.agent_id in memory, the caller saves the leads
+        for lead in leads:
+            if lead.agent_id is None:
+                lead.agent_id = self.choose(lead)
+        return leads
+
+    def save(self):
+        # Round robin continues after the last agent in the next request
+        if self.strategy == LeadRouting.ROUND_ROBIN and self.agent_ids:
+            last_agent_id = self.agent_ids[(self.next_index - 1) % len(self.agent_ids)]
+            LeadRouting.objects.filter(pk=self.routing.pk).update(last_agent_id=last_agent_id)
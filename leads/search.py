@@ -0,0 +1,118 @@
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchVectorExact, SearchVectorField
+from django.db import connections
+from django.db.models import Expression, F, Lookup, Q
+from django.db.models.expressions import RawSQL
+
+# PostgreSQL: the generated tsvector column "search_vector" with a GIN index and trigram indexes
+# on email and phone_number are created in migration 0014.
+# SQLite: an FTS5 table with the trigram tokenizer (any part of a word with 3+ letters matches),
+# kept in sync with leads_lead by triggers. SQLite drops the triggers when Django rebuilds the
+# table in a migration, so ensure_sqlite_fts() runs after every migrate (see apps.py).
+
+SEARCH_FIELDS = ('first_name', 'last_name', 'email', 'phone_number', 'description')
+
+_columns = ', '.join(SEARCH_FIELDS)
+_new_values = ', '.join(f'new.{field}' for field in SEARCH_FIELDS)
+_old_values = ', '.join(f'old.{field}' for field in SEARCH_FIELDS)
+
+SQLITE_FTS_SQL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS leads_lead_fts USING fts5(
+        {_columns}, content='leads_lead', content_rowid='id', tokenize='trigram'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS leads_lead_fts_insert AFTER INSERT ON leads_lead BEGIN
+        INSERT INTO leads_lead_fts(rowid, {_columns}) VALUES (new.id, {_new_values});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS leads_lead_fts_delete AFTER DELETE ON leads_lead BEGIN
+        INSERT INTO leads_lead_fts(leads_lead_fts, rowid, {_columns}) VALUES ('delete', old.id, {_old_values});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS leads_lead_fts_update AFTER UPDATE ON leads_lead BEGIN
+        INSERT INTO leads_lead_fts(leads_lead_fts, rowid, {_columns}) VALUES ('delete', old.id, {_old_values});
+        INSERT INTO leads_lead_fts(rowid, {_columns}) VALUES (new.id, {_new_values});
+    END""",
+    # (re)index the rows that were written while the triggers were missing
+    "INSERT INTO leads_lead_fts(leads_lead_fts) VALUES ('rebuild')",
+]
+
+
+def ensure_sqlite_fts(db_connection):
+    with db_connection.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'leads_lead'")
+        if not cursor.fetchone():
+            return
+        cursor.execute("SELECT count(*) FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'leads_lead_fts_%'")
+        if cursor.fetchone()[0] == 3:
+            return
+        for sql in SQLITE_FTS_SQL:
+            cursor.execute(sql)
+
+
+def search_leads(queryset, query):
+    terms = query.split()
+    if not terms:
+        return queryset
+    # the database the queryset runs on, with shards and replicas that is not always 'default'
+    vendor = connections[queryset.db].vendor
+    if vendor == 'postgresql':
+        return _search_postgresql(queryset, query, terms)
+    if vendor == 'sqlite':
+        return _search_sqlite(queryset, terms)
+    # other databases: slow, but correct
+    for term in terms:
+        condition = Q()
+        for field in SEARCH_FIELDS:
+            condition |= Q(**{f'{field}__icontains': term})
+        queryset = queryset.filter(condition)
+    return queryset
+
+
+class SearchVectorColumn(Expression):
+    # "search_vector" is not a model field (see migration 0014), so it is read through the
+    # alias the query gives leads_lead, which is not always "leads_lead" in joins and subqueries
+    output_field = SearchVectorField()
+
+    def resolve_expression(self, query=None, allow_joins=True, reuse=None, summarize=False, for_save=False):
+        column = self.copy()
+        column.alias = query.get_initial_alias()
+        return column
+
+    def as_sql(self, compiler, connection):
+        return '{}.{}'.format(compiler.quote_name_unless_alias(self.alias), connection.ops.quote_name('search_vector')), []
+
+
+class ILike(Lookup):
+    # a plain ILIKE, which the trigram indexes on email and phone_number can answer
+    # (icontains compares UPPER() of both sides and can't use them)
+    lookup_name = 'ilike'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} ILIKE {rhs}', lhs_params + rhs_params
+
+
+def _search_postgresql(queryset, query, terms):
+    # every word as a prefix: 'ana nov' -> 'ana:* & nov:*'
+    words = [re.sub(r'\W', '', term) for term in terms]
+    tsquery = ' & '.join(f'{word}:*' for word in words if word)
+    # %, _ and \ in the query are matched literally
+    like = '%{}%'.format(connections[queryset.db].ops.prep_for_like_query(query.strip()))
+    condition = ILike(F('email'), like) | ILike(F('phone_number'), like)
+    if tsquery:
+        condition |= SearchVectorExact(SearchVectorColumn(), SearchQuery(tsquery, config='simple', search_type='raw'))
+    return queryset.filter(condition)
+
+
+def _search_sqlite(queryset, terms):
+    # The trigram tokenizer needs at least 3 characters, shorter words are matched on the names
+    long_terms = [term for term in terms if len(term) >= 3]
+    for term in terms:
+        if len(term) < 3:
+            queryset = queryset.filter(Q(first_name__istartswith=term) | Q(last_name__istartswith=term))
+    if long_terms:
+        match = ' '.join('"{}"'.format(term.replace('"', '""')) for term in long_terms)
+        queryset = queryset.filter(
+            id__in=RawSQL('SELECT rowid FROM leads_lead_fts WHERE leads_lead_fts MATCH %s', [match])
+        )
+    return queryset
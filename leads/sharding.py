@@ -0,0 +1,275 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import AutoField, Max
+from .models import (
+    User, UserProfile, Agent, Lead, Category, CategoryLeadCount, LeadImport, LeadRouting, OrganisationShard, ArchivePolicy,
+    ArchivedLead, LeadDailyCount, LeadActivity, AgentLeadCount, delete_rows
+)
+
+# Organisation based sharding. The tenant data (TENANT_MODELS) of an organisation lives in the
+# database given by OrganisationShard, TenantShardRouter (leads/routers.py) sends the queries there.
+# Users, profiles and agents stay in 'default' (login has to find them before we know the tenant),
+# and are mirrored into the shard of their organisation, because the tenant tables point to them.
+
+# In the order they have to be copied (a table after the tables it points to)
+TENANT_MODELS = [
+    Category,
+    Category.routing_agents.through,
+    LeadRouting,
+    ArchivePolicy,
+    ArchivePolicy.categories.through,
+    Lead,
+    ArchivedLead,
+    CategoryLeadCount,
+    AgentLeadCount,
+    LeadDailyCount,
+    LeadImport,
+    LeadActivity,
+]
+DIRECTORY_CACHE_KEY = 'organisation-shard:{}'
+
+# The tenant tables of every shard hand out ids from their own range, the n-th database of
+# DATABASE_SHARDS from n * SHARD_ID_RANGE on (reset_id_sequences). So the ids stay unique across
+# the shards: moved rows keep their ids, and ArchivedLead and LeadActivity.lead_id (no foreign key)
+# still point to the right lead. Users, profiles and agents only get ids in 'default'.
+SHARD_ID_RANGE = 2 ** 48
+
+_current_shard = ContextVar('current_shard', default=DEFAULT_DB_ALIAS)
+
+
+def is_sharded():
+    return len(settings.DATABASE_SHARDS) > 1
+
+
+def is_tenant_model(model):
+    return model in TENANT_MODELS
+
+
+def tenant_rows(model, organisation, database):
+    # Queryset of the rows of one organisation in one of the tenant tables
+    queryset = model._base_manager.using(database)
+    # the tables of the many to many fields have no organisation column
+    if model is Category.routing_agents.through:
+        return queryset.filter(category__organisation=organisation)
+    if model is ArchivePolicy.categories.through:
+        return queryset.filter(archivepolicy__organisation=organisation)
+    return queryset.filter(organisation=organisation)
+
+
+def organisation_shard(organisation_id):
+    # (database, moving) of the organisation, cached because every request needs it. Not forever:
+    # a per process cache doesn't see the changes made by the other workers
+    if not is_sharded() or organisation_id is None:
+        return DEFAULT_DB_ALIAS, False
+    key = DIRECTORY_CACHE_KEY.format(organisation_id)
+    value = cache.get(key)
+    if value is None:
+        row = OrganisationShard.objects.using(DEFAULT_DB_ALIAS).filter(
+            organisation_id=organisation_id
+        ).values_list('database', 'moving').first()
+        value = row or (DEFAULT_DB_ALIAS, False)
+        cache.set(key, value, timeout=settings.LEADS_SHARD_DIRECTORY_TIMEOUT)
+    return tuple(value)
+
+
+class OrganisationMoving(Exception):
+    """move_tenant is copying the organisation to another database, changes would be lost"""
+
+
+def writable_shard(organisation_id):
+    # The database of the organisation for code that changes its data: jobs and commands
+    # (requests get a 503 from OrganisationMiddleware)
+    database, moving = organisation_shard(organisation_id)
+    if moving:
+        raise OrganisationMoving(f'Organisation {organisation_id} is being moved to another database')
+    return database
+
+
+def owns_organisation(database, organisation_id):
+    # For the commands that go through every shard: False while the organisation is being moved,
+    # and for the rows move_tenant left in its old database (--keep-source)
+    return organisation_shard(organisation_id) == (database, False)
+
+
+def forget_organisation_shard(organisation_id):
+    cache.delete(DIRECTORY_CACHE_KEY.format(organisation_id))
+
+
+def shard_id_range(database):
+    start = settings.DATABASE_SHARDS.index(database) * SHARD_ID_RANGE
+    return start, start + SHARD_ID_RANGE
+
+
+def reset_id_sequences(database):
+    """Move the id sequences of the tenant tables of a shard past the largest id of its range
+
+    Run by migrate_shards and by move_tenant after it copied rows with their ids. A sequence is
+    never moved back, so the ids of deleted rows aren't handed out again. (Django's
+    sequence_reset_sql would use the largest id of the whole table, which can be a moved row
+    from the range of another shard.) PostgreSQL and SQLite, the other databases keep their own.
+    """
+    connection = connections[database]
+    start, end = shard_id_range(database)
+    for model in TENANT_MODELS:
+        if not isinstance(model._meta.pk, AutoField):
+            continue # ArchivedLead keeps the id of its Lead
+        largest = model._base_manager.using(database).filter(pk__gte=start, pk__lt=end).aggregate(largest=Max('pk'))['largest']
+        value = max(largest or 0, start)
+        if not value:
+            continue
+        table = model._meta.db_table
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute('SELECT pg_get_serial_sequence(%s, %s)', [table, model._meta.pk.column])
+                sequence = cursor.fetchone()[0]
+                cursor.execute(f'SELECT last_value, is_called FROM {sequence}')
+                last_value, is_called = cursor.fetchone()
+                if value > (last_value if is_called else last_value - 1):
+                    cursor.execute('SELECT setval(%s, %s)', [sequence, value])
+            elif connection.vendor == 'sqlite':
+                # AUTOINCREMENT continues after max(seq, largest id of the table)
+                cursor.execute('UPDATE sqlite_sequence SET seq = %s WHERE name = %s AND seq < %s', [value, table, value])
+                cursor.execute('SELECT 1 FROM sqlite_sequence WHERE name = %s', [table])
+                if cursor.fetchone() is None:
+                    cursor.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)', [table, value])
+
+
+def delete_tenant_rows(organisation, database, batch_size=2000):
+    # The rows of one organisation in the tenant tables of a database, a table after the tables that
+    # point to it, with plain DELETEs in batches: no signals, so no history or counter rows are written
+    deleted = 0
+    for model in reversed(TENANT_MODELS):
+        rows = tenant_rows(model, organisation, database)
+        while True:
+            pks = list(rows.values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                break
+            deleted += delete_rows(model, pks, database)
+    return deleted
+
+
+def used_shards():
+    # 'default' and the shards that hold at least one organisation
+    if not is_sharded():
+        return [DEFAULT_DB_ALIAS]
+    databases = set(OrganisationShard.objects.using(DEFAULT_DB_ALIAS).values_list('database', flat=True))
+    return [database for database in settings.DATABASE_SHARDS if database == DEFAULT_DB_ALIAS or database in databases]
+
+
+def current_shard():
+    return _current_shard.get()
+
+
+def set_current_organisation(organisation):
+    # For the rest of a management command, requests use use_organisation() (OrganisationMiddleware)
+    _current_shard.set(organisation_shard(organisation.id)[0])
+
+
+@contextmanager
+def use_shard(database):
+    token = _current_shard.set(database)
+    try:
+        yield database
+    finally:
+        _current_shard.reset(token)
+
+
+def use_organisation(organisation):
+    # with use_organisation(organisation): ... - the whole block works on the shard of the organisation
+    return use_shard(organisation_shard(organisation.id)[0] if organisation else DEFAULT_DB_ALIAS)
+
+
+def fan_out(function):
+    # Calls function(database) for every shard at the same time, returns {database: result}
+    if not is_sharded():
+        return {DEFAULT_DB_ALIAS: function(DEFAULT_DB_ALIAS)}
+
+    def call(database):
+        try:
+            with use_shard(database):
+                return function(database)
+        finally:
+            connections[database].close() # the thread's own connection
+
+    with ThreadPoolExecutor(max_workers=len(settings.DATABASE_SHARDS)) as executor:
+        results = executor.map(call, settings.DATABASE_SHARDS)
+        return dict(zip(settings.DATABASE_SHARDS, results))
+
+
+@contextmanager
+def keep_dates(model):
+    # auto_now/auto_now_add would overwrite the dates of copied rows
+    fields = [field for field in model._meta.concrete_fields if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)]
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now = auto_now
+            field.auto_now_add = auto_now_add
+
+
+def copy_objects(model, objects, database):
+    # Insert or update the objects (with their primary keys) in another database, without signals.
+    # For the mirrored users and agents: they only get ids in 'default', so the ids never collide.
+    if not objects:
+        return
+    existing = set(
+        model._base_manager.using(database).filter(pk__in=[obj.pk for obj in objects]).values_list('pk', flat=True)
+    )
+    fields = [field.name for field in model._meta.concrete_fields if not field.primary_key]
+    with keep_dates(model):
+        model._base_manager.using(database).bulk_create([obj for obj in objects if obj.pk not in existing])
+        if existing and fields:
+            model._base_manager.using(database).bulk_update([obj for obj in objects if obj.pk in existing], fields)
+
+
+def mirror_organisation(organisation, database):
+    # The organisor, the profile and the agents (with their users) of the organisation
+    agents = list(Agent.objects.using(DEFAULT_DB_ALIAS).filter(organisation=organisation))
+    users = list(User.objects.using(DEFAULT_DB_ALIAS).filter(id__in=[organisation.user_id] + [agent.user_id for agent in agents]))
+    copy_objects(User, users, database)
+    copy_objects(UserProfile, [organisation], database)
+    copy_objects(Agent, agents, database)
+
+
+# Signals (connected in apps.py) that keep the mirrored rows of sharded organisations up to date
+
+def mirror_user_signal(sender, instance, using, update_fields=None, **kwargs):
+    if using != DEFAULT_DB_ALIAS or not is_sharded() or update_fields == frozenset(['last_login']):
+        return
+    organisation_ids = list(Agent.objects.using(DEFAULT_DB_ALIAS).filter(user=instance).values_list('organisation_id', flat=True))
+    organisation_ids += list(UserProfile.objects.using(DEFAULT_DB_ALIAS).filter(user=instance).values_list('id', flat=True))
+    for organisation_id in organisation_ids:
+        database = organisation_shard(organisation_id)[0]
+        if database != DEFAULT_DB_ALIAS:
+            copy_objects(User, [instance], database)
+
+
+def mirror_agent_signal(sender, instance, using, **kwargs):
+    if using != DEFAULT_DB_ALIAS or not is_sharded():
+        return
+    database = organisation_shard(instance.organisation_id)[0]
+    if database != DEFAULT_DB_ALIAS:
+        copy_objects(User, [instance.user], database)
+        copy_objects(Agent, [instance], database)
+
+
+def delete_mirrored_agent_signal(sender, instance, using, **kwargs):
+    if using != DEFAULT_DB_ALIAS or not is_sharded():
+        return
+    database = organisation_shard(instance.organisation_id)[0]
+    if database != DEFAULT_DB_ALIAS:
+        # the delete in the shard sets lead.agent to NULL there
+        Agent.objects.using(database).filter(pk=instance.pk).delete()
+
+
+def directory_changed_signal(sender, instance, **kwargs):
+    forget_organisation_shard(instance.organisation_id)
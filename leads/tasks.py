@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.contrib.auth.tokens import default_token_generator
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.template import loader
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+from .jobs import job
+from .models import User
+
+# Jobs, run by 'py manage.py run_workers' (see leads/jobs.py)
+
+
+@job
+def send_email(subject, body, from_email, to, html_body=None):
+    # the message is rendered in the request, only the (slow) SMTP part runs here
+    message = EmailMultiAlternatives(subject, body, from_email, to)
+    if html_body:
+        message.attach_alternative(html_body, 'text/html')
+    message.send()
+
+
+@job
+def send_agent_invitations(user_ids, domain, use_https=False):
+    # New agents have no password. The mail links to the password reset page with a token,
+    # the password is hashed when the agent sets it there. Making a token is only an HMAC, and
+    # all mails of the job go through one SMTP connection.
+    messages = []
+    for user in User.objects.filter(id__in=user_ids, is_agent=True, last_login__isnull=True):
+        context = {
+            'user': user,
+            'domain': domain,
+            'protocol': 'https' if use_https else 'http',
+            'uid': urlsafe_base64_encode(force_bytes(user.pk)),
+            'token': default_token_generator.make_token(user),
+        }
+        subject = ''.join(loader.render_to_string('registration/agent_invitation_subject.txt', context).splitlines())
+        body = loader.render_to_string('registration/agent_invitation_email.txt', context)
+        messages.append(EmailMultiAlternatives(subject, body, settings.DEFAULT_FROM_EMAIL, [user.email]))
+    get_connection().send_messages(messages)
@@ -0,0 +1,54 @@
+from django import template
+from django.conf import settings
+from django.core.cache import cache
+from leads.cache import fragment_key, count_hit, count_miss
+
+register = template.Library()
+
+
+# {% query_replace 'cursor' page_obj.next_cursor %} -> "?cursor=...&other=params"
+# Keeps the other GET parameters (for example the cursor of the second list on the page).
+@register.simple_tag(takes_context=True)
+def query_replace(context, key, value=None):
+    query = context['request'].GET.copy()
+    if value:
+        query[key] = value
+    else:
+        query.pop(key, None)
+    return f'?{query.urlencode()}'
+
+
+# {% orgcache 'lead-cards' request.agent.id search_query %} ... {% endorgcache %}
+# Like Django's {% cache %}, but the key also has the organisation of the request and its
+# version (leads/cache.py), so any change of a lead, agent or category renders the fragment again.
+# Never put {% csrf_token %} or anything else that is different per user inside.
+class OrgCacheNode(template.Node):
+    def __init__(self, nodelist, name, vary_on):
+        self.nodelist = nodelist
+        self.name = name
+        self.vary_on = vary_on
+
+    def render(self, context):
+        organisation = getattr(context['request'], 'organisation', None)
+        if organisation is None:
+            return self.nodelist.render(context)
+        name = self.name.resolve(context)
+        key = fragment_key(name, organisation.id, [var.resolve(context) for var in self.vary_on])
+        value = cache.get(key)
+        if value is not None:
+            count_hit()
+            return value
+        count_miss()
+        value = self.nodelist.render(context)
+        cache.set(key, value, settings.LEADS_FRAGMENT_CACHE_TIMEOUT)
+        return value
+
+
+@register.tag('orgcache')
+def do_orgcache(parser, token):
+    bits = token.split_contents()
+    if len(bits) < 2:
+        raise template.TemplateSyntaxError("'orgcache' tag requires at least 1 argument (the fragment name).")
+    nodelist = parser.parse(('endorgcache',))
+    parser.delete_first_token()
+    return OrgCacheNode(nodelist, parser.compile_filter(bits[1]), [parser.compile_filter(bit) for bit in bits[2:]])
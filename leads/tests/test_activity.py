@@ -0,0 +1,119 @@
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from leads.activity import collect_activity
+from leads.models import User, Agent, Lead, Category, LeadActivity
+
+
+class LeadActivityTest(TransactionTestCase):
+    # the history of a request is collected when its changes are committed, TestCase never commits
+
+    def setUp(self):
+        self.organisor = User.objects.create_user(username='organisor', password='test')
+        self.organisation = self.organisor.userprofile
+        agent_user = User.objects.create_user(username='ana', password='test', is_organisor=False, is_agent=True)
+        self.agent = Agent.objects.create(user=agent_user, organisation=self.organisation)
+        self.category = Category.objects.create(name='Contacted', organisation=self.organisation)
+        self.leads = [
+            Lead.objects.create(
+                first_name=f'Lead{i}', last_name='Test', organisation=self.organisation,
+                phone_number='123', email=f'lead{i}@test.com'
+            )
+            for i in range(3)
+        ]
+        LeadActivity.objects.all().delete()
+        self.client.force_login(self.organisor)
+
+    def activity_inserts(self, queries):
+        return [query['sql'] for query in queries if query['sql'].startswith('INSERT INTO "leads_leadactivity"')]
+
+    def test_update_logs_the_changed_fields_with_one_insert(self):
+        lead = self.leads[0]
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(reverse('leads:lead-update', args=[lead.pk]), {
+                'first_name': 'Changed', 'last_name': 'Test', 'age': 0, 'agent': self.agent.pk,
+                'phone_number': '123', 'email': 'lead0@test.com', 'allow_duplicate': 'on'
+            })
+        self.assertEqual(len(self.activity_inserts(queries)), 1)
+        activity = LeadActivity.objects.get()
+        self.assertEqual((activity.lead_id, activity.action, activity.actor), (lead.id, LeadActivity.UPDATED, self.organisor))
+        self.assertEqual(activity.changes, {'first_name': ['Lead0', 'Changed'], 'agent': [None, self.agent.id]})
+
+    def test_assign_category_create_and_delete(self):
+        lead = self.leads[0]
+        self.client.post(reverse('leads:assign-agent', args=[lead.pk]), {'agent': self.agent.pk})
+        self.client.post(reverse('leads:lead-category-update', args=[lead.pk]), {'category': self.category.pk})
+        lead_id = lead.id
+        lead.delete()
+        changes = list(LeadActivity.objects.filter(lead_id=lead_id).order_by('id').values_list('action', 'changes'))
+        self.assertEqual(changes, [
+            ('updated', {'agent': [None, self.agent.id]}),
+            ('updated', {'category': [None, self.category.id]}),
+            ('deleted', {}),
+        ])
+        created = Lead.objects.create(first_name='New', last_name='Lead', organisation=self.organisation, phone_number='1', email='new@test.com')
+        self.assertEqual(LeadActivity.objects.get(lead_id=created.id).action, LeadActivity.CREATED)
+
+    def test_unchanged_save_logs_nothing(self):
+        self.leads[0].save()
+        self.assertFalse(LeadActivity.objects.exists())
+
+    def test_rolled_back_change_is_not_logged(self):
+        with collect_activity():
+            try:
+                with transaction.atomic():
+                    lead = self.leads[0]
+                    lead.agent = self.agent
+                    lead.save()
+                    raise ValueError
+            except ValueError:
+                pass
+        self.assertFalse(LeadActivity.objects.exists())
+
+    def test_bulk_assign_logs_every_lead_with_one_insert(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(reverse('leads:bulk-assign-agent'), {
+                'agent': self.agent.id, 'leads': [lead.id for lead in self.leads]
+            })
+        self.assertEqual(len(self.activity_inserts(queries)), 1)
+        self.assertEqual(LeadActivity.objects.filter(actor=self.organisor, changes__agent=[None, self.agent.id]).count(), 3)
+
+    def test_select_all_writes_the_history_in_chunks(self):
+        with mock.patch('leads.activity.BULK_INSERT_SIZE', 2), CaptureQueriesContext(connection) as queries:
+            self.client.post(reverse('leads:bulk-assign-agent'), {'agent': self.agent.id, 'select_all': 'on'})
+        self.assertEqual(len(self.activity_inserts(queries)), 2)
+        self.assertEqual(LeadActivity.objects.filter(changes__agent=[None, self.agent.id]).count(), 3)
+
+    def test_history_page(self):
+        lead = self.leads[0]
+        self.client.post(reverse('leads:assign-agent', args=[lead.pk]), {'agent': self.agent.pk})
+        response = self.client.get(reverse('leads:lead-history', args=[lead.pk]))
+        self.assertContains(response, 'Updated by organisor')
+        self.assertContains(response, '- &rarr; ana')
+
+    async def test_sync_view_under_asgi(self):
+        lead = self.leads[0]
+        await self.async_client.aforce_login(self.organisor)
+        response = await self.async_client.post(reverse('leads:assign-agent', args=[lead.pk]), {'agent': self.agent.pk})
+        self.assertEqual(response.status_code, 302)
+        activity = await LeadActivity.objects.aget()
+        self.assertEqual((activity.lead_id, activity.actor_id), (lead.id, self.organisor.id))
+        self.assertEqual(activity.changes, {'agent': [None, self.agent.id]})
+
+    def test_prune(self):
+        old = LeadActivity.objects.create(organisation=self.organisation, lead_id=1, action=LeadActivity.CREATED)
+        LeadActivity.objects.filter(id=old.id).update(date_added=timezone.now() - timedelta(days=400))
+        recent = LeadActivity.objects.create(organisation=self.organisation, lead_id=1, action=LeadActivity.DELETED)
+        with CaptureQueriesContext(connection) as queries:
+            call_command('prune_lead_activity', days=365, batch_size=1, stdout=StringIO())
+        self.assertEqual(list(LeadActivity.objects.all()), [recent])
+        # no SELECT of the rows to delete, no collector
+        deletes = [query['sql'] for query in queries if query['sql'].startswith('DELETE')]
+        self.assertEqual(len(deletes), 1)
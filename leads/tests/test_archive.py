@@ -0,0 +1,127 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.db.models import Sum
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from leads.archive import LeadArchiver
+from leads.counts import category_lead_counts
+from leads.models import User, Agent, Lead, ArchivedLead, Category, ArchivePolicy, AgentLeadCount, LeadActivity, LeadDailyCount
+
+
+class ArchiveTest(TestCase):
+
+    def setUp(self):
+        self.organisor = User.objects.create_user(username='organisor', password='test')
+        self.organisation = self.organisor.userprofile
+        agent_user = User.objects.create_user(username='agent', password='test', is_organisor=False, is_agent=True)
+        self.agent = Agent.objects.create(user=agent_user, organisation=self.organisation)
+        self.converted = Category.objects.create(name='Converted', organisation=self.organisation)
+        self.new = Category.objects.create(name='New', organisation=self.organisation)
+        self.policy = ArchivePolicy.objects.create(organisation=self.organisation, enabled=True, archive_after_days=90)
+        self.policy.categories.add(self.converted)
+
+        old = timezone.now() - timedelta(days=200)
+        self.old_converted = [self.create_lead(f'Old{i}', self.converted, old) for i in range(5)]
+        self.old_new = self.create_lead('OldNew', self.new, old)
+        self.recent = self.create_lead('Recent', self.converted, timezone.now())
+
+    def create_lead(self, name, category, date_added):
+        lead = Lead.objects.create(
+            first_name=name, last_name='Test', organisation=self.organisation, agent=self.agent,
+            category=category, phone_number='123', email=f'{name.lower()}@test.com'
+        )
+        # date_added is auto_now_add
+        Lead.objects.filter(id=lead.id).update(date_added=date_added)
+        return lead
+
+    def test_policy_selects_old_leads_of_its_categories(self):
+        archiver = LeadArchiver(self.policy, chunk_size=2).run()
+        self.assertEqual(archiver.archived, 5)
+        self.assertTrue(archiver.finished)
+        self.assertEqual(
+            set(ArchivedLead.objects.values_list('id', flat=True)),
+            {lead.id for lead in self.old_converted}
+        )
+        self.assertEqual(
+            set(Lead.objects.values_list('id', flat=True)),
+            {self.old_new.id, self.recent.id}
+        )
+        archived = ArchivedLead.objects.get(id=self.old_converted[0].id)
+        self.assertEqual((archived.first_name, archived.email_normalized), ('Old0', 'old0@test.com'))
+
+    def test_archiving_is_no_deletion(self):
+        # the hot rows are removed without the post_delete signals of Lead
+        LeadArchiver(self.policy).run()
+        self.assertFalse(LeadActivity.objects.filter(action=LeadActivity.DELETED).exists())
+        # the intake rollup counts archived leads as well
+        self.assertEqual(LeadDailyCount.objects.aggregate(total=Sum('count'))['total'], 7)
+
+    def test_command_can_stop_and_continue(self):
+        out = StringIO()
+        call_command('archive_leads', chunk_size=2, max_chunks=1, stdout=out)
+        self.assertIn('2 leads archived (not finished', out.getvalue())
+        call_command('archive_leads', chunk_size=2, stdout=out)
+        self.assertEqual(ArchivedLead.objects.count(), 5)
+
+    def test_disabled_policy_archives_nothing(self):
+        ArchivePolicy.objects.update(enabled=False)
+        call_command('archive_leads', stdout=StringIO())
+        self.assertFalse(ArchivedLead.objects.exists())
+
+    @override_settings(LEADS_USE_CATEGORY_COUNTERS=True)
+    def test_category_counters_only_count_hot_leads(self):
+        call_command('rebuild_category_counts', stdout=StringIO())
+        LeadArchiver(self.policy).run()
+        counts = category_lead_counts(self.organisation)
+        self.assertEqual((counts[self.converted.id], counts[self.new.id]), (1, 1))
+        loads = dict(AgentLeadCount.objects.values_list('category', 'count'))
+        self.assertEqual(loads, {self.converted.id: 1, self.new.id: 1})
+
+    def test_lead_list_shows_only_hot_leads(self):
+        LeadArchiver(self.policy).run()
+        self.client.force_login(self.organisor)
+        response = self.client.get(reverse('leads:lead-list'))
+        self.assertContains(response, 'Recent')
+        self.assertNotContains(response, 'Old0')
+
+    def test_archived_lead_keeps_its_page(self):
+        LeadArchiver(self.policy).run()
+        lead = self.old_converted[0]
+        self.client.force_login(self.agent.user)
+        response = self.client.get(reverse('leads:lead-detail', args=[lead.id]))
+        self.assertContains(response, 'Old0')
+        self.assertContains(response, 'Archived on')
+        self.assertNotContains(response, reverse('leads:lead-update', args=[lead.id]))
+
+    def test_archived_lead_of_another_agent_is_not_found(self):
+        LeadArchiver(self.policy).run()
+        other_user = User.objects.create_user(username='other', password='test', is_organisor=False, is_agent=True)
+        Agent.objects.create(user=other_user, organisation=self.organisation)
+        self.client.force_login(other_user)
+        response = self.client.get(reverse('leads:lead-detail', args=[self.old_converted[0].id]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_export_can_include_archived_leads(self):
+        LeadArchiver(self.policy).run()
+        self.client.force_login(self.organisor)
+        response = self.client.get(reverse('leads:lead-export'))
+        self.assertEqual(len(b''.join(response.streaming_content).splitlines()), 1 + 2)
+        response = self.client.get(reverse('leads:lead-export'), {'archived': 'on', 'format': 'jsonl'})
+        lines = b''.join(response.streaming_content).splitlines()
+        self.assertEqual(len(lines), 7)
+        # one list in id order, the archived leads between the others
+        ids = [int(line.split(b',')[0].split(b':')[1]) for line in lines]
+        self.assertEqual(ids, sorted(ids))
+
+    def test_policy_page(self):
+        self.client.force_login(self.organisor)
+        response = self.client.post(reverse('leads:archive-policy'), {
+            'enabled': 'on', 'archive_after_days': 30, 'categories': [self.new.id]
+        })
+        self.assertEqual(response.status_code, 302)
+        policy = ArchivePolicy.objects.get()
+        self.assertEqual(policy.archive_after_days, 30)
+        self.assertEqual(list(policy.categories.all()), [self.new])
@@ -0,0 +1,50 @@
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from leads.models import User, Agent, Lead, Category
+
+
+class BulkAssignAgentTest(TestCase):
+
+    def setUp(self):
+        self.organisor = User.objects.create_user(username='organisor', password='test')
+        self.organisation = self.organisor.userprofile
+        agent_user = User.objects.create_user(username='agent', password='test', is_organisor=False, is_agent=True)
+        self.agent = Agent.objects.create(user=agent_user, organisation=self.organisation)
+        self.category = Category.objects.create(name='New', organisation=self.organisation)
+        self.leads = [
+            Lead.objects.create(first_name=f'Lead{i}', last_name='Test', organisation=self.organisation,
+                                category=self.category if i < 3 else None, phone_number='1', email='a@test.com')
+            for i in range(5)
+        ]
+        other = User.objects.create_user(username='other', password='test')
+        self.foreign_lead = Lead.objects.create(first_name='Foreign', last_name='Lead', organisation=other.userprofile,
+                                                phone_number='1', email='f@test.com')
+        self.client.force_login(self.organisor)
+
+    def test_selected_leads_are_assigned_with_one_update(self):
+        ids = [self.leads[0].id, self.leads[1].id, self.foreign_lead.id]
+        url = reverse('leads:bulk-assign-agent')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url, {'agent': self.agent.id, 'leads': ids})
+        lead_queries = [query['sql'] for query in queries if 'FROM "leads_lead"' in query['sql'] or 'UPDATE "leads_lead"' in query['sql']]
+        # the UPDATE, and before it the grouped SELECT of the daily rollup (leads/rollup.py)
+        # and the SELECT of the old agents for the history (leads/activity.py)
+        self.assertEqual(len(lead_queries), 3)
+        self.assertIn('GROUP BY', lead_queries[0])
+        self.assertTrue(lead_queries[2].startswith('UPDATE'))
+        self.assertRedirects(response, reverse('leads:lead-list'), fetch_redirect_response=False)
+        self.assertEqual(Lead.objects.filter(agent=self.agent).count(), 2)
+        self.foreign_lead.refresh_from_db()
+        self.assertIsNone(self.foreign_lead.agent)
+
+    def test_all_unassigned_leads_in_category(self):
+        self.client.post(reverse('leads:bulk-assign-agent'), {
+            'agent': self.agent.id, 'select_all': 'on', 'category': self.category.id
+        })
+        self.assertEqual(Lead.objects.filter(agent=self.agent).count(), 3)
+
+    def test_single_assign_checks_organisation(self):
+        response = self.client.post(reverse('leads:assign-agent', args=[self.foreign_lead.pk]), {'agent': self.agent.id})
+        self.assertEqual(response.status_code, 404)
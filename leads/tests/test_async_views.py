@@ -0,0 +1,88 @@
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.http import Http404
+from django.test import TestCase, AsyncRequestFactory
+from leads.backends import OrganisationModelBackend
+from leads.middleware import OrganisationMiddleware
+from leads.models import User, Agent, Lead, Category
+from leads.views import AsyncLeadListView, AsyncLeadDetailView, AsyncCategoryListView, AsyncCategoryDetailView
+
+
+class AsyncViewsTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        organisor = User.objects.create_user(username='organisor', password='test')
+        self.organisation = organisor.userprofile
+        agent_user = User.objects.create_user(username='agent', password='test', is_organisor=False, is_agent=True)
+        self.agent = Agent.objects.create(user=agent_user, organisation=self.organisation)
+        self.category = Category.objects.create(name='New', organisation=self.organisation)
+        self.lead = Lead.objects.create(first_name='Ana', last_name='Novak', organisation=self.organisation,
+                                        agent=self.agent, category=self.category, phone_number='1', email='a@test.com')
+        self.unassigned = Lead.objects.create(first_name='Bor', last_name='Kos', organisation=self.organisation,
+                                              phone_number='2', email='b@test.com')
+        other = User.objects.create_user(username='other', password='test')
+        self.foreign_lead = Lead.objects.create(first_name='Foreign', last_name='Lead', organisation=other.userprofile,
+                                                phone_number='3', email='f@test.com')
+        # loaded like in a request, with the profile, agent and organisation
+        self.organisor = OrganisationModelBackend().get_user(organisor.id)
+        self.agent_user = OrganisationModelBackend().get_user(agent_user.id)
+
+    async def get(self, view_class, user, path='/', **kwargs):
+        # The request goes through OrganisationMiddleware in async mode, like under ASGI
+        request = AsyncRequestFactory().get(path)
+
+        async def auser():
+            return user
+        request.auser = auser
+        request.user = AnonymousUser() # replaced by the middleware
+
+        async def view(request):
+            return await view_class.as_view()(request, **kwargs)
+        response = await OrganisationMiddleware(view)(request)
+        if hasattr(response, 'render'):
+            # ASGIHandler renders in a thread as well
+            await sync_to_async(response.render)()
+        return response
+
+    async def test_lead_list_loads_both_pages_in_the_view(self):
+        response = await self.get(AsyncLeadListView, self.organisor)
+        # the pages were loaded before rendering (no lazy queries in async code)
+        self.assertIn('_rows', response.context_data['page_obj'].__dict__)
+        self.assertIn('_rows', response.context_data['unassigned_page_obj'].__dict__)
+        self.assertContains(response, 'Ana')
+        self.assertContains(response, 'Bor')
+        self.assertNotContains(response, 'Foreign')
+
+    async def test_agent_sees_only_own_leads(self):
+        response = await self.get(AsyncLeadListView, self.agent_user)
+        self.assertContains(response, 'Ana')
+        self.assertNotContains(response, 'Bor')
+
+    async def test_lead_detail_is_scoped_to_the_organisation(self):
+        response = await self.get(AsyncLeadDetailView, self.organisor, pk=self.lead.pk)
+        self.assertContains(response, 'Novak')
+        with self.assertRaises(Http404):
+            await self.get(AsyncLeadDetailView, self.organisor, pk=self.foreign_lead.pk)
+
+    async def test_category_list_counts(self):
+        response = await self.get(AsyncCategoryListView, self.organisor)
+        category = response.context_data['category_list'][0]
+        self.assertEqual(category.lead_count, 1)
+        self.assertEqual(response.context_data['unassigned_lead_count'], 1)
+
+    async def test_category_detail(self):
+        response = await self.get(AsyncCategoryDetailView, self.organisor, pk=self.category.pk)
+        self.assertContains(response, 'Ana')
+
+    async def test_anonymous_user_is_redirected(self):
+        response = await self.get(AsyncLeadListView, AnonymousUser())
+        self.assertEqual(response.status_code, 302)
+
+    async def test_cached_fragments_are_not_loaded(self):
+        await self.get(AsyncLeadListView, self.organisor)
+        response = await self.get(AsyncLeadListView, self.organisor)
+        self.assertNotIn('_rows', response.context_data['page_obj'].__dict__)
+        self.assertNotIn('_rows', response.context_data['unassigned_page_obj'].__dict__)
+        self.assertContains(response, 'Bor')
@@ -0,0 +1,77 @@
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from leads.assignment import bulk_assign
+from leads.cache import fragment_cache_stats, organisation_version
+from leads.models import User, Agent, Lead
+
+
+class LeadFragmentCacheTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.organisor = User.objects.create_user(username='organisor', password='test')
+        self.organisation = self.organisor.userprofile
+        agent_user = User.objects.create_user(username='agent', password='test', is_organisor=False, is_agent=True)
+        self.agent = Agent.objects.create(user=agent_user, organisation=self.organisation)
+        self.lead = Lead.objects.create(first_name='Ana', last_name='Novak', organisation=self.organisation,
+                                        agent=self.agent, phone_number='1', email='ana@test.com')
+        self.unassigned = Lead.objects.create(first_name='Bor', last_name='Kos', organisation=self.organisation,
+                                              phone_number='2', email='bor@test.com')
+        self.client.force_login(self.organisor)
+
+    def test_second_request_does_not_query_leads(self):
+        url = reverse('leads:lead-list')
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertContains(response, 'Ana')
+        self.assertContains(response, 'Bor')
+        self.assertFalse([query['sql'] for query in queries if 'leads_lead' in query['sql']])
+        self.assertEqual(fragment_cache_stats()['hits'], 2) # lead cards and unassigned leads
+        self.assertEqual(fragment_cache_stats()['misses'], 2)
+
+    def test_saving_a_lead_drops_the_fragments(self):
+        url = reverse('leads:lead-list')
+        self.client.get(url)
+        version = organisation_version(self.organisation.id)
+        self.lead.first_name = 'Eva'
+        self.lead.save()
+        self.assertGreater(organisation_version(self.organisation.id), version)
+        self.assertContains(self.client.get(url), 'Eva')
+
+    def test_bulk_assign_drops_the_fragments(self):
+        url = reverse('leads:lead-list')
+        self.client.get(url)
+        bulk_assign(self.organisation, self.agent, lead_ids=[self.unassigned.id])
+        response = self.client.get(url)
+        self.assertNotContains(response, 'value="%s"' % self.unassigned.id)
+
+    def test_agents_and_organisations_have_their_own_fragments(self):
+        url = reverse('leads:lead-list')
+        self.client.get(url)
+        other = User.objects.create_user(username='other', password='test')
+        self.client.force_login(other)
+        self.assertNotContains(self.client.get(url), 'Ana')
+        # the agent only sees their own leads, not the organisor's fragment with unassigned leads
+        self.client.force_login(self.agent.user)
+        response = self.client.get(url)
+        self.assertContains(response, 'Ana')
+        self.assertNotContains(response, 'Bor')
+
+    def test_page_links_do_not_leak_the_other_cursor(self):
+        # both lists get a second page
+        for i in range(20):
+            Lead.objects.create(first_name=f'Lead{i}', last_name='Test', organisation=self.organisation,
+                                agent=self.agent if i % 2 else None, phone_number='3', email=f'lead{i}@test.com')
+            Lead.objects.create(first_name=f'Other{i}', last_name='Test', organisation=self.organisation,
+                                agent=None if i % 2 else self.agent, phone_number='3', email=f'other{i}@test.com')
+        url = reverse('leads:lead-list')
+        cursor = self.client.get(url).context['unassigned_page_obj'].next_cursor
+        cache.clear()
+        self.assertContains(self.client.get(url, {'unassigned_cursor': cursor}), f'unassigned_cursor={cursor}')
+        # the first page of both lists: only the next link of the unassigned leads has the cursor,
+        # not the next link of the lead cards
+        self.assertContains(self.client.get(url), f'unassigned_cursor={cursor}', count=1)
@@ -0,0 +1,72 @@
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+from leads.models import User, Agent, Lead, Category
+
+
+class ConditionalGetTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.organisor = User.objects.create_user(username='organisor', password='test')
+        self.organisation = self.organisor.userprofile
+        agent_user = User.objects.create_user(username='agent', password='test', is_organisor=False, is_agent=True)
+        self.agent = Agent.objects.create(user=agent_user, organisation=self.organisation)
+        self.category = Category.objects.create(name='New', organisation=self.organisation)
+        self.lead = Lead.objects.create(first_name='Ana', last_name='Novak', organisation=self.organisation,
+                                        agent=self.agent, phone_number='1', email='a@test.com')
+        self.client.force_login(self.organisor)
+        self.list_url = reverse('leads:lead-list')
+        self.detail_url = reverse('leads:lead-detail', args=[self.lead.pk])
+
+    def revalidate(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+
+    def test_unchanged_pages_return_304_without_queries(self):
+        # the lead page reads the version of its lead
+        for url, queries in ((self.list_url, 0), (self.detail_url, 1), (reverse('leads:category-list'), 0),
+                             (reverse('leads:category-detail', args=[self.category.pk]), 0)):
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertIn('no-cache', response['Cache-Control'])
+                with self.assertNumQueries(queries):
+                    response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+                self.assertEqual(response.status_code, 304)
+
+    def test_other_leads_do_not_reload_the_lead_page(self):
+        etag = self.client.get(self.detail_url)['ETag']
+        list_etag = self.client.get(self.list_url)['ETag']
+        Lead.objects.create(first_name='Eva', last_name='Kos', organisation=self.organisation, phone_number='2', email='e@test.com')
+        self.assertEqual(self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get(self.list_url, HTTP_IF_NONE_MATCH=list_etag).status_code, 200)
+
+    def test_if_modified_since(self):
+        response = self.client.get(self.list_url)
+        response = self.client.get(self.list_url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_every_user_has_own_etag(self):
+        etag = self.client.get(self.list_url)['ETag']
+        self.client.force_login(self.agent.user)
+        response = self.client.get(self.list_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def assertChangeReloads(self, url, data):
+        etag = self.client.get(self.detail_url)['ETag']
+        self.client.post(url, data)
+        response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertNotEqual(response.status_code, 304)
+
+    def test_lead_changes_bump_the_version(self):
+        other_agent_user = User.objects.create_user(username='agent2', password='test', is_organisor=False, is_agent=True)
+        other_agent = Agent.objects.create(user=other_agent_user, organisation=self.organisation)
+        self.assertChangeReloads(reverse('leads:lead-update', args=[self.lead.pk]), {
+            'first_name': 'Eva', 'last_name': 'Novak', 'age': 30, 'agent': self.agent.pk,
+            'description': '', 'phone_number': '1', 'email': 'a@test.com'
+        })
+        self.assertChangeReloads(reverse('leads:assign-agent', args=[self.lead.pk]), {'agent': other_agent.pk})
+        self.assertChangeReloads(reverse('leads:lead-category-update', args=[self.lead.pk]), {'category': self.category.pk})
+        self.assertChangeReloads(reverse('leads:bulk-assign-agent'), {'agent': self.agent.pk, 'leads': [self.lead.pk]})
+        self.assertChangeReloads(reverse('leads:lead-delete', args=[self.lead.pk]), {})
@@ -0,0 +1,75 @@
+from io import StringIO
+from unittest import mock
+from django.core.management import call_command
+from django.db import IntegrityError, transaction
+from django.db.models import QuerySet
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from leads.counts import category_lead_counts
+from leads.models import User, Lead, Category, CategoryLeadCount
+
+
+class CategoryLeadCountTest(TestCase):
+
+    def setUp(self):
+        self.organisor = User.objects.create_user(username='organisor', password='test')
+        self.organisation = self.organisor.userprofile
+        self.new = Category.objects.create(name='New', organisation=self.organisation)
+        self.contacted = Category.objects.create(name='Contacted', organisation=self.organisation)
+
+    def create_lead(self, category):
+        return Lead.objects.create(
+            first_name='Lead', last_name='Test', organisation=self.organisation,
+            category=category, phone_number='123', email='lead@test.com'
+        )
+
+    def test_category_list_counts_in_one_query(self):
+        self.create_lead(self.new)
+        self.create_lead(self.new)
+        self.create_lead(None)
+        with self.assertNumQueries(1):
+            counts = category_lead_counts(self.organisation)
+        self.assertEqual(counts, {self.new.id: 2, None: 1})
+
+        self.client.force_login(self.organisor)
+        response = self.client.get(reverse('leads:category-list'))
+        self.assertEqual(response.context['unassigned_lead_count'], 1)
+        lead_counts = {category.name: category.lead_count for category in response.context['category_list']}
+        self.assertEqual(lead_counts, {'New': 2, 'Contacted': 0})
+
+    @override_settings(LEADS_USE_CATEGORY_COUNTERS=True)
+    def test_counters_follow_create_update_and_delete(self):
+        lead = self.create_lead(self.new)
+        other = self.create_lead(self.new)
+        lead.category = self.contacted
+        lead.save()
+        other.delete()
+        self.assertEqual(category_lead_counts(self.organisation), {self.new.id: 0, self.contacted.id: 1})
+
+        self.contacted.delete()
+        self.assertEqual(category_lead_counts(self.organisation), {self.new.id: 0, None: 1})
+
+    @override_settings(LEADS_USE_CATEGORY_COUNTERS=True)
+    def test_rebuild_command_repairs_drift(self):
+        self.create_lead(self.new)
+        CategoryLeadCount.objects.update(count=42)
+        call_command('rebuild_category_counts', stdout=StringIO())
+        self.assertEqual(category_lead_counts(self.organisation), {self.new.id: 1})
+
+    def test_one_counter_per_category(self):
+        CategoryLeadCount.objects.create(organisation=self.organisation, category=None, count=1)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            CategoryLeadCount.objects.create(organisation=self.organisation, category=None, count=1)
+
+    def test_adjust_when_another_request_created_the_counter(self):
+        CategoryLeadCount.objects.create(organisation=self.organisation, category=self.new, count=1)
+        update = QuerySet.update
+        calls = []
+        def update_after_the_other_request(queryset, **kwargs):
+            # the first UPDATE ran before the other request committed its INSERT
+            calls.append(kwargs)
+            return 0 if len(calls) == 1 else update(queryset, **kwargs)
+        with mock.patch.object(QuerySet, 'update', update_after_the_other_request):
+            CategoryLeadCount.adjust(self.organisation.id, self.new.id, 2)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(list(CategoryLeadCount.objects.values_list('category', 'count')), [(self.new.id, 3)])
@@ -0,0 +1,72 @@
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from leads.dashboard import agent_dashboard
+from leads.models import User, Agent, Lead, Category
+
+
+class AgentDashboardTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.organisor = User.objects.create_user(username='organisor', password='test')
+        self.organisation = self.organisor.userprofile
+        self.categories = {
+            name: Category.objects.create(name=name, organisation=self.organisation)
+            for name in ('Contacted', 'Converted', 'Unconverted')
+        }
+        self.ana = self.create_agent('ana')
+        self.bor = self.create_agent('bor')
+        self.create_agent('cene') # no leads
+        self.create_leads(self.ana, 'Contacted', 2)
+        self.create_leads(self.ana, 'Converted', 3)
+        self.create_leads(self.ana, 'Unconverted', 1, days_ago=20)
+        self.create_leads(self.ana, None, 1, days_ago=60)
+        self.create_leads(self.bor, 'Contacted', 4, days_ago=10)
+
+    def create_agent(self, username):
+        user = User.objects.create_user(username=username, password='test', is_organisor=False, is_agent=True)
+        return Agent.objects.create(user=user, organisation=self.organisation)
+
+    def create_leads(self, agent, category, count, days_ago=0):
+        for i in range(count):
+            lead = Lead.objects.create(
+                first_name='Lead', last_name='Test', organisation=self.organisation, agent=agent,
+                category=self.categories.get(category), phone_number='123', email='lead@test.com'
+            )
+            Lead.objects.filter(id=lead.id).update(date_added=timezone.now() - timedelta(days=days_ago))
+
+    def test_matrix(self):
+        dashboard = agent_dashboard(self.organisation)
+        self.assertEqual(dashboard['categories'], ['Contacted', 'Converted', 'Unconverted', 'No category'])
+        ana, bor, cene = dashboard['agents']
+        self.assertEqual(ana['category_counts'], [2, 3, 1, 1])
+        self.assertEqual((ana['open'], ana['last_7_days'], ana['last_30_days']), (3, 5, 6))
+        self.assertEqual(ana['conversion_rate'], 0.75)
+        self.assertEqual((bor['open'], bor['last_7_days'], bor['last_30_days']), (4, 0, 4))
+        self.assertIsNone(bor['conversion_rate'])
+        self.assertEqual((cene['username'], cene['category_counts'], cene['total']), ('cene', [0, 0, 0, 0], 0))
+
+    def test_one_query_then_cached_until_a_change(self):
+        with CaptureQueriesContext(connection) as queries:
+            agent_dashboard(self.organisation)
+        self.assertEqual(len(queries), 1)
+        with self.assertNumQueries(0):
+            agent_dashboard(self.organisation)
+        self.create_leads(self.bor, 'Converted', 1)
+        self.assertEqual(agent_dashboard(self.organisation)['agents'][1]['conversion_rate'], 1)
+
+    def test_page_query_count_does_not_grow_with_agents(self):
+        self.client.force_login(self.organisor)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('agents:agent-dashboard'))
+        self.assertContains(response, '75%')
+        for i in range(10):
+            self.create_leads(self.create_agent(f'agent{i}'), 'Contacted', 1)
+        with self.assertNumQueries(len(queries)):
+            self.client.get(reverse('agents:agent-dashboard'))
@@ -0,0 +1,108 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from leads.counts import category_lead_counts
+from leads.deletion import Cascade, delete_later
+from leads.jobs import run_available_jobs
+from leads.models import User, UserProfile, Agent, Lead, ArchivedLead, Category, CategoryLeadCount, Deletion, Job
+
+
+@override_settings(LEADS_DELETION_BATCH_SIZE=2, LEADS_DELETION_BATCHES_PER_JOB=3)
+class DeletionTest(TestCase):
+
+    def setUp(self):
+        self.organisor = User.objects.create_user(username='organisor', password='test')
+        self.organisation = self.organisor.userprofile
+        self.agent_user = User.objects.create_user(username='agent', password='test', is_organisor=False, is_agent=True)
+        self.agent = Agent.objects.create(user=self.agent_user, organisation=self.organisation)
+        self.category = Category.objects.create(name='Contacted', organisation=self.organisation)
+        self.category.routing_agents.add(self.agent)
+        for i in range(5):
+            Lead.objects.create(
+                first_name=f'Lead{i}', last_name='Test', organisation=self.organisation, agent=self.agent,
+                category=self.category, phone_number=f'12{i}', email=f'lead{i}@test.com'
+            )
+
+    def test_agent_is_hidden_right_away_and_deleted_by_the_worker(self):
+        self.client.force_login(self.organisor)
+        response = self.client.post(reverse('agents:agent-delete', args=[self.agent.pk]))
+        self.assertRedirects(response, reverse('agents:agent-list'))
+        self.agent.refresh_from_db()
+        self.assertTrue(self.agent.deleting)
+        self.assertEqual(Lead.objects.filter(agent=self.agent).count(), 5)
+        self.assertNotContains(self.client.get(reverse('agents:agent-list')), 'agent@')
+        self.assertEqual(self.client.get(reverse('agents:agent-detail', args=[self.agent.pk])).status_code, 404)
+        # and can't log in anymore
+        self.assertFalse(self.client.login(username='agent', password='test'))
+
+        run_available_jobs()
+        self.assertFalse(Agent.objects.filter(pk=self.agent.pk).exists())
+        self.assertEqual(Lead.objects.filter(agent__isnull=True).count(), 5)
+        self.assertFalse(Category.routing_agents.through.objects.exists())
+        deletion = Deletion.objects.get()
+        self.assertEqual((deletion.status, deletion.rows_done), (Deletion.DONE, 6))
+
+    @override_settings(LEADS_DELETION_BATCHES_PER_JOB=2)
+    def test_big_deletion_is_split_into_jobs(self):
+        delete_later(self.agent)
+        # 2 batches of 2 leads per job
+        run_available_jobs(limit=1)
+        self.assertEqual(Lead.objects.filter(agent__isnull=True).count(), 4)
+        deletion = Deletion.objects.get()
+        self.assertEqual((deletion.status, deletion.step), (Deletion.RUNNING, 'leads'))
+        self.assertEqual(Job.objects.filter(status=Job.QUEUED).count(), 1)
+        run_available_jobs()
+        self.assertEqual(Deletion.objects.get().status, Deletion.DONE)
+
+    @override_settings(LEADS_USE_CATEGORY_COUNTERS=True)
+    def test_category_leads_move_to_unassigned(self):
+        call_command('rebuild_category_counts', stdout=StringIO())
+        self.client.force_login(self.organisor)
+        response = self.client.post(reverse('leads:category-detail', args=[self.category.pk]))
+        self.assertRedirects(response, reverse('leads:category-list'))
+        self.assertNotContains(self.client.get(reverse('leads:category-list')), 'Contacted')
+        run_available_jobs()
+        self.assertFalse(Category.objects.exists())
+        self.assertEqual(Lead.objects.filter(category__isnull=True).count(), 5)
+        self.assertEqual(category_lead_counts(self.organisation), {None: 5})
+
+    def test_agents_cant_delete_categories(self):
+        self.client.force_login(self.agent_user)
+        response = self.client.post(reverse('leads:category-detail', args=[self.category.pk]))
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(Category.objects.get().deleting)
+
+    def test_deleting_category_is_not_a_choice(self):
+        self.category.deleting = True
+        self.category.save()
+        lead = Lead.objects.first()
+        self.client.force_login(self.organisor)
+        response = self.client.post(reverse('leads:lead-category-update', args=[lead.pk]), {'category': self.category.pk})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['form'].errors)
+
+    def test_organisation(self):
+        ArchivedLead.objects.create(
+            id=1000, first_name='Old', last_name='Test', organisation=self.organisation,
+            date_added='2020-01-01T00:00Z', date_archived='2021-01-01T00:00Z'
+        )
+        CategoryLeadCount.objects.create(organisation=self.organisation, category=self.category, count=5)
+        out = StringIO()
+        call_command('delete_organisation', self.organisation.pk, stdout=out)
+        self.assertIn('is being deleted', out.getvalue())
+        self.assertFalse(self.client.login(username='organisor', password='test'))
+        run_available_jobs()
+        self.assertFalse(UserProfile.objects.exists())
+        for model in (Lead, ArchivedLead, Category, CategoryLeadCount, Agent):
+            self.assertFalse(model.objects.exists(), model)
+        self.assertEqual(Deletion.objects.get().status, Deletion.DONE)
+
+    def test_cascade_needs_a_delete_object(self):
+        class NoDelete(Cascade):
+            def steps(self):
+                return []
+        deletion = Deletion(kind=Deletion.CATEGORY, object_id=self.category.id, organisation_id=self.organisation.id)
+        with self.assertRaises(TypeError):
+            NoDelete(deletion, 'default')
@@ -0,0 +1,85 @@
+import json
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase, SimpleTestCase, override_settings
+from django.urls import reverse
+from leads.duplicates import normalize_email, normalize_phone, DuplicateClusters
+from leads.models import User, Lead
+
+
+class NormalizeTest(SimpleTestCase):
+
+    def test_email(self):
+        self.assertEqual(normalize_email('  Ana.Novak@Example.COM '), 'ana.novak@example.com')
+
+    @override_settings(LEADS_PHONE_COUNTRY_CODE='386')
+    def test_phone(self):
+        self.assertEqual(normalize_phone('+386 (41) 123-456'), '+38641123456')
+        self.assertEqual(normalize_phone('00386 41 123 456'), '+38641123456')
+        self.assertEqual(normalize_phone('041 123 456'), '+38641123456')
+        self.assertEqual(normalize_phone('n/a'), '')
+
+    def test_clusters_join_through_shared_keys(self):
+        clusters = DuplicateClusters()
+        clusters.add(1, [('email', 'a'), ('phone', '1')])
+        clusters.add(2, [('email', 'b'), ('phone', '2')])
+        clusters.add(3, [('email', 'b'), ('phone', '1')]) # joins 1 and 2
+        clusters.add(4, [('email', 'c')])
+        self.assertEqual(clusters.clusters(), [(1, [2, 3], [('email', 'b'), ('phone', '1')])])
+
+
+class DuplicateLeadTest(TestCase):
+
+    def setUp(self):
+        self.organisor = User.objects.create_user(username='organisor', password='test')
+        self.organisation = self.organisor.userprofile
+        self.lead = Lead.objects.create(first_name='Ana', last_name='Novak', organisation=self.organisation,
+                                        phone_number='+386 41 111 111', email='Ana@Test.com')
+        self.client.force_login(self.organisor)
+
+    def test_save_sets_normalized_columns(self):
+        self.assertEqual(self.lead.email_normalized, 'ana@test.com')
+        self.lead.email = 'ANA2@test.com'
+        self.lead.save(update_fields=['email'])
+        self.lead.refresh_from_db()
+        self.assertEqual(self.lead.email_normalized, 'ana2@test.com')
+
+    def test_create_form_rejects_duplicates(self):
+        data = {'first_name': 'Ana', 'last_name': 'N', 'age': 1, 'phone_number': '2', 'email': 'ana@test.COM'}
+        response = self.client.post(reverse('leads:lead-create'), data)
+        self.assertContains(response, 'has the same email or phone number')
+        self.assertEqual(Lead.objects.count(), 1)
+
+        response = self.client.post(reverse('leads:lead-create'), dict(data, allow_duplicate='on'))
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Lead.objects.count(), 2)
+
+    def test_other_organisations_and_the_lead_itself_are_no_duplicates(self):
+        other = User.objects.create_user(username='other', password='test')
+        Lead.objects.create(first_name='Bor', last_name='Kos', organisation=other.userprofile,
+                            phone_number='9', email='bor@test.com')
+        response = self.client.post(reverse('leads:lead-create'), {
+            'first_name': 'Bor', 'last_name': 'Kos', 'age': 1, 'phone_number': '9', 'email': 'bor@test.com'
+        })
+        self.assertEqual(response.status_code, 302)
+        response = self.client.post(reverse('leads:lead-update', args=[self.lead.pk]), {
+            'first_name': 'Ana', 'last_name': 'Novak', 'age': 2, 'phone_number': '+386 41 111 111', 'email': 'ana@test.com'
+        })
+        self.assertEqual(response.status_code, 302)
+
+    def test_command_prints_merge_candidates(self):
+        second = Lead.objects.create(first_name='A', last_name='Novak', organisation=self.organisation,
+                                     phone_number='0038641111111', email='other@test.com')
+        third = Lead.objects.create(first_name='Ana', last_name='N', organisation=self.organisation,
+                                    phone_number='5', email='OTHER@test.com')
+        Lead.objects.create(first_name='Bor', last_name='Kos', organisation=self.organisation,
+                            phone_number='6', email='bor@test.com')
+        out = StringIO()
+        call_command('find_duplicate_leads', organisation=self.organisation.id, stdout=out, stderr=StringIO())
+        groups = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(groups, [{
+            'keep': self.lead.pk,
+            'merge': [second.pk, third.pk],
+            'keys': ['email:other@test.com', 'phone:+38641111111'],
+        }])
@@ -0,0 +1,49 @@
+import json
+from io import StringIO
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+from leads.models import User, Agent, Lead, Category
+
+
+class LeadExportTest(TestCase):
+
+    def setUp(self):
+        self.organisor = User.objects.create_user(username='organisor', password='test')
+        organisation = self.organisor.userprofile
+        self.agent_user = User.objects.create_user(username='agent', password='test', is_organisor=False, is_agent=True)
+        self.agent = Agent.objects.create(user=self.agent_user, organisation=organisation)
+        self.category = Category.objects.create(name='Contacted', organisation=organisation)
+        Lead.objects.create(first_name='Ana', last_name='Novak', organisation=organisation, agent=self.agent,
+                            category=self.category, phone_number='1', email='ana@test.com')
+        Lead.objects.create(first_name='Bor', last_name='Kos', organisation=organisation,
+                            phone_number='2', email='bor@test.com')
+        other = User.objects.create_user(username='other', password='test')
+        Lead.objects.create(first_name='Cene', last_name='Zupan', organisation=other.userprofile,
+                            phone_number='3', email='cene@test.com')
+
+    def export(self, **params):
+        response = self.client.get(reverse('leads:lead-export'), params)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_organisor_exports_whole_organisation(self):
+        self.client.force_login(self.organisor)
+        lines = self.export().splitlines()
+        self.assertTrue(lines[0].startswith('id,first_name'))
+        self.assertEqual([line.split(',')[1] for line in lines[1:]], ['Ana', 'Bor'])
+
+    def test_agent_exports_only_own_leads_as_jsonl(self):
+        self.client.force_login(self.agent_user)
+        rows = [json.loads(line) for line in self.export(format='jsonl').splitlines()]
+        self.assertEqual([(row['first_name'], row['category']) for row in rows], [('Ana', 'Contacted')])
+
+    def test_filters(self):
+        self.client.force_login(self.organisor)
+        self.assertEqual(len(self.export(category=self.category.id).splitlines()), 2)
+        self.assertEqual(len(self.export(date_from='2000-01-01', date_to='2000-01-31').splitlines()), 1)
+
+    def test_command(self):
+        out = StringIO()
+        call_command('export_leads', organisation=self.organisor.userprofile.id, format='jsonl', stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 2)
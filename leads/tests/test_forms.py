@@ -0,0 +1,71 @@
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from leads.forms import LeadModelForm, LeadCategoryUpdateForm, PICKER_MAX_CHOICES
+from leads.models import User, Agent, Lead, Category
+
+
+class PickerTest(TestCase):
+
+    def setUp(self):
+        self.organisor = User.objects.create_user(username='organisor', password='test')
+        self.organisation = self.organisor.userprofile
+        self.agent = self.create_agents(self.organisation, 'ana')[0]
+        self.category = Category.objects.create(name='Contacted', organisation=self.organisation)
+        other = User.objects.create_user(username='other', password='test').userprofile
+        self.other_agent = self.create_agents(other, 'foreign')[0]
+        self.other_category = Category.objects.create(name='Foreign', organisation=other)
+        self.lead = Lead.objects.create(
+            first_name='Lead', last_name='Test', organisation=self.organisation, agent=self.agent,
+            phone_number='123', email='lead@test.com'
+        )
+
+    def create_agents(self, organisation, prefix, count=1):
+        # bulk_create doesn't send post_save, so no UserProfile is created for the agents
+        users = User.objects.bulk_create([
+            User(username=f'{prefix}{i}', email=f'{prefix}{i}@test.com', is_organisor=False, is_agent=True)
+            for i in range(count)
+        ])
+        return Agent.objects.bulk_create([Agent(user=user, organisation=organisation) for user in users])
+
+    def test_choices_are_scoped_to_the_organisation(self):
+        form = LeadModelForm(instance=self.lead)
+        self.assertEqual(list(form.fields['agent'].queryset), [self.agent])
+        form = LeadCategoryUpdateForm(instance=self.lead)
+        self.assertEqual(list(form.fields['category'].queryset), [self.category])
+        form = LeadCategoryUpdateForm({'category': self.other_category.pk}, instance=self.lead)
+        self.assertIn('category', form.errors)
+
+    def test_page_does_not_grow_with_the_agents(self):
+        self.client.force_login(self.organisor)
+        url = reverse('leads:lead-update', args=[self.lead.pk])
+        self.client.get(url) # the cached user and session
+        with CaptureQueriesContext(connection) as small:
+            self.client.get(url)
+        self.create_agents(self.organisation, 'agent', count=PICKER_MAX_CHOICES + 50)
+        with CaptureQueriesContext(connection) as big:
+            response = self.client.get(url)
+        # the first agents, then only the selected one
+        self.assertEqual(len(big), len(small) + 1)
+        # only the empty choice and the agent of the lead, the others come from the autocomplete
+        self.assertNotContains(response, 'agent0@test.com')
+        self.assertContains(response, 'ana0@test.com')
+        self.assertContains(response, reverse('leads:agent-autocomplete'))
+
+    def test_agent_autocomplete(self):
+        self.create_agents(self.organisation, 'bor', count=3)
+        self.client.force_login(self.organisor)
+        response = self.client.get(reverse('leads:agent-autocomplete'), {'q': 'bor'})
+        self.assertEqual([result['text'] for result in response.json()['results']], [
+            'bor0@test.com', 'bor1@test.com', 'bor2@test.com'
+        ])
+        response = self.client.get(reverse('leads:agent-autocomplete'), {'q': 'foreign'})
+        self.assertEqual(response.json()['results'], [])
+
+    def test_category_autocomplete_for_agents(self):
+        self.client.force_login(self.agent.user)
+        response = self.client.get(reverse('leads:category-autocomplete'), {'q': 'con'})
+        self.assertEqual(response.json()['results'], [{'id': self.category.id, 'text': 'Contacted'}])
+        # the agent pickers are for organisors
+        self.assertEqual(self.client.get(reverse('leads:agent-autocomplete')).status_code, 302)
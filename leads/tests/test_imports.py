@@ -0,0 +1,124 @@
+import os
+import shutil
+import tempfile
+from io import StringIO
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from leads.imports import LeadImporter, read_rows, file_hash
+from leads.jobs import run_available_jobs
+from leads.models import User, Agent, Lead, LeadImport, Job
+
+CSV_FILE = (
+    'first_name,last_name,age,agent,description,phone_number,email\n'
+    'Ana,Novak,30,,,101,ana@test.com\n'
+    'Bor,Kos,abc,,,102,bor@test.com\n'
+    'Cene,Zupan,40,,,103,not-an-email\n'
+    'Dana,Horvat,25,,,104,dana@test.com\n'
+)
+
+
+class LeadImportTest(TestCase):
+
+    def setUp(self):
+        self.organisor = User.objects.create_user(username='organisor', password='test')
+        self.organisation = self.organisor.userprofile
+
+    def test_rows_are_validated_like_the_lead_form(self):
+        lead_import = LeadImport.objects.create(organisation=self.organisation, source_name='leads.csv')
+        LeadImporter(lead_import, batch_size=2).run(read_rows(StringIO(CSV_FILE), 'csv'))
+
+        self.assertEqual(lead_import.status, LeadImport.FINISHED)
+        self.assertEqual(lead_import.rows_imported, 2)
+        self.assertEqual([error['row'] for error in lead_import.errors], [2, 3])
+        self.assertEqual(
+            sorted(Lead.objects.values_list('first_name', flat=True)), ['Ana', 'Dana']
+        )
+
+    def test_agent_must_belong_to_the_organisation(self):
+        other = User.objects.create_user(username='other', password='test')
+        agent_user = User.objects.create_user(username='agent', password='test', is_organisor=False)
+        foreign_agent = Agent.objects.create(user=agent_user, organisation=other.userprofile)
+        rows = [{'first_name': 'Ana', 'last_name': 'Novak', 'age': 1, 'agent': foreign_agent.id,
+                 'phone_number': '1', 'email': 'ana@test.com'}]
+        lead_import = LeadImport.objects.create(organisation=self.organisation, source_name='leads.jsonl')
+        LeadImporter(lead_import).run(iter(rows))
+        self.assertEqual(lead_import.rows_failed, 1)
+        self.assertFalse(Lead.objects.exists())
+
+    def test_command_resumes_after_last_committed_batch(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as file:
+            file.write(CSV_FILE)
+        self.addCleanup(os.remove, file.name)
+        # pretend that a previous run of the same file (under another name) committed the first two rows and then crashed
+        with open(file.name, 'rb') as source:
+            source_hash = file_hash(source)
+        LeadImport.objects.create(
+            organisation=self.organisation,
+            source_name='renamed.csv',
+            source_hash=source_hash,
+            rows_processed=2
+        )
+        call_command('import_leads', file.name, organisation=self.organisation.id, stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(list(Lead.objects.values_list('first_name', flat=True)), ['Dana'])
+
+    def test_duplicates_of_leads_and_earlier_rows_fail(self):
+        Lead.objects.create(first_name='Ana', last_name='Novak', organisation=self.organisation,
+                            phone_number='+386 41 111 111', email='ana@test.com')
+        rows = [
+            {'first_name': 'Ana', 'last_name': 'N', 'age': 1, 'phone_number': '1', 'email': ' ANA@test.com'},
+            {'first_name': 'Bor', 'last_name': 'Kos', 'age': 1, 'phone_number': '0038641111111', 'email': 'bor@test.com'},
+            {'first_name': 'Cene', 'last_name': 'Kos', 'age': 1, 'phone_number': '2', 'email': 'cene@test.com'},
+            {'first_name': 'Cene', 'last_name': 'Kos', 'age': 1, 'phone_number': '3', 'email': 'Cene@test.com'},
+        ]
+        lead_import = LeadImport.objects.create(organisation=self.organisation, source_name='leads.jsonl')
+        LeadImporter(lead_import).run(iter(rows))
+        self.assertEqual(lead_import.rows_imported, 1)
+        self.assertEqual([error['row'] for error in lead_import.errors], [1, 2, 4])
+        self.assertIn('row 3', lead_import.errors[2]['errors'][0])
+
+        lead_import = LeadImport.objects.create(organisation=self.organisation, source_name='again.jsonl')
+        LeadImporter(lead_import, skip_duplicates=False).run(iter(rows))
+        self.assertEqual(lead_import.rows_imported, 4)
+
+    def test_upload_is_imported_by_a_job(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.client.force_login(self.organisor)
+        url = reverse('leads:lead-import')
+        with override_settings(MEDIA_ROOT=media_root):
+            response = self.client.post(url, {'file': SimpleUploadedFile('leads.csv', CSV_FILE.encode())})
+            self.assertRedirects(response, url)
+            self.assertFalse(Lead.objects.exists())
+            # the same content again doesn't start a second import or job
+            self.client.post(url, {'file': SimpleUploadedFile('copy.csv', CSV_FILE.encode())})
+            self.assertEqual((LeadImport.objects.count(), Job.objects.count()), (1, 1))
+            run_available_jobs()
+
+        lead_import = LeadImport.objects.get()
+        self.assertEqual((lead_import.status, lead_import.rows_imported), (LeadImport.FINISHED, 2))
+        self.assertEqual(Lead.objects.filter(organisation=self.organisation).count(), 2)
+        self.assertFalse(lead_import.file) # the stored upload is removed
+        self.assertEqual(os.listdir(os.path.join(media_root, 'lead_imports')), [])
+        self.assertContains(self.client.get(url), 'imported 2 leads, 2 rows failed')
+
+    @override_settings(LEADS_IMPORT_BATCHES_PER_JOB=1)
+    def test_big_upload_is_imported_by_a_job_per_step(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.client.force_login(self.organisor)
+        rows = ''.join(f'Lead{i},Test,30,{i},lead{i}@test.com\n' for i in range(2100))
+        upload = SimpleUploadedFile('leads.csv', ('first_name,last_name,age,phone_number,email\n' + rows).encode())
+        with override_settings(MEDIA_ROOT=media_root):
+            self.client.post(reverse('leads:lead-import'), {'file': upload})
+            # one batch of 1000 rows, then the next job is queued
+            self.assertEqual(run_available_jobs(limit=1), 1)
+            lead_import = LeadImport.objects.get()
+            self.assertEqual((lead_import.status, lead_import.rows_processed), (LeadImport.RUNNING, 1000))
+            self.assertEqual(Job.objects.filter(status=Job.QUEUED).count(), 1)
+            self.assertEqual(run_available_jobs(), 2)
+
+        lead_import.refresh_from_db()
+        self.assertEqual((lead_import.status, lead_import.rows_imported), (LeadImport.FINISHED, 2100))
+        self.assertEqual(Job.objects.filter(status=Job.DONE).count(), 3)
@@ -0,0 +1,118 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.core import mail
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from leads.jobs import job, claim_jobs, run_available_jobs, requeue_stale_jobs
+from leads.models import User, Job
+
+calls = []
+
+
+@job
+def remember(value):
+    calls.append(value)
+
+
+@job(max_attempts=2)
+def always_fails():
+    raise RuntimeError('SMTP is down')
+
+
+def not_a_job():
+    pass
+
+
+class JobQueueTest(TestCase):
+
+    def setUp(self):
+        calls.clear()
+
+    def test_enqueued_job_runs_in_the_worker(self):
+        remember.enqueue(value=1)
+        self.assertEqual(calls, [])
+        out = StringIO()
+        call_command('run_workers', once=True, stdout=out)
+        self.assertIn('Ran 1 jobs', out.getvalue())
+        self.assertEqual(calls, [1])
+        job = Job.objects.get()
+        self.assertEqual(job.status, Job.DONE)
+        self.assertIsNotNone(job.duration)
+
+    def test_a_job_is_claimed_once(self):
+        remember.enqueue(value=1)
+        self.assertEqual(len(claim_jobs(worker='a')), 1)
+        self.assertEqual(claim_jobs(worker='b'), [])
+        self.assertEqual(Job.objects.get().locked_by, 'a')
+
+    def test_jobs_wait_for_run_at(self):
+        remember.enqueue(value=1, run_at=timezone.now() + timedelta(minutes=1))
+        self.assertEqual(run_available_jobs(), 0)
+
+    def test_failed_job_is_retried_later_then_dead(self):
+        always_fails.enqueue()
+        with self.assertLogs('leads.jobs', 'WARNING'):
+            run_available_jobs()
+        job = Job.objects.get()
+        self.assertEqual((job.status, job.attempts), (Job.QUEUED, 1))
+        self.assertGreater(job.run_at, timezone.now())
+        self.assertIn('SMTP is down', job.last_error)
+
+        Job.objects.update(run_at=timezone.now())
+        with self.assertLogs('leads.jobs', 'ERROR'):
+            run_available_jobs()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.DEAD, 2))
+
+    def test_only_decorated_functions_run(self):
+        Job.objects.create(name='leads.tests.test_jobs.not_a_job', run_at=timezone.now(), max_attempts=1)
+        with self.assertLogs('leads.jobs', 'ERROR'):
+            run_available_jobs()
+        self.assertEqual(Job.objects.get().status, Job.DEAD)
+
+    def test_stale_jobs_are_queued_again(self):
+        remember.enqueue(value=1)
+        claim_jobs()
+        Job.objects.update(started_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(requeue_stale_jobs(), 1)
+        self.assertEqual(Job.objects.get().status, Job.QUEUED)
+
+    @override_settings(LEADS_JOBS_EAGER=True)
+    def test_eager_mode_runs_right_away(self):
+        remember.enqueue(value=2)
+        self.assertEqual(calls, [2])
+        self.assertFalse(Job.objects.exists())
+
+    def test_stats_command(self):
+        remember.enqueue(value=1)
+        out = StringIO()
+        call_command('job_stats', stdout=out)
+        self.assertIn('leads.tests.test_jobs.remember: 1 queued', out.getvalue())
+
+
+class SlowSideEffectsTest(TestCase):
+
+    def setUp(self):
+        self.organisor = User.objects.create_user(username='organisor', password='test', email='organisor@test.com')
+
+    def test_password_reset_mail_is_sent_by_the_worker(self):
+        response = self.client.post(reverse('password_reset'), {'email': 'organisor@test.com'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(len(mail.outbox), 0)
+        run_available_jobs()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn('/reset/', mail.outbox[0].body)
+
+    def test_new_agent_gets_invitation_in_the_background(self):
+        self.client.force_login(self.organisor)
+        self.client.post(reverse('agents:agent-create'), {
+            'email': 'agent@test.com', 'username': 'agent', 'first_name': 'Ana', 'last_name': 'Novak'
+        })
+        agent_user = User.objects.get(username='agent')
+        self.assertFalse(agent_user.has_usable_password())
+        self.assertEqual(len(mail.outbox), 0)
+        run_available_jobs()
+        self.assertEqual(mail.outbox[0].to, ['agent@test.com'])
@@ -0,0 +1,90 @@
+import os
+import re
+import tempfile
+from io import StringIO
+
+from django.core import mail
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+from leads.jobs import run_available_jobs
+from leads.models import User, UserProfile, Agent
+
+CSV_FILE = (
+    'email,username,first_name,last_name\n'
+    'ana@test.com,,Ana,Novak\n'
+    'bor@test.com,bor,Bor,Kos\n'
+    'not-an-email,cene,Cene,Zupan\n'
+    'taken@test.com,organisor,Dana,Horvat\n'
+    'ANA@test.com,ana2,Ana,Again\n'
+)
+
+
+class AgentOnboardingTest(TestCase):
+
+    def setUp(self):
+        self.organisor = User.objects.create_user(username='organisor', password='test', email='organisor@test.com')
+        self.organisation = self.organisor.userprofile
+        self.client.force_login(self.organisor)
+
+    def upload(self):
+        upload = SimpleUploadedFile('agents.csv', CSV_FILE.encode())
+        return self.client.post(reverse('agents:agent-import'), {'file': upload})
+
+    def test_upload_creates_agents_in_bulk(self):
+        # taken usernames/emails, savepoint, users, agents, invitation job, savepoint - nothing per agent
+        with self.assertNumQueries(6):
+            response = self.upload()
+        onboarding = response.context['onboarding']
+        self.assertEqual(onboarding.created, 2)
+        self.assertEqual([error['row'] for error in onboarding.errors], [3, 4, 5])
+
+        agents = Agent.objects.filter(organisation=self.organisation).select_related('user')
+        self.assertEqual(sorted(agent.user.username for agent in agents), ['ana@test.com', 'bor'])
+        for agent in agents:
+            self.assertFalse(agent.user.has_usable_password())
+            self.assertFalse(agent.user.is_organisor)
+        # agents are no organisations
+        self.assertEqual(UserProfile.objects.count(), 1)
+
+    def test_taken_email_in_another_case(self):
+        User.objects.create_user(username='eva', password='test', email='Eva.Kos@Test.com')
+        upload = SimpleUploadedFile('agents.csv', b'email,username,first_name,last_name\neva.kos@test.com,eva.kos,Eva,Kos\n')
+        response = self.client.post(reverse('agents:agent-import'), {'file': upload})
+        self.assertEqual(response.context['onboarding'].created, 0)
+        self.assertFalse(User.objects.filter(username='eva.kos').exists())
+
+    def test_invitation_link_sets_the_password(self):
+        self.upload()
+        self.client.logout()
+        run_available_jobs()
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), ['ana@test.com', 'bor@test.com'])
+
+        message = next(message for message in mail.outbox if message.to == ['bor@test.com'])
+        link = re.search(r'http://testserver(/reset/\S+)', message.body).group(1)
+        response = self.client.get(link, follow=True)
+        response = self.client.post(response.redirect_chain[-1][0], {
+            'new_password1': 'a-long-new-password', 'new_password2': 'a-long-new-password'
+        })
+        self.assertRedirects(response, reverse('password_reset_complete'))
+        self.assertTrue(self.client.login(username='bor', password='a-long-new-password'))
+
+    def test_invited_agent_can_ask_for_a_new_link(self):
+        self.upload()
+        run_available_jobs()
+        mail.outbox.clear()
+        self.client.post(reverse('password_reset'), {'email': 'bor@test.com'})
+        run_available_jobs()
+        self.assertEqual(mail.outbox[0].to, ['bor@test.com'])
+
+    def test_command(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as file:
+            file.write(CSV_FILE)
+        self.addCleanup(os.remove, file.name)
+        out = StringIO()
+        call_command('onboard_agents', file.name, organisation=self.organisation.id, domain='crm.test',
+                     stdout=out, stderr=StringIO())
+        self.assertIn('Created 2 agents, 3 rows failed', out.getvalue())
+        run_available_jobs()
+        self.assertIn('https://crm.test/reset/', mail.outbox[0].body)
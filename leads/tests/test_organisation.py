@@ -0,0 +1,40 @@
+from django.test import TestCase
+from django.urls import reverse
+from leads.models import User, Agent, Lead, Category
+
+
+class OrganisationMiddlewareTest(TestCase):
+
+    def setUp(self):
+        self.organisor = User.objects.create_user(username='organisor', password='test')
+        self.organisation = self.organisor.userprofile
+        self.agent_user = User.objects.create_user(username='agent', password='test', is_organisor=False, is_agent=True)
+        self.agent = Agent.objects.create(user=self.agent_user, organisation=self.organisation)
+        self.category = Category.objects.create(name='New', organisation=self.organisation)
+        self.lead = Lead.objects.create(first_name='Ana', last_name='Novak', organisation=self.organisation,
+                                        agent=self.agent, category=self.category, phone_number='1', email='a@test.com')
+
+    def test_request_has_organisation(self):
+        self.client.force_login(self.agent_user)
+        response = self.client.get(reverse('leads:category-list'))
+        request = response.wsgi_request
+        self.assertEqual(request.organisation, self.organisation)
+        self.assertEqual(request.agent, self.agent)
+
+    def test_user_profile_and_organisation_come_from_one_query(self):
+        self.client.force_login(self.agent_user)
+        # the session and the user (with profile/agent/organisation) come from the cache, only the lead is queried
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('leads:lead-detail', args=[self.lead.pk]))
+        self.assertEqual(response.status_code, 200)
+
+    def test_agent_can_open_categories(self):
+        self.client.force_login(self.agent_user)
+        response = self.client.get(reverse('leads:category-detail', args=[self.category.pk]))
+        self.assertEqual(list(response.context['leads']), [self.lead])
+
+    def test_agent_detail_is_scoped_to_organisation(self):
+        other = User.objects.create_user(username='other', password='test')
+        self.client.force_login(other)
+        response = self.client.get(reverse('agents:agent-detail', args=[self.agent.pk]))
+        self.assertEqual(response.status_code, 404)
@@ -0,0 +1,57 @@
+from django.test import TestCase
+from django.urls import reverse
+from leads.models import User, Agent, Lead, Category
+
+
+class LeadListPaginationTest(TestCase):
+
+    def setUp(self):
+        self.organisor = User.objects.create_user(username='organisor', password='test')
+        organisation = self.organisor.userprofile
+        agent_user = User.objects.create_user(username='agent', password='test', is_organisor=False, is_agent=True)
+        self.agent = Agent.objects.create(user=agent_user, organisation=organisation)
+        self.category = Category.objects.create(name='New', organisation=organisation)
+        for i in range(45):
+            Lead.objects.create(
+                first_name=f'Lead{i}',
+                last_name='Test',
+                organisation=organisation,
+                agent=self.agent if i % 2 else None,
+                category=self.category,
+                phone_number='123',
+                email=f'lead{i}@test.com'
+            )
+        self.client.force_login(self.organisor)
+
+    def collect_pages(self, url, context_name, cursor_name='cursor', page_name='page_obj'):
+        # walk through all pages by following the next cursor
+        ids = []
+        cursor = None
+        while True:
+            response = self.client.get(url, {cursor_name: cursor} if cursor else {})
+            self.assertEqual(response.status_code, 200)
+            ids += [obj.id for obj in response.context[context_name]]
+            page = response.context[page_name]
+            if not page.has_next:
+                return ids
+            cursor = page.next_cursor
+
+    def test_assigned_leads_are_paged_without_gaps(self):
+        ids = self.collect_pages(reverse('leads:lead-list'), 'leads')
+        expected = Lead.objects.filter(agent__isnull=False).order_by('-date_added', '-id')
+        self.assertEqual(ids, [lead.id for lead in expected])
+
+    def test_unassigned_leads_have_their_own_cursor(self):
+        ids = self.collect_pages(
+            reverse('leads:lead-list'), 'unassigned_leads', 'unassigned_cursor', 'unassigned_page_obj'
+        )
+        self.assertEqual(len(ids), 23)
+        self.assertEqual(len(set(ids)), 23)
+
+    def test_category_detail_is_paged(self):
+        ids = self.collect_pages(reverse('leads:category-detail', args=[self.category.pk]), 'leads')
+        self.assertEqual(len(ids), 45)
+
+    def test_invalid_cursor_returns_404(self):
+        response = self.client.get(reverse('leads:lead-list'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
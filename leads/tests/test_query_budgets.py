@@ -0,0 +1,79 @@
+import random
+from django.conf import settings
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from leads.benchmark import named_routes, route_url
+from leads.middleware import QueryStats, fingerprint
+from leads.models import User, Agent, Lead, Category
+
+
+class QueryBudgetTest(TestCase):
+    # Every named route must stay within its budget in settings.QUERY_BUDGETS, no matter
+    # how many agents, categories and leads the organisation has.
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.organisor = User.objects.create_user(username='organisor', password='test')
+        organisation = cls.organisor.userprofile
+        # bulk_create doesn't send post_save, so no UserProfile is created for the agents
+        users = User.objects.bulk_create([
+            User(username=f'agent{i}', email=f'agent{i}@test.com', is_organisor=False, is_agent=True)
+            for i in range(25)
+        ])
+        agents = Agent.objects.bulk_create([Agent(user=user, organisation=organisation) for user in users])
+        categories = Category.objects.bulk_create([
+            Category(name=name, organisation=organisation)
+            for name in ('New', 'Contacted', 'Converted', 'Unconverted')
+        ])
+        rng = random.Random(1)
+        Lead.objects.bulk_create([
+            Lead(
+                first_name=f'Lead{i}', last_name='Test', organisation=organisation,
+                agent=rng.choice(agents + [None]), category=rng.choice(categories + [None]),
+                phone_number='123', email=f'lead{i}@test.com'
+            )
+            for i in range(500)
+        ])
+        cls.lead = Lead.objects.filter(agent__isnull=False).first()
+        cls.category = categories[0]
+        cls.agent = agents[0]
+
+    def test_every_route_has_a_budget(self):
+        missing = [name for name, pattern in named_routes() if name not in settings.QUERY_BUDGETS]
+        self.assertEqual(missing, [])
+
+    def test_routes_stay_within_budget(self):
+        self.client.force_login(self.organisor)
+        for name, pattern in named_routes():
+            with self.subTest(route=name):
+                stats = QueryStats()
+                with connection.execute_wrapper(stats):
+                    response = self.client.get(route_url(name, pattern, self.lead, self.category, self.agent))
+                    if response.streaming:
+                        b''.join(response.streaming_content)
+                self.assertIn(response.status_code, (200, 405))
+                self.assertLessEqual(stats.count, settings.QUERY_BUDGETS[name])
+                self.assertEqual(stats.repeated(settings.QUERY_COUNT_N_PLUS_ONE_THRESHOLD), [])
+
+
+class QueryCountMiddlewareTest(TestCase):
+
+    def test_fingerprint_ignores_parameters(self):
+        self.assertEqual(
+            fingerprint('SELECT * FROM leads_lead WHERE id = 12 AND email = \'a@b.com\''),
+            fingerprint('SELECT * FROM leads_lead WHERE id = 7 AND email = \'c@d.com\'')
+        )
+        self.assertEqual(
+            fingerprint('SELECT * FROM leads_lead WHERE id IN (1, 2, 3)'),
+            fingerprint('SELECT * FROM leads_lead WHERE id IN (4)')
+        )
+
+    @override_settings(QUERY_COUNT_ENABLED=True, QUERY_BUDGETS={'leads:category-list': 0})
+    def test_headers_and_budget_warning(self):
+        organisor = User.objects.create_user(username='organisor', password='test')
+        self.client.force_login(organisor)
+        with self.assertLogs('leads.middleware', level='WARNING') as logs:
+            response = self.client.get(reverse('leads:category-list'))
+        self.assertGreater(int(response['X-Query-Count']), 0)
+        self.assertIn('the budget is 0', logs.output[0])
@@ -0,0 +1,135 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Sum
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from leads.assignment import bulk_assign
+from leads.imports import LeadImporter, read_rows
+from leads.models import User, Agent, Lead, Category, LeadDailyCount, LeadImport
+from leads.rollup import LeadIntakeReport
+
+
+class LeadRollupTest(TestCase):
+
+    def setUp(self):
+        self.organisor = User.objects.create_user(username='organisor', password='test')
+        self.organisation = self.organisor.userprofile
+        agent_user = User.objects.create_user(username='ana', password='test', is_organisor=False, is_agent=True)
+        self.agent = Agent.objects.create(user=agent_user, organisation=self.organisation)
+        self.contacted = Category.objects.create(name='Contacted', organisation=self.organisation)
+        self.converted = Category.objects.create(name='Converted', organisation=self.organisation)
+        self.today = timezone.localdate()
+        self.leads = [self.create_lead(f'Lead{i}') for i in range(3)]
+
+    def create_lead(self, name, **kwargs):
+        return Lead.objects.create(
+            first_name=name, last_name='Test', organisation=self.organisation,
+            phone_number='123', email=f'{name.lower()}@test.com', **kwargs
+        )
+
+    def rollup(self):
+        # {(day, category_id, agent_id): count} without the empty buckets
+        rows = LeadDailyCount.objects.values('day', 'category', 'agent').annotate(total=Sum('count'))
+        return {(row['day'], row['category'], row['agent']): row['total'] for row in rows if row['total']}
+
+    def rebuilt(self):
+        expected = self.rollup()
+        call_command('rebuild_lead_rollup', stdout=StringIO())
+        self.assertEqual(self.rollup(), expected)
+        return expected
+
+    def test_new_leads_are_counted(self):
+        self.assertEqual(self.rebuilt(), {(self.today, None, None): 3})
+
+    def test_category_update_and_assign_move_the_lead(self):
+        lead = self.leads[0]
+        self.client.force_login(self.organisor)
+        self.client.post(reverse('leads:lead-category-update', args=[lead.pk]), {'category': self.contacted.pk})
+        self.client.post(reverse('leads:assign-agent', args=[lead.pk]), {'agent': self.agent.pk})
+        self.assertEqual(self.rebuilt(), {
+            (self.today, None, None): 2,
+            (self.today, self.contacted.id, self.agent.id): 1,
+        })
+
+    def test_deleted_lead_is_removed(self):
+        self.leads[0].delete()
+        self.assertEqual(self.rebuilt(), {(self.today, None, None): 2})
+
+    def test_bulk_assign(self):
+        bulk_assign(self.organisation, self.agent, lead_ids=[self.leads[0].id, self.leads[1].id])
+        self.assertEqual(self.rebuilt(), {(self.today, None, None): 1, (self.today, None, self.agent.id): 2})
+        bulk_assign(self.organisation, self.agent, select_all=True)
+        self.assertEqual(self.rebuilt(), {(self.today, None, self.agent.id): 3})
+
+    def test_moving_leads_of_many_days_costs_the_same_queries(self):
+        def assign(days):
+            leads = [self.create_lead(f'Day{days}x{i}') for i in range(days)]
+            for i, lead in enumerate(leads):
+                Lead.objects.filter(id=lead.id).update(date_added=timezone.now() - timedelta(days=i))
+            call_command('rebuild_lead_rollup', days=days + 1, stdout=StringIO())
+            agent_user = User.objects.create_user(username=f'agent{days}', password='test', is_organisor=False, is_agent=True)
+            agent = Agent.objects.create(user=agent_user, organisation=self.organisation)
+            with CaptureQueriesContext(connection) as queries:
+                bulk_assign(self.organisation, agent, lead_ids=[lead.id for lead in leads])
+            return len(queries)
+
+        self.assertEqual(assign(2), assign(30))
+        self.rebuilt()
+
+    def test_one_row_per_key(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            LeadDailyCount.objects.create(organisation=self.organisation, day=self.today, count=1)
+
+    def test_deleted_category_and_agent_join_the_rows_without_one(self):
+        self.create_lead('Contacted', category=self.contacted, agent=self.agent)
+        self.create_lead('Assigned', agent=self.agent)
+        self.contacted.delete()
+        self.assertEqual(self.rebuilt(), {(self.today, None, None): 3, (self.today, None, self.agent.id): 2})
+        self.agent.delete()
+        self.assertEqual(self.rebuilt(), {(self.today, None, None): 5})
+        self.assertEqual(LeadDailyCount.objects.count(), 1)
+
+    def test_imported_leads_are_counted(self):
+        lead_import = LeadImport.objects.create(organisation=self.organisation, source_name='leads.csv')
+        csv_file = 'first_name,last_name,age,phone_number,email\nBor,Kos,30,102,bor@test.com\n'
+        LeadImporter(lead_import).run(read_rows(StringIO(csv_file), 'csv'))
+        self.assertEqual(self.rebuilt(), {(self.today, None, None): 4})
+
+    def test_rebuild_covers_old_leads(self):
+        old = self.create_lead('Old', category=self.converted)
+        Lead.objects.filter(id=old.id).update(date_added=timezone.now() - timedelta(days=100))
+        call_command('rebuild_lead_rollup', days=7, stdout=StringIO())
+        self.assertEqual(self.rollup(), {
+            (self.today, None, None): 3,
+            (self.today - timedelta(days=100), self.converted.id, None): 1,
+        })
+
+    def test_report_sums_the_rows_of_a_week(self):
+        LeadDailyCount.objects.all().delete()
+        monday = self.today - timedelta(days=self.today.weekday() + 7)
+        LeadDailyCount.objects.bulk_create([
+            LeadDailyCount(organisation=self.organisation, day=monday, category=self.contacted, count=2),
+            LeadDailyCount(organisation=self.organisation, day=monday + timedelta(days=3), category=self.contacted, count=3),
+            LeadDailyCount(organisation=self.organisation, day=monday + timedelta(days=4), count=1),
+            # outside the range
+            LeadDailyCount(organisation=self.organisation, day=monday - timedelta(days=1), count=10),
+        ])
+        report = LeadIntakeReport(self.organisation, monday, monday + timedelta(days=6), period='week').build()
+        self.assertEqual(report, {
+            'columns': ['Contacted', 'No category'],
+            'rows': [{'period': monday, 'counts': [5, 1], 'total': 6}],
+            'total': 6,
+        })
+
+    def test_report_page(self):
+        self.client.force_login(self.organisor)
+        response = self.client.get(reverse('leads:lead-report'), {'split': 'agent'})
+        self.assertContains(response, 'Unassigned')
+        self.assertEqual(response.context['report']['total'], 3)
+        self.client.force_login(self.agent.user)
+        self.assertEqual(self.client.get(reverse('leads:lead-report')).status_code, 302)
@@ -0,0 +1,121 @@
+import time
+import unittest
+
+from django.conf import settings
+from django.db import connections
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from leads.models import User, Lead
+from leads.routers import PrimaryReplicaRouter, database_state, replica_health
+
+
+# SimpleTestCase: no transaction around the test (inside one every read goes to the primary)
+class PrimaryReplicaRouterTest(SimpleTestCase):
+
+    def setUp(self):
+        self.router = PrimaryReplicaRouter(replicas=['replica1', 'missing'])
+        # replica1 was checked just now and is fine, 'missing' isn't configured at all
+        replica_health.results['replica1'] = (True, time.monotonic())
+        replica_health.results.pop('missing', None)
+
+    def tearDown(self):
+        replica_health.results.clear()
+
+    def test_reads_go_to_a_healthy_replica(self):
+        with database_state():
+            self.assertEqual(self.router.db_for_read(Lead), 'replica1')
+        self.assertFalse(replica_health.is_healthy('missing'))
+
+    def test_reads_after_a_write_use_the_primary(self):
+        with database_state() as state:
+            self.assertEqual(self.router.db_for_write(Lead), 'default')
+            self.assertTrue(state.wrote)
+            self.assertEqual(self.router.db_for_read(Lead), 'default')
+
+    def test_without_healthy_replicas_reads_use_the_primary(self):
+        replica_health.results['replica1'] = (False, time.monotonic())
+        with database_state():
+            self.assertEqual(self.router.db_for_read(Lead), 'default')
+
+    def test_replicas_are_not_migrated(self):
+        self.assertFalse(self.router.allow_migrate('replica1', 'leads'))
+        self.assertTrue(self.router.allow_migrate('default', 'leads'))
+
+    def test_no_replicas(self):
+        self.assertEqual(PrimaryReplicaRouter(replicas=[]).db_for_read(Lead), 'default')
+
+
+@override_settings(DATABASE_REPLICAS=['default']) # a 'replica' that mirrors the primary
+class ReplicaStickinessMiddlewareTest(TestCase):
+
+    def setUp(self):
+        self.organisor = User.objects.create_user(username='organisor', password='test')
+        self.client.force_login(self.organisor)
+
+    def test_write_sets_the_sticky_cookie(self):
+        self.client.post(reverse('leads:lead-create'), {
+            'first_name': 'Ana', 'last_name': 'Novak', 'age': 30, 'phone_number': '1', 'email': 'ana@test.com'
+        })
+        cookie = self.client.cookies['use_primary_until']
+        self.assertGreater(float(cookie.value), time.time())
+
+    def test_read_only_request_sets_no_cookie(self):
+        response = self.client.get(reverse('leads:lead-list'))
+        self.assertNotIn('use_primary_until', response.cookies)
+
+
+@unittest.skipUnless(settings.DATABASE_REPLICAS, 'no replica configured (DB_REPLICA_URLS)')
+class ReplicaRoutingTest(TransactionTestCase):
+    # The configured replica (a test mirror of the primary), through the real routers and middleware.
+    # TransactionTestCase: inside the transaction of TestCase every read goes to the primary.
+    databases = {'default', *settings.DATABASE_REPLICAS}
+
+    def setUp(self):
+        self.replica = settings.DATABASE_REPLICAS[0]
+        replica_health.results[self.replica] = (True, time.monotonic())
+        self.organisor = User.objects.create_user(username='organisor', password='test')
+
+    def tearDown(self):
+        replica_health.results.clear()
+
+    def queries(self):
+        return CaptureQueriesContext(connections['default']), CaptureQueriesContext(connections[self.replica])
+
+    def test_reads_go_to_the_replica_until_something_is_written(self):
+        primary, replica = self.queries()
+        with database_state(), primary, replica:
+            self.assertEqual(Lead.objects.count(), 0)
+            self.assertEqual(len(primary), 0)
+            self.assertEqual(len(replica), 1)
+            Lead.objects.create(first_name='Ana', last_name='Novak', organisation=self.organisor.userprofile,
+                                phone_number='1', email='ana@test.com')
+            writes = len(primary)
+            self.assertEqual(Lead.objects.count(), 1)
+            self.assertEqual(len(primary), writes + 1)
+            self.assertEqual(len(replica), 1)
+
+    def test_requests_stick_to_the_primary_after_a_write(self):
+        self.client.force_login(self.organisor)
+        primary, replica = self.queries()
+        with replica:
+            self.client.get(reverse('leads:lead-list'))
+        self.assertTrue(any('leads_lead' in query['sql'] for query in replica))
+
+        self.client.post(reverse('leads:lead-create'), {
+            'first_name': 'Ana', 'last_name': 'Novak', 'age': 30, 'phone_number': '1', 'email': 'ana@test.com'
+        })
+        primary, replica = self.queries()
+        with primary, replica:
+            self.client.get(reverse('leads:lead-list'))
+        self.assertEqual(len(replica), 0)
+        self.assertTrue(any('leads_lead' in query['sql'] for query in primary))
+
+    @override_settings(QUERY_COUNT_ENABLED=True)
+    def test_query_count_includes_the_replica(self):
+        self.client.force_login(self.organisor)
+        primary, replica = self.queries()
+        with primary, replica:
+            response = self.client.get(reverse('leads:lead-list'))
+        self.assertGreater(len(replica), 0)
+        self.assertEqual(int(response['X-Query-Count']), len(primary) + len(replica))
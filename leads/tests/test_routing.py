@@ -0,0 +1,147 @@
+from io import StringIO
+from unittest import mock
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from leads.assignment import bulk_assign
+from leads.models import User, Agent, Lead, Category, LeadRouting, AgentLeadCount
+from leads.routing import LeadRouter
+
+
+class LeadRoutingTest(TestCase):
+
+    def setUp(self):
+        self.organisor = User.objects.create_user(username='organisor', password='test')
+        self.organisation = self.organisor.userprofile
+        self.agents = []
+        for i in range(3):
+            user = User.objects.create_user(username=f'agent{i}', password='test', is_organisor=False, is_agent=True)
+            self.agents.append(Agent.objects.create(user=user, organisation=self.organisation))
+        self.routing = LeadRouting.objects.create(organisation=self.organisation)
+
+    def create_lead(self, agent=None, category=None):
+        return Lead.objects.create(first_name='Lead', last_name='Test', organisation=self.organisation,
+                                   agent=agent, category=category, phone_number='1', email='a@test.com')
+
+    def test_least_loaded_uses_one_count_query(self):
+        self.routing.strategy = LeadRouting.LEAST_LOADED
+        self.routing.save()
+        self.create_lead(self.agents[0])
+        self.create_lead(self.agents[0])
+        self.create_lead(self.agents[1])
+        leads = [Lead(organisation=self.organisation) for i in range(3)]
+        with self.assertNumQueries(3): # routing, agents, grouped count
+            LeadRouter.for_organisation(self.organisation).assign(leads)
+        self.assertEqual(
+            [lead.agent_id for lead in leads],
+            [self.agents[2].id, self.agents[1].id, self.agents[2].id]
+        )
+
+    def test_round_robin_continues_between_requests(self):
+        self.routing.strategy = LeadRouting.ROUND_ROBIN
+        self.routing.save()
+        self.client.force_login(self.organisor)
+        for i in range(4):
+            self.client.post(reverse('leads:lead-create'), {
+                'first_name': 'Lead', 'last_name': str(i), 'age': 1, 'phone_number': str(i), 'email': f'a{i}@test.com'
+            })
+        self.assertEqual(
+            list(Lead.objects.order_by('id').values_list('agent_id', flat=True)),
+            [self.agents[0].id, self.agents[1].id, self.agents[2].id, self.agents[0].id]
+        )
+
+    def test_route_unassigned_uses_category_pools(self):
+        self.routing.strategy = LeadRouting.CATEGORY_POOL
+        self.routing.save()
+        category = Category.objects.create(name='New', organisation=self.organisation)
+        category.routing_agents.add(self.agents[1])
+        for i in range(3):
+            self.create_lead(category=category)
+        self.create_lead()
+        call_command('route_unassigned', batch_size=2, stdout=StringIO())
+        self.assertFalse(Lead.objects.filter(agent__isnull=True).exists())
+        self.assertEqual(Lead.objects.filter(category=category, agent=self.agents[1]).count(), 3)
+
+    def test_route_unassigned_queries_per_batch(self):
+        self.routing.strategy = LeadRouting.LEAST_LOADED
+        self.routing.save()
+        for i in range(3):
+            self.create_lead()
+        with CaptureQueriesContext(connection) as queries:
+            call_command('route_unassigned', batch_size=10, stdout=StringIO())
+        # another organisation with as many agents and twice as many leads:
+        # the queries are per batch and agent, not per lead
+        other = User.objects.create_user(username='other', password='test').userprofile
+        for i in range(3):
+            user = User.objects.create_user(username=f'other{i}', password='test', is_organisor=False, is_agent=True)
+            Agent.objects.create(user=user, organisation=other)
+        LeadRouting.objects.create(organisation=other, strategy=LeadRouting.LEAST_LOADED)
+        for i in range(6):
+            Lead.objects.create(first_name='Lead', last_name='Test', organisation=other, phone_number='1', email='a@test.com')
+        with self.assertNumQueries(len(queries)):
+            call_command('route_unassigned', organisation=other.id, batch_size=10, stdout=StringIO())
+        self.assertFalse(Lead.objects.filter(agent__isnull=True).exists())
+
+    def counted_loads(self):
+        # the loads from the leads table
+        with override_settings(LEADS_USE_CATEGORY_COUNTERS=False):
+            return dict(LeadRouter.load_rows(self.organisation.id))
+
+    @override_settings(LEADS_USE_CATEGORY_COUNTERS=True)
+    def test_agent_load_counters_follow_the_leads(self):
+        converted = Category.objects.create(name='Converted', organisation=self.organisation)
+        lead = self.create_lead(self.agents[0])
+        self.create_lead(self.agents[0])
+        self.create_lead(self.agents[1], category=converted)
+        lead.agent = self.agents[2]
+        lead.save()
+        bulk_assign(self.organisation, self.agents[1], lead_ids=[self.create_lead().id])
+        self.create_lead(self.agents[0]).delete()
+        self.assertEqual(dict(LeadRouter.load_rows(self.organisation.id)), self.counted_loads())
+        self.assertEqual(self.counted_loads(), {self.agents[0].id: 1, self.agents[1].id: 1, self.agents[2].id: 1})
+        # the converted lead is open again
+        converted.delete()
+        self.assertEqual(dict(LeadRouter.load_rows(self.organisation.id)), self.counted_loads())
+
+        AgentLeadCount.objects.update(count=42)
+        call_command('rebuild_category_counts', stdout=StringIO())
+        self.assertEqual(dict(LeadRouter.load_rows(self.organisation.id)), self.counted_loads())
+
+    @override_settings(LEADS_USE_CATEGORY_COUNTERS=True)
+    def test_create_view_routes_without_counting_the_leads(self):
+        self.routing.strategy = LeadRouting.LEAST_LOADED
+        self.routing.save()
+        self.create_lead(self.agents[0])
+        self.create_lead(self.agents[1])
+        self.client.force_login(self.organisor)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(reverse('leads:lead-create'), {
+                'first_name': 'Lead', 'last_name': 'New', 'age': 1, 'phone_number': '9', 'email': 'new@test.com'
+            })
+        self.assertEqual(Lead.objects.get(last_name='New').agent, self.agents[2])
+        self.assertFalse([query['sql'] for query in queries if 'COUNT("leads_lead"' in query['sql']])
+
+    def test_create_view_locks_the_routing_row(self):
+        self.routing.strategy = LeadRouting.ROUND_ROBIN
+        self.routing.save()
+        self.client.force_login(self.organisor)
+        with mock.patch.object(LeadRouting.objects, 'select_for_update', wraps=LeadRouting.objects.select_for_update) as lock:
+            self.client.post(reverse('leads:lead-create'), {
+                'first_name': 'Lead', 'last_name': 'New', 'age': 1, 'phone_number': '9', 'email': 'new@test.com'
+            })
+        lock.assert_called_once()
+        self.assertEqual(Lead.objects.get(last_name='New').agent, self.agents[0])
+
+    def test_one_lead_reads_only_the_loads_of_its_pool(self):
+        self.routing.strategy = LeadRouting.CATEGORY_POOL
+        self.routing.save()
+        category = Category.objects.create(name='New', organisation=self.organisation)
+        category.routing_agents.add(self.agents[1], self.agents[2])
+        self.create_lead(self.agents[1], category)
+        lead = Lead(organisation=self.organisation, category=category)
+        with mock.patch.object(LeadRouter, 'load_rows', wraps=LeadRouter.load_rows) as load_rows:
+            LeadRouter.for_lead(lead).assign([lead])
+        load_rows.assert_called_once_with(self.organisation.id, [self.agents[1].id, self.agents[2].id])
+        self.assertEqual(lead.agent_id, self.agents[2].id)
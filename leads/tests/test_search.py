@@ -0,0 +1,59 @@
+from django.test import TestCase
+from django.urls import reverse
+from leads.models import User, Agent, Lead
+from leads.search import search_leads, _search_postgresql
+
+
+class LeadSearchTest(TestCase):
+
+    def setUp(self):
+        self.organisor = User.objects.create_user(username='organisor', password='test')
+        organisation = self.organisor.userprofile
+        agent_user = User.objects.create_user(username='agent', password='test', is_organisor=False, is_agent=True)
+        agent = Agent.objects.create(user=agent_user, organisation=organisation)
+        self.ana = Lead.objects.create(first_name='Ana', last_name='Novak', organisation=organisation, agent=agent,
+                                       phone_number='+38641555123', email='ana.novak@example.com')
+        self.bor = Lead.objects.create(first_name='Bor', last_name='Kos', organisation=organisation,
+                                       phone_number='031999888', email='bor@test.com', description='Wants a call in May')
+        other = User.objects.create_user(username='other', password='test')
+        Lead.objects.create(first_name='Ana', last_name='Novak', organisation=other.userprofile,
+                            phone_number='1', email='ana@other.com')
+
+    def search(self, query):
+        return set(search_leads(Lead.objects.all(), query).values_list('id', flat=True))
+
+    def test_matches_names_email_phone_and_description(self):
+        self.assertEqual(self.search('novak'), {self.ana.id, Lead.objects.get(email='ana@other.com').id})
+        self.assertEqual(self.search('example.com'), {self.ana.id})
+        self.assertEqual(self.search('555'), {self.ana.id})
+        self.assertEqual(self.search('call may'), {self.bor.id})
+        self.assertEqual(self.search('Bo'), {self.bor.id})
+
+    def test_index_follows_updates_and_deletes(self):
+        self.bor.last_name = 'Zupan'
+        self.bor.save()
+        self.assertEqual(self.search('zupan'), {self.bor.id})
+        self.bor.delete()
+        self.assertEqual(self.search('zupan'), set())
+
+    def test_wildcards_are_matched_literally(self):
+        self.assertEqual(self.search('%'), set())
+        self.assertEqual(self.search('_'), set())
+        self.assertEqual(self.search('a%k'), set())
+        self.bor.description = 'Discount 100%'
+        self.bor.save()
+        self.assertEqual(self.search('100%'), {self.bor.id})
+
+    def test_postgresql_condition_follows_the_table_alias(self):
+        # only the SQL is built here, the tests run on SQLite
+        searched = _search_postgresql(Lead.objects.all(), 'a_b%', ['a_b%'])
+        sql = str(Lead.objects.filter(id__in=searched.values('id')).query)
+        self.assertIn('U0."search_vector" @@', sql)
+        self.assertIn(r'U0."email" ILIKE %a\_b\%%', sql)
+        self.assertNotIn('"leads_lead"."search_vector"', sql)
+
+    def test_lead_list_search_is_scoped_to_organisation(self):
+        self.client.force_login(self.organisor)
+        response = self.client.get(reverse('leads:lead-list'), {'q': 'novak'})
+        self.assertEqual([lead.id for lead in response.context['leads']], [self.ana.id])
+        self.assertEqual(list(response.context['unassigned_leads']), [])
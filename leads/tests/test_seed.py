@@ -0,0 +1,53 @@
+import tracemalloc
+from io import StringIO
+from django.core.management import call_command
+from django.db import connections
+from django.http import HttpResponse
+from django.test import TestCase
+from leads.benchmark import measure
+from leads.models import User, UserProfile, Agent, Lead, Category
+
+
+class SeedCrmTest(TestCase):
+
+    def test_seed_creates_organisations_agents_and_leads(self):
+        call_command('seed_crm', organisations=2, agents=5, leads=120, batch_size=50, seed=1, stdout=StringIO())
+        self.assertEqual(UserProfile.objects.count(), 2)
+        self.assertEqual(Agent.objects.count(), 10)
+        self.assertEqual(Category.objects.count(), 8)
+        self.assertEqual(Lead.objects.count(), 240)
+        # leads are spread over the last year, not all added "now"
+        dates = Lead.objects.values_list('date_added', flat=True)
+        self.assertGreater((max(dates) - min(dates)).days, 30)
+        self.assertTrue(User.objects.filter(is_agent=True).first().check_password('password'))
+
+    def test_benchmark_runs_on_seeded_data(self):
+        call_command('seed_crm', agents=3, leads=50, seed=2, stdout=StringIO())
+        out = StringIO()
+        call_command('benchmark_views', iterations=2, stdout=out)
+        self.assertIn('leads:lead-list', out.getvalue())
+
+
+class FakeClient:
+    # runs one query on the last database and notes if tracemalloc was on during the request
+    def __init__(self):
+        self.tracing = []
+
+    def get(self, url):
+        self.tracing.append(tracemalloc.is_tracing())
+        with connections[list(connections)[-1]].cursor() as cursor:
+            cursor.execute('SELECT 1')
+        return HttpResponse()
+
+
+class MeasureTest(TestCase):
+    databases = '__all__'
+
+    def test_timing_runs_without_tracemalloc_and_queries_of_every_database_are_counted(self):
+        client = FakeClient()
+        results = measure(client, '/', iterations=3)
+        # warm-up, 3 timed requests, 3 requests for the queries and the memory
+        self.assertEqual(client.tracing, [False] * 4 + [True] * 3)
+        self.assertEqual(results['queries'], 1)
+        self.assertGreater(results['peak_memory_kb'], 0)
+        self.assertFalse(tracemalloc.is_tracing())
@@ -0,0 +1,79 @@
+import datetime
+from io import StringIO
+
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from leads.backends import USER_CACHE_KEY
+from leads.models import User, Agent, Lead
+
+
+class CachedUserTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.organisor = User.objects.create_user(username='organisor', password='test')
+        self.organisation = self.organisor.userprofile
+        self.agent_user = User.objects.create_user(username='agent', password='test', is_organisor=False, is_agent=True)
+        self.agent = Agent.objects.create(user=self.agent_user, organisation=self.organisation)
+        self.lead = Lead.objects.create(first_name='Ana', last_name='Novak', organisation=self.organisation,
+                                        agent=self.agent, phone_number='1', email='a@test.com')
+        self.key = USER_CACHE_KEY.format(self.agent_user.pk)
+
+    def test_login_writes_the_snapshot(self):
+        self.client.post(reverse('login'), {'username': 'agent', 'password': 'test'})
+        self.assertEqual(cache.get(self.key).agent.organisation, self.organisation)
+        # session and user from the cache, only the lead is queried
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('leads:lead-detail', args=[self.lead.pk]))
+        self.assertEqual(response.status_code, 200)
+
+    def test_snapshot_is_loaded_again_after_it_was_dropped(self):
+        self.client.force_login(self.agent_user)
+        cache.delete(self.key)
+        # user joined with profile/agent/organisation, the lead
+        with self.assertNumQueries(2):
+            self.client.get(reverse('leads:lead-detail', args=[self.lead.pk]))
+        self.assertIsNotNone(cache.get(self.key))
+
+    def test_changes_drop_the_snapshot(self):
+        self.client.force_login(self.agent_user)
+        self.agent_user.first_name = 'Eva'
+        self.agent_user.save()
+        self.assertIsNone(cache.get(self.key))
+
+        self.client.get(reverse('leads:lead-detail', args=[self.lead.pk]))
+        self.organisation.save()
+        self.assertIsNone(cache.get(self.key))
+
+        self.client.get(reverse('leads:lead-detail', args=[self.lead.pk]))
+        self.agent.delete()
+        self.assertIsNone(cache.get(self.key))
+
+    def test_password_change_logs_out_other_sessions(self):
+        self.client.force_login(self.agent_user)
+        self.agent_user.set_password('new')
+        self.agent_user.save()
+        response = self.client.get(reverse('leads:lead-detail', args=[self.lead.pk]))
+        self.assertEqual(response.status_code, 302)
+
+    def test_logout_drops_the_snapshot(self):
+        self.client.force_login(self.agent_user)
+        self.client.post(reverse('logout'))
+        self.assertIsNone(cache.get(self.key))
+
+
+class SweepSessionsTest(TestCase):
+
+    def test_deletes_only_expired_sessions(self):
+        now = timezone.now()
+        for i in range(5):
+            Session.objects.create(session_key=f'old{i}', session_data='', expire_date=now - datetime.timedelta(days=1))
+        Session.objects.create(session_key='new', session_data='', expire_date=now + datetime.timedelta(days=1))
+        out = StringIO()
+        call_command('sweep_sessions', batch_size=2, stdout=out)
+        self.assertIn('Deleted 5 expired sessions', out.getvalue())
+        self.assertEqual(list(Session.objects.values_list('session_key', flat=True)), ['new'])
@@ -0,0 +1,196 @@
+import time
+import unittest
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from leads.deletion import delete_later
+from leads.jobs import run_available_jobs
+from leads.models import User, UserProfile, Agent, Lead, Category, OrganisationShard, Job, LeadRouting
+from leads.routers import TenantShardRouter
+from leads.management.commands.move_tenant import Command as MoveTenantCommand
+from leads.sharding import organisation_shard, use_shard, shard_id_range
+
+
+class TenantShardRouterTest(SimpleTestCase):
+
+    def setUp(self):
+        self.router = TenantShardRouter()
+
+    def test_tenant_models_go_to_the_current_shard(self):
+        with use_shard('shard1'):
+            self.assertEqual(self.router.db_for_read(Lead), 'shard1')
+            self.assertEqual(self.router.db_for_write(Category), 'shard1')
+            # users and agents stay in default (the next router decides)
+            self.assertIsNone(self.router.db_for_read(User))
+            self.assertIsNone(self.router.db_for_read(Agent))
+        self.assertIsNone(self.router.db_for_read(Lead))
+
+    def test_related_rows_come_from_the_shard_of_the_instance(self):
+        category = Category(name='New')
+        category._state.db = 'shard2'
+        with use_shard('shard1'):
+            self.assertEqual(self.router.db_for_read(Lead, instance=category), 'shard2')
+
+    def test_directory_is_only_in_default(self):
+        self.assertFalse(self.router.allow_migrate('shard1', 'leads', 'organisationshard'))
+        self.assertTrue(self.router.allow_migrate('default', 'leads', 'organisationshard'))
+        self.assertIsNone(self.router.allow_migrate('shard1', 'leads', 'lead'))
+
+
+@override_settings(DATABASE_SHARDS=['default', 'shard1'])
+class TenantDirectoryTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.organisor = User.objects.create_user(username='organisor', password='test')
+        self.organisation = self.organisor.userprofile
+
+    def test_organisation_without_a_row_is_in_default(self):
+        self.assertEqual(organisation_shard(self.organisation.id), ('default', False))
+
+    def test_directory_changes_are_not_cached(self):
+        organisation_shard(self.organisation.id)
+        OrganisationShard.objects.create(organisation=self.organisation, database='shard1')
+        self.assertEqual(organisation_shard(self.organisation.id), ('shard1', False))
+
+    @override_settings(LEADS_SHARD_DIRECTORY_TIMEOUT=30)
+    def test_directory_changes_of_other_workers_are_seen_after_the_timeout(self):
+        OrganisationShard.objects.create(organisation=self.organisation)
+        organisation_shard(self.organisation.id)
+        # another worker moved it, our cache wasn't told
+        OrganisationShard.objects.filter(organisation=self.organisation).update(database='shard1')
+        self.assertEqual(organisation_shard(self.organisation.id), ('default', False))
+        with mock.patch('django.core.cache.backends.locmem.time.time', return_value=time.time() + 31):
+            self.assertEqual(organisation_shard(self.organisation.id), ('shard1', False))
+
+    def test_jobs_wait_while_the_organisation_is_moving(self):
+        category = Category.objects.create(name='Old', organisation=self.organisation)
+        delete_later(category)
+        shard = OrganisationShard.objects.create(organisation=self.organisation, moving=True)
+        self.assertEqual(run_available_jobs(), 1)
+        job = Job.objects.get()
+        # put back without using up an attempt
+        self.assertEqual((job.status, job.attempts), (Job.QUEUED, 0))
+        self.assertGreater(job.run_at, timezone.now())
+        self.assertTrue(Category.objects.filter(id=category.id).exists())
+
+        shard.moving = False
+        shard.save()
+        Job.objects.update(run_at=timezone.now())
+        run_available_jobs()
+        self.assertFalse(Category.objects.filter(id=category.id).exists())
+
+    def test_commands_skip_a_moving_organisation(self):
+        agent_user = User.objects.create_user(username='agent', password='test', is_organisor=False, is_agent=True)
+        Agent.objects.create(user=agent_user, organisation=self.organisation)
+        LeadRouting.objects.create(organisation=self.organisation, strategy=LeadRouting.ROUND_ROBIN)
+        lead = Lead.objects.create(first_name='Lead', last_name='Test', organisation=self.organisation, phone_number='1', email='a@test.com')
+        OrganisationShard.objects.create(organisation=self.organisation, moving=True)
+        out = StringIO()
+        call_command('route_unassigned', stdout=out)
+        self.assertIn('skipped', out.getvalue())
+        lead.refresh_from_db()
+        self.assertIsNone(lead.agent)
+
+    def test_organisation_is_read_only_while_moving(self):
+        # still in default, so the requests can run here
+        OrganisationShard.objects.create(organisation=self.organisation, moving=True)
+        self.client.force_login(self.organisor)
+        self.assertEqual(self.client.get(reverse('leads:lead-list')).status_code, 200)
+        response = self.client.post(reverse('leads:lead-create'), {'first_name': 'Ana'})
+        self.assertEqual(response.status_code, 503)
+
+
+# Needs a second database, e.g. DB_SHARD_URLS=shard1=sqlite:////tmp/shard1.sqlite3
+@unittest.skipUnless(len(settings.DATABASE_SHARDS) > 1, 'no second shard configured')
+class MoveTenantTest(TransactionTestCase):
+    databases = '__all__'
+
+    def test_move_tenant(self):
+        cache.clear()
+        target = settings.DATABASE_SHARDS[1]
+        organisor = User.objects.create_user(username='organisor', password='test')
+        organisation = organisor.userprofile
+        agent_user = User.objects.create_user(username='agent', password='test', is_organisor=False, is_agent=True)
+        agent = Agent.objects.create(user=agent_user, organisation=organisation)
+        category = Category.objects.create(name='New', organisation=organisation)
+        for i in range(5):
+            Lead.objects.create(first_name=f'Lead{i}', last_name='Test', organisation=organisation, agent=agent,
+                                category=category, phone_number='1', email='a@test.com')
+
+        call_command('move_tenant', organisation.id, target, wait=0, batch_size=2, stdout=open('/dev/null', 'w'))
+
+        self.assertEqual(organisation_shard(organisation.id), (target, False))
+        self.assertEqual(Lead.objects.using(target).filter(organisation=organisation, agent=agent).count(), 5)
+        self.assertFalse(Lead.objects.using('default').filter(organisation=organisation).exists())
+        # the requests of the organisation now read from the new shard
+        self.client.force_login(organisor)
+        response = self.client.get(reverse('leads:lead-list'))
+        self.assertContains(response, 'Lead4')
+
+    def move(self, organisation, database, **options):
+        call_command('move_tenant', organisation.id, database, wait=0, stdout=open('/dev/null', 'w'), **options)
+
+    def test_moved_rows_keep_their_ids_and_new_rows_get_the_range_of_the_shard(self):
+        cache.clear()
+        target = settings.DATABASE_SHARDS[1]
+        organisation = User.objects.create_user(username='organisor', password='test').userprofile
+        lead = Lead.objects.create(first_name='Old', last_name='Test', organisation=organisation, phone_number='1', email='a@test.com')
+        self.move(organisation, target, keep_source=True)
+
+        with use_shard(target):
+            new = Lead.objects.create(first_name='New', last_name='Test', organisation=organisation, phone_number='1', email='b@test.com')
+        start, end = shard_id_range(target)
+        self.assertTrue(start <= new.id < end)
+        self.assertEqual(Lead.objects.using(target).get(id=lead.id).first_name, 'Old')
+        # and back: the rows that were kept in default are replaced by the copies
+        self.move(organisation, 'default')
+        self.assertEqual(
+            dict(Lead.objects.using('default').filter(organisation=organisation).values_list('id', 'first_name')),
+            {lead.id: 'Old', new.id: 'New'}
+        )
+
+    def test_failed_copy_leaves_nothing_in_the_target(self):
+        cache.clear()
+        target = settings.DATABASE_SHARDS[1]
+        organisation = User.objects.create_user(username='organisor', password='test').userprofile
+        Category.objects.create(name='New', organisation=organisation)
+        Lead.objects.create(first_name='Lead', last_name='Test', organisation=organisation, phone_number='1', email='a@test.com')
+        copy_rows = MoveTenantCommand.copy_rows
+
+        def fail_at_the_leads(command, model, *args):
+            if model is Lead:
+                raise RuntimeError('connection lost')
+            return copy_rows(command, model, *args)
+
+        with mock.patch.object(MoveTenantCommand, 'copy_rows', fail_at_the_leads), self.assertRaises(RuntimeError):
+            self.move(organisation, target)
+        self.assertFalse(Category.objects.using(target).exists())
+        self.assertEqual(organisation_shard(organisation.id), ('default', False))
+        # the next attempt starts from scratch
+        self.move(organisation, target)
+        self.assertEqual(Category.objects.using(target).filter(organisation=organisation).count(), 1)
+        self.assertEqual(Lead.objects.using(target).filter(organisation=organisation).count(), 1)
+
+    def test_delete_organisation_in_a_shard(self):
+        cache.clear()
+        target = settings.DATABASE_SHARDS[1]
+        organisor = User.objects.create_user(username='organisor', password='test')
+        organisation = organisor.userprofile
+        category = Category.objects.create(name='New', organisation=organisation)
+        Lead.objects.create(first_name='Lead', last_name='Test', organisation=organisation, category=category,
+                            phone_number='1', email='a@test.com')
+        call_command('move_tenant', organisation.id, target, wait=0, stdout=open('/dev/null', 'w'))
+
+        call_command('delete_organisation', organisation.id, stdout=open('/dev/null', 'w'))
+        run_available_jobs()
+        for database in ('default', target):
+            self.assertFalse(Lead.objects.using(database).exists())
+            self.assertFalse(Category.objects.using(database).exists())
+            self.assertFalse(UserProfile.objects.using(database).exists())
@@ -1,18 +1,34 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
 app_name = "leads"
 
+
+def read_view(sync_view, async_view):
+    # Under ASGI (settings.LEADS_ASYNC_VIEWS) the read-heavy pages use their async version
+    return (async_view if settings.LEADS_ASYNC_VIEWS else sync_view).as_view()
+
+
 urlpatterns = [
     # path('', views.lead_list, name='lead-list'),
-    path('', views.LeadListView.as_view(), name='lead-list'),
-    path('<int:pk>/', views.LeadDetailView.as_view(), name='lead-detail'),
+    path('', read_view(views.LeadListView, views.AsyncLeadListView), name='lead-list'),
+    path('export/', views.LeadExportView.as_view(), name='lead-export'),
+    path('<int:pk>/', read_view(views.LeadDetailView, views.AsyncLeadDetailView), name='lead-detail'),
     path('<int:pk>/update/', views.LeadUpdateView.as_view(), name='lead-update'),
     path('<int:pk>/delete/', views.LeadDeleteView.as_view(), name='lead-delete'),
     path('<int:pk>/assign-agent/', views.AssignAgentView.as_view(), name='assign-agent'),
     path('<int:pk>/category/', views.LeadCategoryUpdateView.as_view(), name='lead-category-update'),
+    path('<int:pk>/history/', views.LeadHistoryView.as_view(), name='lead-history'),
     path('create/', views.LeadCreateView.as_view(), name='lead-create'),
+    path('assign-agent/', views.BulkAssignAgentView.as_view(), name='bulk-assign-agent'),
+    path('import/', views.LeadImportView.as_view(), name='lead-import'),
+    path('routing/', views.LeadRoutingUpdateView.as_view(), name='lead-routing'),
+    path('archive-policy/', views.ArchivePolicyUpdateView.as_view(), name='archive-policy'),
+    path('report/', views.LeadReportView.as_view(), name='lead-report'),
+    path('autocomplete/agents/', views.AgentAutocompleteView.as_view(), name='agent-autocomplete'),
+    path('autocomplete/categories/', views.CategoryAutocompleteView.as_view(), name='category-autocomplete'),
 
-    path('categories/', views.CategoryListView.as_view(), name='category-list'),
-    path('categories/<int:pk>/', views.CategoryDetailView.as_view(), name='category-detail'),
+    path('categories/', read_view(views.CategoryListView, views.AsyncCategoryListView), name='category-list'),
+    path('categories/<int:pk>/', read_view(views.CategoryDetailView, views.AsyncCategoryDetailView), name='category-detail'),
 ]
\ No newline at end of file
@@ -1,9 +1,32 @@
-from django.shortcuts import render, redirect
+import math
+import asyncio
+from asgiref.sync import sync_to_async
+from django.shortcuts import render, redirect, get_object_or_404, aget_object_or_404
+from django.contrib import messages
+from django.core.exceptions import PermissionDenied
+from django.http import StreamingHttpResponse, HttpResponseBadRequest, Http404, JsonResponse
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.db import router as db_router, transaction
+from django.db.models import Q
 from django.urls import reverse_lazy, reverse
-from .models import Lead, Agent, Category
-from .forms import LeadModelForm, CustomUserCreationForm, AssignAgentForm, LeadCategoryUpdateForm
-from agents.mixins import OrganisorAndLoginRequiredMixin
+from .models import Lead, Agent, Category, LeadRouting, ArchivePolicy, LeadImport
+from .forms import (
+    LeadModelForm, CustomUserCreationForm, AssignAgentForm, BulkAssignAgentForm, LeadCategoryUpdateForm, LeadImportForm,
+    LeadRoutingForm, ArchivePolicyForm, LeadReportForm
+)
+from .assignment import bulk_assign
+from .routing import LeadRouter
+from .search import search_leads
+from .imports import guess_format, get_or_resume_import, file_hash, start_import
+from .counts import category_lead_counts, acategory_lead_counts
+from .exports import LeadExportFilterForm, filter_leads, export_rows
+from .pagination import KeysetPaginationMixin, keyset_paginate
+from .cache import has_fragment
+from .conditional import ConditionalGetMixin
+from .deletion import delete_later
+from .rollup import LeadIntakeReport
+from .activity import lead_timeline
+from agents.mixins import OrganisorAndLoginRequiredMixin, OrganisationMixin, AsyncLoginRequiredMixin
 from django.views import generic
 
 class SignUpView(generic.CreateView):
@@ -14,71 +37,180 @@ class SignUpView(generic.CreateView):
 class LandingPageView(generic.TemplateView):
     template_name = 'landing.html'
 
-class LeadListView(LoginRequiredMixin, generic.ListView): # LoginRequiredMixin allows ony authenticated user
+class LeadListView(LoginRequiredMixin, OrganisationMixin, ConditionalGetMixin, KeysetPaginationMixin, generic.ListView): # LoginRequiredMixin allows ony authenticated user
     template_name = 'leads/lead_list.html'
     context_object_name = 'leads'
 
     def get_queryset(self):
-        user = self.request.user
-        if user.is_organisor:
-            queryset = Lead.objects.filter(
-                organisation=user.userprofile,
-                agent__isnull=False
-                )
-        else:
-            queryset = Lead.objects.filter(
-                organisation=user.agent.organisation,
-                agent__isnull=False
-                )
-            queryset = queryset.filter(agent__user=user)
-        return queryset
+        queryset = self.get_lead_queryset().filter(agent__isnull=False)
+        return search_leads(queryset, self.get_search_query())
+
+    def get_search_query(self):
+        return self.request.GET.get('q', '')
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         user = self.request.user
+        context['search_query'] = self.get_search_query()
+        context['fragment_vary_on'] = self.get_fragment_vary_on()
         if user.is_organisor:
-            queryset = Lead.objects.filter(
-                organisation=user.userprofile, 
+            queryset = self.get_lead_queryset().filter(
                 agent__isnull=True
                 ) # filter all leads from one organisation that don't have its own agent
+            queryset = search_leads(queryset, self.get_search_query())
+            # unassigned leads have their own cursor, so both lists can be paged independently.
+            # The pages are lazy: when the template serves the lists from the cache they are never queried.
+            unassigned_page = keyset_paginate(
+                queryset,
+                self.get_cursor('unassigned_cursor'),
+                self.get_paginate_by(queryset),
+                self.get_ordering()
+            )
             context.update({
-                'unassigned_leads': queryset
+                'unassigned_leads': unassigned_page,
+                'unassigned_page_obj': unassigned_page,
+                'bulk_assign_form': BulkAssignAgentForm(request=self.request)
             })
         return context
 
-class LeadDetailView(LoginRequiredMixin, generic.DetailView):
+    def get_fragment_vary_on(self):
+        # Everything the cached fragments of the template ({% orgcache %}) depend on, besides the organisation
+        request = self.request
+        # the page links of a fragment keep the query string, so the cursor of the other list as well
+        cursors = [self.get_cursor(), self.get_cursor('unassigned_cursor')]
+        return {
+            'lead_cards': [request.user.is_organisor, getattr(request.agent, 'id', None),
+                           self.get_search_query(), *cursors],
+            'unassigned_leads': [self.get_search_query(), *cursors],
+        }
+
+class LeadExportView(LoginRequiredMixin, OrganisationMixin, generic.View):
+    # Same scoping as the lead list: the organisor exports the whole organisation, an agent only their own leads
+
+    def get_queryset(self):
+        return self.get_lead_queryset()
+
+    def get(self, request, *args, **kwargs):
+        form = LeadExportFilterForm(request.GET)
+        if not form.is_valid():
+            return HttpResponseBadRequest(form.errors.as_text())
+        file_format = form.cleaned_data['format'] or 'csv'
+        queryset = filter_leads(self.get_queryset(), **form.cleaned_data)
+        # the rows are read after the middleware finished, so we fix the database (shard) now
+        queryset = queryset.using(queryset.db)
+        archived = None
+        if form.cleaned_data['archived']:
+            archived = filter_leads(self.get_archived_lead_queryset(), **form.cleaned_data)
+            archived = archived.using(archived.db)
+        # The rows are sent while they are read from the database, the first byte goes out immediately
+        response = StreamingHttpResponse(
+            export_rows(queryset, file_format, archived=archived),
+            content_type='application/x-ndjson' if file_format == 'jsonl' else 'text/csv'
+        )
+        response['Content-Disposition'] = f'attachment; filename="leads.{file_format}"'
+        return response
+
+
+class LeadDetailView(LoginRequiredMixin, OrganisationMixin, ConditionalGetMixin, generic.DetailView):
     template_name = 'leads/lead_detail.html'
     context_object_name = 'lead'
     lookup_field = 'id'   
 
     def get_queryset(self):
-        user = self.request.user
-        if user.is_organisor:
-            queryset = Lead.objects.filter(organisation=user.userprofile)
-        else:
-            queryset = Lead.objects.filter(organisation=user.agent.organisation)
-            queryset = queryset.filter(agent__user=user)
-        return queryset
+        return self.get_lead_queryset()
+
+    def get_object(self, queryset=None):
+        if getattr(self, 'object', None) is not None: # loaded for the ETag
+            return self.object
+        try:
+            return super().get_object(queryset)
+        except Http404:
+            # an archived lead keeps its id, so old links still work
+            return super().get_object(self.get_archived_lead_queryset())
+
+    def get_updated(self):
+        # The page only shows the lead, so its ETag follows the lead instead of the organisation
+        self.object = self.get_object()
+        return self.object.date_archived if self.object.is_archived else self.object.updated_at
+
+    def get_version(self):
+        return self.get_updated().isoformat()
+
+    def get_last_modified(self):
+        return math.ceil(self.get_updated().timestamp())
 
 
-class LeadCreateView(OrganisorAndLoginRequiredMixin, generic.CreateView):
+class LeadHistoryView(LoginRequiredMixin, OrganisationMixin, generic.DetailView):
+    # Who changed what and when (leads/activity.py)
+    template_name = 'leads/lead_history.html'
+    context_object_name = 'lead'
+
+    def get_queryset(self):
+        return self.get_lead_queryset()
+
+    def get_object(self, queryset=None):
+        try:
+            return super().get_object(queryset)
+        except Http404:
+            return super().get_object(self.get_archived_lead_queryset())
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['activities'] = lead_timeline(self.object)
+        return context
+
+
+class LeadCreateView(OrganisorAndLoginRequiredMixin, OrganisationMixin, generic.CreateView):
     template_name = 'leads/lead_create.html'
     form_class = LeadModelForm
     success_url = reverse_lazy('leads:lead-list')
 
     def get_queryset(self):
-        user = self.request.user
-        if user.is_organisor:
-            queryset = Lead.objects.filter(organisation=user.userprofile)
-        else:
-            queryset = Lead.objects.filter(organisation=user.agent.organisation)
-            queryset = queryset.filter(agent__user=user)
-        return queryset
+        return self.get_lead_queryset()
+
+    def get_form_kwargs(self):
+        # the form checks for duplicates inside the organisation of the lead
+        kwargs = super().get_form_kwargs()
+        kwargs['instance'] = Lead(organisation=self.request.organisation)
+        return kwargs
     
     def form_valid(self, form):
         lead = form.save(commit=False)
-        lead.organisation = self.request.user.userprofile
-        lead.save()
+        lead.organisation = self.request.organisation
+        with transaction.atomic(using=db_router.db_for_write(Lead)):
+            # Without an agent from the form, the routing of the organisation (if any) picks one.
+            # The routing row stays locked until the lead is saved.
+            if lead.agent_id is None:
+                router = LeadRouter.for_lead(lead)
+                if router:
+                    router.assign([lead])
+                    router.save()
+            # super().form_valid() saves the form (= this lead) and redirects
+            return super().form_valid(form)
+
+
+class LeadImportView(OrganisorAndLoginRequiredMixin, generic.FormView):
+    template_name = 'leads/lead_import.html'
+    form_class = LeadImportForm
+
+    success_url = reverse_lazy('leads:lead-import')
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # the progress of the latest imports, a worker runs them (run_lead_import)
+        context['lead_imports'] = LeadImport.objects.filter(
+            organisation=self.request.organisation
+        ).order_by('-id')[:5]
+        return context
+
+    def form_valid(self, form):
+        uploaded = form.cleaned_data['file']
+        lead_import = get_or_resume_import(self.request.organisation, uploaded.name, uploaded.size, file_hash(uploaded))
+        if not lead_import.file:
+            # the worker reads the file from the storage, the upload is gone after the request
+            lead_import.file.save(uploaded.name, uploaded)
+        start_import(lead_import, form.cleaned_data['format'] or guess_format(uploaded.name))
+        messages.info(self.request, f'Importing {uploaded.name}, reload the page to see the progress.')
         return super().form_valid(form)
 
 
@@ -105,26 +237,16 @@ def lead_create(request):
 
 # Even though Django's UpdateView retrieves an object using the pk in the URL, 
 # we must still define the queryset to control which objects the user is allowed to update.
-class LeadUpdateView(OrganisorAndLoginRequiredMixin, generic.UpdateView):
+class LeadUpdateView(OrganisorAndLoginRequiredMixin, OrganisationMixin, generic.UpdateView):
     template_name = 'leads/lead_update.html'
     form_class = LeadModelForm
     success_url = reverse_lazy('leads:lead-list')
 
     def get_queryset(self):
-        user = self.request.user
-        queryset = Lead.objects.filter(organisation=user.userprofile)
-        return queryset
+        return self.get_lead_queryset()
 
-    # Pre-fill the form with already existing data. 'self.object' refers to an instance.
-    def get_form_kwargs(self):  
-        kwargs = super().get_form_kwargs()
-        kwargs['initial'] = {
-            'first_name': self.object.first_name,
-            'last_name': self.object.last_name,
-            'age': self.object.age,
-            'agent': self.object.agent
-        }
-        return kwargs
+    # The ModelForm pre-fills itself from the instance ('self.object'), we don't need to pass initial data.
+    # (Passing 'agent': self.object.agent cost an extra query for the agent.)
 # def lead_update(request, pk):
 #     lead = Lead.objects.get(id=pk)
 #     form = LeadModelForm(instance=lead)
@@ -137,22 +259,20 @@ class LeadUpdateView(OrganisorAndLoginRequiredMixin, generic.UpdateView):
 #     context = {"form": form, "lead": lead}
 #     return render (request, "leads/lead_update.html", context)
 
-class LeadDeleteView(OrganisorAndLoginRequiredMixin, generic.DeleteView):
+class LeadDeleteView(OrganisorAndLoginRequiredMixin, OrganisationMixin, generic.DeleteView):
     template_name = 'leads/lead_delete.html'
     success_url = reverse_lazy('leads:lead-list')
     context_object_name = 'lead'
 
     def get_queryset(self):
-        user = self.request.user
-        queryset = Lead.objects.filter(organisation=user.userprofile)
-        return queryset
+        return self.get_lead_queryset()
 
 def lead_delete(request, pk):
     lead = Lead.objects.get(od=pk)
     lead.delete()
     return 
 
-class AssignAgentView(OrganisorAndLoginRequiredMixin, generic.FormView):
+class AssignAgentView(OrganisorAndLoginRequiredMixin, OrganisationMixin, generic.FormView):
     template_name = "leads/assign_agent.html"
     form_class = AssignAgentForm
     success_url = reverse_lazy('leads:lead-list')
@@ -166,94 +286,249 @@ class AssignAgentView(OrganisorAndLoginRequiredMixin, generic.FormView):
 
     def form_valid(self, form):
         agent = form.cleaned_data["agent"]
-        lead = Lead.objects.get(id=self.kwargs["pk"]) # extracting from url
+        # the lead must belong to the organisation of the organisor
+        lead = get_object_or_404(self.get_lead_queryset(), id=self.kwargs["pk"]) # extracting from url
         lead.agent = agent
-        lead.save()
+        lead.save(update_fields=['agent'])
         return super(AssignAgentView, self).form_valid(form)
+
+
+class BulkAssignAgentView(OrganisorAndLoginRequiredMixin, generic.FormView):
+    # The form is shown in the 'Unassigned leads' section of the lead list, so we only accept POST
+    form_class = BulkAssignAgentForm
+    success_url = reverse_lazy('leads:lead-list')
+    http_method_names = ['post']
+
+    def get_form_kwargs(self, **kwargs):
+        kwargs = super().get_form_kwargs()
+        kwargs.update({
+            "request": self.request
+        })
+        return kwargs
+
+    def form_valid(self, form):
+        agent = form.cleaned_data["agent"]
+        lead_ids = form.cleaned_data["leads"]
+        updated = bulk_assign(
+            self.request.organisation,
+            agent,
+            lead_ids=lead_ids,
+            select_all=form.cleaned_data["select_all"],
+            category=form.cleaned_data["category"]
+        )
+        messages.success(self.request, f'{updated} leads assigned to {agent}.')
+        if not form.cleaned_data["select_all"] and updated < len(lead_ids):
+            messages.warning(self.request, f'{len(lead_ids) - updated} leads were not found in your organisation.')
+        return super().form_valid(form)
+
+    def form_invalid(self, form):
+        for errors in form.errors.values():
+            for error in errors:
+                messages.error(self.request, error)
+        return redirect(self.success_url)
     
-class CategoryListView(LoginRequiredMixin ,generic.ListView):
+class LeadRoutingUpdateView(OrganisorAndLoginRequiredMixin, generic.UpdateView):
+    template_name = 'leads/lead_routing.html'
+    form_class = LeadRoutingForm
+    success_url = reverse_lazy('leads:lead-list')
+
+    def get_object(self, queryset=None):
+        # not saved until the form is submitted, so opening the page doesn't write anything
+        routing = LeadRouting.objects.filter(organisation=self.request.organisation).first()
+        return routing or LeadRouting(organisation=self.request.organisation)
+
+
+class ArchivePolicyUpdateView(OrganisorAndLoginRequiredMixin, generic.UpdateView):
+    template_name = 'leads/archive_policy.html'
+    form_class = ArchivePolicyForm
+    success_url = reverse_lazy('leads:lead-list')
+
+    def get_object(self, queryset=None):
+        policy = ArchivePolicy.objects.filter(organisation=self.request.organisation).first()
+        return policy or ArchivePolicy(organisation=self.request.organisation)
+
+
+class LeadReportView(OrganisorAndLoginRequiredMixin, OrganisationMixin, generic.TemplateView):
+    # Leads added per day or week, from the daily rollup (see leads/rollup.py)
+    template_name = 'leads/lead_report.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        form = LeadReportForm(self.request.GET)
+        context['form'] = form
+        if form.is_valid():
+            context['report'] = LeadIntakeReport(self.get_organisation(), **form.cleaned_data).build()
+        return context
+
+
+AUTOCOMPLETE_RESULTS = 20
+
+
+class AgentAutocompleteView(OrganisorAndLoginRequiredMixin, OrganisationMixin, generic.View):
+    # JSON for the agent pickers of big organisations (AutocompleteSelect in forms.py), ?q=<start of the username or email>
+    def get(self, request, *args, **kwargs):
+        q = request.GET.get('q', '').strip()
+        agents = self.get_agent_queryset().select_related('user').order_by('user__username')
+        if q:
+            # prefix matches, so the indexes on username and email can be used
+            agents = agents.filter(Q(user__username__startswith=q) | Q(user__email__startswith=q.lower()))
+        results = [{'id': agent.id, 'text': str(agent)} for agent in agents[:AUTOCOMPLETE_RESULTS]]
+        return JsonResponse({'results': results})
+
+
+class CategoryAutocompleteView(LoginRequiredMixin, OrganisationMixin, generic.View):
+    # the same for the categories, agents can change the category of their leads
+    def get(self, request, *args, **kwargs):
+        q = request.GET.get('q', '').strip()
+        categories = self.get_category_queryset().order_by('name')
+        if q:
+            # (organisation, name) index, 'con' finds 'Contacted'
+            categories = categories.filter(name__istartswith=q)
+        results = [{'id': category.id, 'text': str(category)} for category in categories[:AUTOCOMPLETE_RESULTS]]
+        return JsonResponse({'results': results})
+
+
+class CategoryListView(LoginRequiredMixin, OrganisationMixin, ConditionalGetMixin, generic.ListView):
     template_name = 'leads/category_list.html'
     context_object_name = 'category_list'
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        user = self.request.user
 
-        if user.is_organisor:
-            queryset = Lead.objects.filter(
-                organisation=user.userprofile
-            )
-        else:
-            queryset = Lead.objects.filter(
-                organisation=user.agent.organisation
-            )
+        counts = self.get_lead_counts()
+        for category in context['category_list']:
+            category.lead_count = counts.get(category.id, 0)
 
         context.update({
-            'unassigned_lead_count': queryset.filter(category__isnull=True).count()
+            'unassigned_lead_count': counts.get(None, 0)
         })
         return context
 
+    def get_lead_counts(self):
+        # all counts (also the 'Unassigned' one) come from a single grouped query
+        return category_lead_counts(self.request.organisation)
+
     def get_queryset(self):
-        user = self.request.user
-        if user.is_organisor:
-            queryset = Category.objects.filter(
-                organisation=user.userprofile
-            )
-        else:
-            queryset = Category.objects.filter(
-                organisation=user.agent.userprofile
-            )
-        return queryset
+        return self.get_category_queryset()
     
-class CategoryDetailView(LoginRequiredMixin, generic.DeleteView):
+class CategoryDetailView(LoginRequiredMixin, OrganisationMixin, ConditionalGetMixin, generic.DeleteView):
     template_name = 'leads/category_detail.html'
     context_object_name = 'category'
+    paginate_by = 20
+    success_url = reverse_lazy('leads:category-list')
 
-    # we can actually call {{ category.leads.all }} instead of doing this context data:
+    # we can actually call {{ category.leads.all }} instead of doing this context data,
+    # but a category can hold a lot of leads, so we page through them with a cursor
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        leads = self.get_object().leads.all()
+        page = self.get_lead_page()
         context.update({
-            'leads':leads
+            'leads': page,
+            'page_obj': page
         })
 
         return context
 
-    def get_queryset(self):
-        user = self.request.user
-        if user.is_organisor:
-            queryset = Category.objects.filter(
-                organisation=user.userprofile
+    def get_lead_page(self):
+        # agents only see their own leads of the category. We filter by the pk from the url,
+        # so the page doesn't have to wait for the category to be loaded (see the async version)
+        if not hasattr(self, 'lead_page'):
+            self.lead_page = keyset_paginate(
+                self.get_lead_queryset().filter(category_id=self.kwargs['pk']),
+                self.request.GET.get('cursor'),
+                self.paginate_by
             )
-        else:
-            queryset = Category.objects.filter(
-                organisation=user.agent.userprofile
-            )
-        return queryset
+        return self.lead_page
+
+    def get_queryset(self):
+        return self.get_category_queryset()
+
+    def form_valid(self, form):
+        if not self.request.user.is_organisor:
+            raise PermissionDenied
+        # the leads of the category are moved to 'Unassigned' by a background job (leads/deletion.py)
+        delete_later(self.object)
+        messages.info(self.request, f'The category {self.object.name} is being deleted.')
+        return redirect(self.success_url)
 
 
-class LeadCategoryUpdateView(LoginRequiredMixin, generic.UpdateView):
+class LeadCategoryUpdateView(LoginRequiredMixin, OrganisationMixin, generic.UpdateView):
     template_name = "leads/lead_category_update.html"
     form_class = LeadCategoryUpdateForm
 
     def get_queryset(self):
-        user = self.request.user
-        # initial queryset of leads for the entire organisation
-        if user.is_organisor:
-            queryset = Lead.objects.filter(organisation=user.userprofile)
-        else:
-            queryset = Lead.objects.filter(organisation=user.agent.organisation)
-            # filter for the agent that is logged in
-            queryset = queryset.filter(agent__user=user)
-        return queryset
+        # leads of the entire organisation, for agents only the leads of the agent that is logged in
+        return self.get_lead_queryset()
     
     def get_success_url(self):
-        return reverse('leads:lead-detail', kwargs={"pk": self.get_object().pk})
+        # self.object is the saved lead, no need to load it again with get_object()
+        return reverse('leads:lead-detail', kwargs={"pk": self.object.pk})
+
+
+# Async versions of the read-heavy views, used under ASGI when settings.LEADS_ASYNC_VIEWS is on
+# (see urls.py). They reuse the sync views for everything except loading the data: the lazy
+# querysets and pages are fetched with the async ORM, the independent ones at the same time
+# with asyncio.gather, before the template is rendered.
+
+class AsyncLeadListView(AsyncLoginRequiredMixin, LeadListView):
+
+    async def get(self, request, *args, **kwargs):
+        self.object_list = self.get_queryset()
+        context = self.get_context_data()
+        pages = {'lead_cards': context['page_obj']}
+        if 'unassigned_page_obj' in context:
+            pages['unassigned_leads'] = context['unassigned_page_obj']
+        # A page whose fragment is cached isn't needed. The others (assigned and unassigned
+        # leads) are independent queries and run at the same time.
+        cached = await asyncio.gather(*(
+            # the template passes the list as one argument: {% orgcache 'lead_cards' fragment_vary_on.lead_cards %}
+            sync_to_async(has_fragment, thread_sensitive=False)(name, request.organisation.id, [context['fragment_vary_on'][name]])
+            for name in pages
+        ))
+        await asyncio.gather(*(page.aload() for page, is_cached in zip(pages.values(), cached) if not is_cached))
+        return self.render_to_response(context)
+
+
+class AsyncLeadDetailView(AsyncLoginRequiredMixin, LeadDetailView):
+
+    async def get(self, request, *args, **kwargs):
+        if getattr(self, 'object', None) is None: # not loaded for the ETag
+            try:
+                self.object = await aget_object_or_404(self.get_queryset(), pk=kwargs['pk'])
+            except Http404:
+                self.object = await aget_object_or_404(self.get_archived_lead_queryset(), pk=kwargs['pk'])
+        return self.render_to_response(self.get_context_data(object=self.object))
+
+
+class AsyncCategoryListView(AsyncLoginRequiredMixin, CategoryListView):
 
+    async def get(self, request, *args, **kwargs):
+        categories, self.lead_counts = await asyncio.gather(
+            self.load_categories(),
+            acategory_lead_counts(request.organisation)
+        )
+        self.object_list = categories
+        return self.render_to_response(self.get_context_data())
 
+    async def load_categories(self):
+        return [category async for category in self.get_queryset()]
 
+    def get_lead_counts(self):
+        return self.lead_counts
 
 
+class AsyncCategoryDetailView(AsyncLoginRequiredMixin, CategoryDetailView):
 
+    async def get(self, request, *args, **kwargs):
+        self.object, _ = await asyncio.gather(
+            aget_object_or_404(self.get_queryset(), pk=kwargs['pk']),
+            self.get_lead_page().aload()
+        )
+        return self.render_to_response(self.get_context_data())
 
+    # A view has to be all sync or all async. Deleting a category is rare, it keeps the sync code.
+    async def post(self, request, *args, **kwargs):
+        return await sync_to_async(super().post)(request, *args, **kwargs)
 
+    async def delete(self, request, *args, **kwargs):
+        return await sync_to_async(super().delete)(request, *args, **kwargs)